@@ -0,0 +1,347 @@
+"""
+HVAC Assistant - Query Benchmarks
+Seeds a scratch database and times hot API queries against it
+
+Usage: python benchmark.py <benchmark> [options]
+Runs against BENCHMARK_DB_NAME (default hvac_benchmark), which is dropped first.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from pathlib import Path
+
+from models import Customer, Technician, TechnicianStatus
+from services import TechnicianSearchService, DispatchService, LocationIngestBuffer
+from search_index import CustomerSearchRegistry
+from route_optimizer import RouteOptimizer, parse_time_window
+from compression import compress_body, supported_encodings
+
+# Load environment variables
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# MongoDB connection (never the application database)
+mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+client = AsyncIOMotorClient(mongo_url)
+db_name = os.environ.get('BENCHMARK_DB_NAME', 'hvac_benchmark')
+db = client[db_name]
+
+FIRST_NAMES = ["Mike", "Sarah", "David", "Jennifer", "Carlos", "Priya", "Tom", "Aisha", "Luis", "Emma",
+               "Noah", "Olivia", "Raj", "Grace", "Omar", "Hannah", "Kevin", "Mei", "Sam", "Zoe"]
+LAST_NAMES = ["Johnson", "Davis", "Wilson", "Brown", "Garcia", "Patel", "Nguyen", "Smith", "Lee", "Martin",
+              "Clark", "Lopez", "Khan", "Walker", "Young", "Hall", "Allen", "King", "Wright", "Scott"]
+SPECIALTIES = ["hvac", "installation", "repair", "maintenance", "diagnostics", "electrical",
+               "plumbing", "commercial", "industrial", "refrigeration", "ductwork", "heat pumps"]
+STREETS = ["Main St", "Oak Ave", "Pine Dr", "Maple Ln", "Cedar Rd", "Elm St", "Lakeview Blvd", "Hillcrest Way"]
+CITIES = ["Springfield", "Riverton", "Fairview", "Greenville", "Madison", "Franklin", "Clinton", "Salem"]
+CERTIFICATIONS = ["EPA 608", "NATE Certified", "R-410A", "Electrical License", "Commercial HVAC", "OSHA 10"]
+
+def report_latencies(label: str, samples_ms: list, target_ms: float):
+    """Print latency percentiles for one query shape"""
+    samples_ms = sorted(samples_ms)
+    p95 = samples_ms[int(len(samples_ms) * 0.95) - 1]
+    status = "✅" if p95 < target_ms else "❌"
+    print(
+        f"{status} {label:<24} p50={statistics.median(samples_ms):6.2f}ms "
+        f"p95={p95:6.2f}ms max={samples_ms[-1]:6.2f}ms (target p95 < {target_ms}ms)"
+    )
+
+async def seed_technicians(count: int, companies: int):
+    """Insert `count` technicians spread evenly across `companies` tenants"""
+    rng = random.Random(42)
+    statuses = [status.value for status in TechnicianStatus]
+    batch = []
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        technician = Technician(
+            company_id=f"company-{i % companies:04d}",
+            name=f"{first} {last}",
+            email=f"{first.lower()}.{last.lower()}{i}@hvactech.com",
+            phone=f"+1555{i:07d}",
+            specialties=rng.sample(SPECIALTIES, 3),
+            certifications=rng.sample(CERTIFICATIONS, 2),
+            status=rng.choice(statuses),
+            current_location={"lat": rng.uniform(41.63, 42.13), "lng": rng.uniform(-87.88, -87.38)}
+        )
+        technician.calculate_search_fields()
+        technician.calculate_location()
+        batch.append(technician.dict())
+        if len(batch) == 5000:
+            await db.technicians.insert_many(batch)
+            batch = []
+    if batch:
+        await db.technicians.insert_many(batch)
+
+async def technician_search(args):
+    """Technician search across many tenants"""
+    count = args.count or 50000
+    await seed_technicians(count, args.companies)
+    for keys, options in TechnicianSearchService.INDEXES:
+        await db.technicians.create_index(keys, **options)
+    print(f"Seeded {count} technicians across {args.companies} companies")
+
+    search_service = TechnicianSearchService(db)
+    rng = random.Random(7)
+    shapes = {
+        "name prefix": lambda: {"q": rng.choice(FIRST_NAMES)[:3]},
+        "two-word prefix": lambda: {"q": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)[:2]}"},
+        "email prefix": lambda: {"q": rng.choice(FIRST_NAMES).lower() + "."},
+        "status filter": lambda: {"status": rng.choice(list(TechnicianStatus)).value},
+        "skill + status": lambda: {"skill": rng.choice(SPECIALTIES), "status": TechnicianStatus.AVAILABLE.value},
+        "no filter": lambda: {},
+    }
+
+    for label, make_params in shapes.items():
+        samples = []
+        for _ in range(args.iterations):
+            company_id = f"company-{rng.randrange(args.companies):04d}"
+            started = time.perf_counter()
+            page = await search_service.search(company_id, limit=20, **make_params())
+            if page["next_cursor"]:
+                await search_service.search(company_id, limit=20, cursor=page["next_cursor"], **make_params())
+            samples.append((time.perf_counter() - started) * 1000)
+        report_latencies(label, samples, args.target_ms or 10.0)
+
+async def seed_customers(count: int, company_id: str):
+    """Insert `count` customers for one company"""
+    rng = random.Random(42)
+    batch = []
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        customer = Customer(
+            company_id=company_id,
+            name=f"{first} {last}",
+            email=f"{first.lower()}.{last.lower()}{i}@example.com",
+            phone=f"+1 ({rng.randint(200, 999)}) {rng.randint(200, 999)}-{i % 10000:04d}",
+            address={"full": f"{rng.randint(1, 9999)} {rng.choice(STREETS)}, {rng.choice(CITIES)}"}
+        )
+        batch.append(customer.dict())
+        if len(batch) == 5000:
+            await db.customers.insert_many(batch)
+            batch = []
+    if batch:
+        await db.customers.insert_many(batch)
+
+async def customer_search(args):
+    """Customer type-ahead over one large company"""
+    company_id = "company-0000"
+    count = args.count or 200000
+    await seed_customers(count, company_id)
+    await db.customers.create_index([("company_id", 1), ("id", 1)])
+    print(f"Seeded {count} customers")
+
+    registry = CustomerSearchRegistry()
+    started = time.perf_counter()
+    await registry.search(db, company_id, q=FIRST_NAMES[0][:3], limit=20)
+    print(f"First search (from MongoDB while the index loads) in {(time.perf_counter() - started) * 1000:.0f}ms")
+    started = time.perf_counter()
+    await registry.get_index(db, company_id)
+    print(f"Index loaded in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    rng = random.Random(7)
+    shapes = {
+        "name prefix": lambda: {"q": rng.choice(FIRST_NAMES)[:rng.randint(2, 4)]},
+        "full name": lambda: {"q": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"},
+        "misspelled name": lambda: {"q": rng.choice(LAST_NAMES)[:-1] + "x"},
+        "phone fragment": lambda: {"q": f"{rng.randint(200, 999)}-{rng.randint(0, 9999):04d}"},
+        "address": lambda: {"q": f"{rng.choice(STREETS).split()[0]} {rng.choice(CITIES)[:3]}"},
+        "city": lambda: {"q": rng.choice(CITIES)},
+        "one letter": lambda: {"q": rng.choice("abcdefghijklmnopqrstuvwxyz")},
+        "email prefix": lambda: {"email": rng.choice(FIRST_NAMES).lower() + "."},
+    }
+
+    for label, make_params in shapes.items():
+        samples = []
+        for _ in range(args.iterations):
+            started = time.perf_counter()
+            await registry.search(db, company_id, limit=20, **make_params())
+            samples.append((time.perf_counter() - started) * 1000)
+        report_latencies(label, samples, args.target_ms or 20.0)
+
+async def dispatch_nearest(args):
+    """Nearest available technicians with a specialty"""
+    count = args.count or 10000
+    companies = min(args.companies, 10)
+    await seed_technicians(count, companies)
+    for keys, options in TechnicianSearchService.INDEXES + DispatchService.INDEXES:
+        await db.technicians.create_index(keys, **options)
+    print(f"Seeded {count} technicians across {companies} companies")
+
+    dispatch_service = DispatchService(db)
+    rng = random.Random(7)
+    shapes = {
+        "nearest 5": lambda: {},
+        "nearest 5 + specialty": lambda: {"specialty": rng.choice(SPECIALTIES)},
+        "within 5 km": lambda: {"specialty": rng.choice(SPECIALTIES), "max_distance_km": 5},
+    }
+
+    for label, make_params in shapes.items():
+        samples = []
+        for _ in range(args.iterations):
+            company_id = f"company-{rng.randrange(companies):04d}"
+            lat, lng = rng.uniform(41.63, 42.13), rng.uniform(-87.88, -87.38)
+            started = time.perf_counter()
+            await dispatch_service.nearest_technicians(company_id, lat, lng, k=5, **make_params())
+            samples.append((time.perf_counter() - started) * 1000)
+        report_latencies(label, samples, args.target_ms or 10.0)
+
+async def location_ingest(args):
+    """GPS pings: every technician reports once a second, flushed every LOCATION_FLUSH_INTERVAL"""
+    count = args.count or 5000
+    companies = min(args.companies, 10)
+    await seed_technicians(count, companies)
+    for keys, options in TechnicianSearchService.INDEXES + DispatchService.INDEXES:
+        await db.technicians.create_index(keys, **options)
+    technicians = await db.technicians.find({}, {"_id": 0, "id": 1, "company_id": 1}).to_list(None)
+    print(f"Seeded {count} technicians across {companies} companies")
+
+    buffer = LocationIngestBuffer(db)
+    await buffer.ensure_trail_collection()
+    interval = max(1, round(buffer.FLUSH_INTERVAL))
+    rng = random.Random(7)
+    clock = datetime.utcnow()
+    samples, add_seconds = [], 0.0
+    started = time.perf_counter()
+    for _ in range(max(1, min(args.iterations, 50))):
+        # One flush interval: `interval` pings per technician, then the bulk write
+        interval_started = time.perf_counter()
+        for _ in range(interval):
+            clock += timedelta(seconds=1)
+            add_started = time.perf_counter()
+            for technician in technicians:
+                buffer.add(technician["company_id"], {
+                    "technician_id": technician["id"], "lat": rng.uniform(41.63, 42.13),
+                    "lng": rng.uniform(-87.88, -87.38), "recorded_at": clock, "accuracy_m": 5.0
+                })
+            add_seconds += time.perf_counter() - add_started
+        await buffer.flush()
+        samples.append((time.perf_counter() - interval_started) * 1000)
+    elapsed = time.perf_counter() - started
+
+    received = buffer.counters["received"]
+    print(f"Ingested {received} pings in {elapsed:.1f}s: {received / elapsed:.0f} pings/s sustained, "
+          f"{received / add_seconds:.0f} pings/s buffered (add only)")
+    print(f"Wrote {buffer.counters['flushed']} positions and {buffer.counters['trail_points']} trail points, "
+          f"{buffer.counters['flush_errors']} flush errors")
+    # Keeping up means each interval's pings are buffered and flushed within the interval
+    report_latencies(f"{interval}s of pings + flush", samples, args.target_ms or interval * 1000.0)
+
+async def route_optimizer(args):
+    """Daily route plan: `count` stops with time windows across count / 10 technicians"""
+    count = args.count or 500
+    rng = random.Random(42)
+    technicians = [
+        {"id": f"tech-{i}", "lat": rng.uniform(41.63, 42.13), "lng": rng.uniform(-87.88, -87.38),
+         "shift_start": 8 * 60, "shift_end": 18 * 60}
+        for i in range(max(1, count // 10))
+    ]
+    stops = []
+    for i in range(count):
+        earliest, latest = parse_time_window(rng.choice(["8-11", "12-3", "3-6"]))
+        stops.append({
+            "id": f"appt-{i}", "lat": rng.uniform(41.63, 42.13), "lng": rng.uniform(-87.88, -87.38),
+            "duration": rng.choice([30, 45, 60]), "earliest": earliest, "latest": latest
+        })
+    print(f"Planning {count} stops for {len(technicians)} technicians")
+
+    optimizer = RouteOptimizer()
+    samples = []
+    for _ in range(args.iterations):
+        started = time.perf_counter()
+        plan = optimizer.optimize(technicians, stops)
+        samples.append((time.perf_counter() - started) * 1000)
+    routed = sum(len(route["stops"]) for route in plan["routes"])
+    total_km = sum(route["total_distance_km"] for route in plan["routes"])
+    print(f"Routed {routed}/{count} stops, {total_km:.0f} km total")
+    report_latencies("plan day", samples, args.target_ms or 1000.0)
+
+def sample_payloads(count: int) -> dict:
+    """Representative large JSON bodies: call-log search, company export, owner insights"""
+    rng = random.Random(42)
+    phrases = ["my furnace is not turning on", "the AC is blowing warm air", "can someone come tomorrow morning",
+               "what time works for you", "I can book you for 8 to 11", "is there a charge for the visit",
+               "the thermostat is blank", "we hear a rattling noise from the unit"]
+
+    def customer(i):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        return {"id": f"customer-{i:06d}", "name": f"{first} {last}", "phone": f"+1555{i:07d}",
+                "email": f"{first.lower()}.{last.lower()}{i}@example.com",
+                "address": {"full": f"{rng.randint(1, 9999)} {rng.choice(STREETS)}, {rng.choice(CITIES)}"}}
+
+    call_logs = [
+        {"id": f"call-{i:06d}", "customer": customer(i), "status": "completed", "duration_seconds": rng.randint(30, 600),
+         "transcript": [{"speaker": rng.choice(["caller", "assistant"]), "text": rng.choice(phrases),
+                         "timestamp": f"2026-10-{rng.randint(1, 28):02d}T{rng.randint(8, 17):02d}:00:00"}
+                        for _ in range(rng.randint(6, 20))]}
+        for i in range(count // 10)
+    ]
+    export = {"customers": [customer(i) for i in range(count)],
+              "technicians": [{"id": f"tech-{i}", "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                               "specialties": rng.sample(SPECIALTIES, 3)} for i in range(count // 100)]}
+    insights = {"revenue_by_day": [{"date": f"2026-{m:02d}-{d:02d}", "revenue": round(rng.uniform(500, 9000), 2),
+                                    "jobs": rng.randint(1, 30)} for m in range(1, 13) for d in range(1, 29)],
+                "technician_performance": [{"technician_id": f"tech-{i}", "jobs": rng.randint(10, 200),
+                                            "average_rating": round(rng.uniform(3, 5), 2)} for i in range(50)]}
+    return {
+        "call-log search": {"call_logs": call_logs, "total": len(call_logs)},
+        "company export": export,
+        "owner insights": insights,
+    }
+
+async def compression(args):
+    """Bytes saved and CPU time per response for each supported encoding"""
+    count = args.count or 2000
+    payloads = {label: json.dumps(payload).encode() for label, payload in sample_payloads(count).items()}
+    iterations = max(1, min(args.iterations, 50))
+
+    for label, body in payloads.items():
+        for encoding in supported_encodings():
+            samples = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                compressed = compress_body(body, encoding)
+                samples.append((time.perf_counter() - started) * 1000)
+            saved = 1 - len(compressed) / len(body)
+            print(f"   {label:<16} {encoding:<5} {len(body) / 1024:8.0f} KB -> {len(compressed) / 1024:6.0f} KB "
+                  f"({saved:.0%} saved, {len(body) / 1024 / 1024 / (statistics.median(samples) / 1000):.0f} MB/s)")
+            report_latencies(f"{label} {encoding}", samples, args.target_ms or 50.0)
+
+BENCHMARKS = {
+    "technician-search": technician_search,
+    "customer-search": customer_search,
+    "dispatch-nearest": dispatch_nearest,
+    "location-ingest": location_ingest,
+    "route-optimizer": route_optimizer,
+    "compression": compression,
+}
+
+async def main(benchmark: str, args):
+    """Run a single benchmark against a freshly dropped scratch database"""
+    print(f"⏱️  Running '{benchmark}' on {db_name}")
+    await client.drop_database(db_name)
+
+    try:
+        await BENCHMARKS[benchmark](args)
+    finally:
+        if not args.keep_data:
+            await client.drop_database(db_name)
+        client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HVAC Assistant query benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--count", type=int, help="Records to seed (defaults per benchmark)")
+    parser.add_argument("--companies", type=int, default=500, help="Tenants to spread records across")
+    parser.add_argument("--iterations", type=int, default=200, help="Timed runs per query shape")
+    parser.add_argument("--target-ms", type=float, help="p95 latency target (defaults per benchmark)")
+    parser.add_argument("--keep-data", action="store_true", help="Leave the seeded database in place")
+    args = parser.parse_args()
+    asyncio.run(main(args.benchmark, args))
@@ -0,0 +1,443 @@
+import os
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from pymongo import CursorType, ReturnDocument
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+# Cache lookup outcomes
+CACHE_HIT = "hit"
+CACHE_STALE = "stale"
+CACHE_MISS = "miss"
+CACHE_COALESCED = "coalesced"
+
+class _CacheEntry:
+    __slots__ = ("value", "computed_at")
+
+    def __init__(self, value: Any, computed_at: float):
+        self.value = value
+        self.computed_at = computed_at
+
+class ResponseCache:
+    """In-process response cache with TTL, stale-while-revalidate and single-flight.
+
+    - Fresh entries (younger than `ttl`) are served directly.
+    - Stale entries (up to `ttl + stale_ttl`) are served while one background
+      task recomputes them.
+    - Concurrent misses for the same key share a single computation.
+    - `invalidate` drops an entry and discards any computation already in flight.
+    - Values rejected by `cacheable` are returned but not stored (a previous
+      entry, if any, keeps being served).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        stale_ttl: float = 0.0,
+        max_entries: int = 1000,
+        cacheable: Optional[Callable[[Any], bool]] = None
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.cacheable = cacheable
+        self._entries: Dict[str, _CacheEntry] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._generations: Dict[str, int] = {}
+        self.counters = {
+            CACHE_HIT: 0, CACHE_STALE: 0, CACHE_MISS: 0, CACHE_COALESCED: 0,
+            "invalidations": 0, "errors": 0, "not_stored": 0
+        }
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, str]:
+        """Return (value, outcome) for `key`, computing it with `compute` when needed"""
+        if self.ttl <= 0:
+            self.counters[CACHE_MISS] += 1
+            return await compute(), CACHE_MISS
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry.computed_at
+            if age < self.ttl:
+                self.counters[CACHE_HIT] += 1
+                return entry.value, CACHE_HIT
+            if age < self.ttl + self.stale_ttl:
+                self.counters[CACHE_STALE] += 1
+                self._refresh(key, compute)
+                return entry.value, CACHE_STALE
+
+        if key in self._inflight:
+            self.counters[CACHE_COALESCED] += 1
+            outcome = CACHE_COALESCED
+        else:
+            self.counters[CACHE_MISS] += 1
+            outcome = CACHE_MISS
+
+        # Shield so a cancelled request does not cancel the shared computation
+        value = await asyncio.shield(self._refresh(key, compute))
+        return value, outcome
+
+    def _refresh(self, key: str, compute: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Start (or join) the single in-flight computation for `key`"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._compute(key, compute, self._generations.get(key, 0)))
+            task.add_done_callback(self._log_failure)
+            self._inflight[key] = task
+        return task
+
+    def _log_failure(self, task: asyncio.Task):
+        """Log failed computations (background refreshes have no caller to raise to)"""
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"{self.name} cache refresh failed: {str(task.exception())}")
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]], generation: int) -> Any:
+        """Compute and store a value unless the key was invalidated meanwhile"""
+        try:
+            value = await compute()
+        except Exception:
+            self.counters["errors"] += 1
+            raise
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+
+        if self.cacheable is not None and not self.cacheable(value):
+            self.counters["not_stored"] += 1
+        elif self._generations.get(key, 0) == generation:
+            self._store(key, value)
+        return value
+
+    def _store(self, key: str, value: Any):
+        """Store a value, evicting the oldest entries beyond max_entries"""
+        self._entries.pop(key, None)
+        self._entries[key] = _CacheEntry(value, time.monotonic())
+        while len(self._entries) > self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+
+    def peek(self, key: str) -> Any:
+        """Return the cached value for `key` (fresh or stale) without computing it"""
+        entry = self._entries.get(key)
+        return entry.value if entry is not None else None
+
+    def invalidate(self, key: str):
+        """Drop a cached value and any computation started before now"""
+        self._entries.pop(key, None)
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._inflight.pop(key, None)
+        self.counters["invalidations"] += 1
+
+    def clear(self):
+        """Drop every cached value"""
+        for key in list(self._entries) + list(self._inflight):
+            self.invalidate(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and configuration for tuning"""
+        lookups = self.counters[CACHE_HIT] + self.counters[CACHE_STALE] + self.counters[CACHE_MISS] + self.counters[CACHE_COALESCED]
+        served_from_cache = self.counters[CACHE_HIT] + self.counters[CACHE_STALE] + self.counters[CACHE_COALESCED]
+        return {
+            "name": self.name,
+            "ttl_seconds": self.ttl,
+            "stale_ttl_seconds": self.stale_ttl,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            **self.counters,
+            "hit_ratio": round(served_from_cache / lookups, 4) if lookups else None
+        }
+
+# Dashboard caches (per company)
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "15"))
+DASHBOARD_CACHE_STALE_TTL = float(os.getenv("DASHBOARD_CACHE_STALE_TTL", "60"))
+
+def all_queries_succeeded(value: Tuple[Dict[str, Any], str]) -> bool:
+    """(payload, Server-Timing) pairs built from a QueryFanout with no failed queries"""
+    return not value[0].get("failed_queries")
+
+# Payloads with failed queries carry defaults in place of real numbers: never cache those
+dashboard_cache = ResponseCache(
+    "dashboard", DASHBOARD_CACHE_TTL, DASHBOARD_CACHE_STALE_TTL, cacheable=all_queries_succeeded
+)
+owner_insights_cache = ResponseCache(
+    "owner_insights", DASHBOARD_CACHE_TTL, DASHBOARD_CACHE_STALE_TTL, cacheable=all_queries_succeeded
+)
+
+def invalidate_company_dashboards(company_id: str):
+    """Drop cached dashboard responses after a company's appointments or jobs change"""
+    if not company_id:
+        return
+    dashboard_cache.invalidate(company_id)
+    owner_insights_cache.invalidate(company_id)
+
+class InvalidationBus:
+    """Cross-worker cache invalidation over a capped MongoDB collection.
+
+    Workers publish (channel, key, version) messages and tail the collection
+    with a TAILABLE_AWAIT cursor; subscribers run for messages from other
+    workers. Invalidation is idempotent, so replaying a few recent messages
+    after a reconnect is harmless.
+    """
+
+    COLLECTION = "cache_invalidations"
+    CAPPED_SIZE_BYTES = 1024 * 1024
+    RECONNECT_DELAY = 5.0
+    REPLAY_WINDOW = timedelta(seconds=5)
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self.db = None
+        self._subscribers: Dict[str, List[Callable[[str, Optional[int]], None]]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self.messages_received = 0
+        self.messages_published = 0
+
+    def subscribe(self, channel: str, callback: Callable[[str, Optional[int]], None]):
+        """Run `callback(key, version)` for invalidations published by other workers"""
+        self._subscribers.setdefault(channel, []).append(callback)
+
+    async def start(self, db):
+        """Create the capped collection if needed and start tailing it"""
+        self.db = db
+        try:
+            await db.create_collection(self.COLLECTION, capped=True, size=self.CAPPED_SIZE_BYTES)
+        except CollectionInvalid:
+            pass  # Already exists
+        except Exception as e:
+            logger.error(f"Could not create invalidation bus collection: {str(e)}")
+
+        # A tailable cursor on an empty capped collection dies immediately
+        await self.publish("_bus", self.worker_id)
+        self._listener = asyncio.ensure_future(self._listen())
+
+    async def stop(self):
+        """Stop tailing the bus"""
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    async def publish(self, channel: str, key: str, version: Optional[int] = None):
+        """Announce an invalidation to the other workers"""
+        if self.db is None:
+            return
+        try:
+            await self.db[self.COLLECTION].insert_one({
+                "channel": channel,
+                "key": key,
+                "version": version,
+                "origin": self.worker_id,
+                "published_at": datetime.utcnow()
+            })
+            self.messages_published += 1
+        except Exception as e:
+            logger.error(f"Failed to publish {channel} invalidation for {key}: {str(e)}")
+
+    async def _listen(self):
+        """Tail the capped collection, reopening the cursor when it dies"""
+        since = datetime.utcnow() - self.REPLAY_WINDOW
+        while True:
+            try:
+                cursor = self.db[self.COLLECTION].find(
+                    {"published_at": {"$gte": since}},
+                    cursor_type=CursorType.TAILABLE_AWAIT
+                )
+                while cursor.alive:
+                    async for message in cursor:
+                        since = max(since, message["published_at"])
+                        self._dispatch(message)
+                    await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Invalidation bus listener error: {str(e)}")
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+    def _dispatch(self, message: dict):
+        """Hand a message from another worker to its channel's subscribers"""
+        if message.get("origin") == self.worker_id:
+            return
+        self.messages_received += 1
+        for callback in self._subscribers.get(message.get("channel"), []):
+            try:
+                callback(message.get("key"), message.get("version"))
+            except Exception as e:
+                logger.error(f"Invalidation subscriber failed for {message.get('channel')}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Bus counters for the cache stats endpoint"""
+        return {
+            "worker_id": self.worker_id,
+            "listening": self._listener is not None and not self._listener.done(),
+            "published": self.messages_published,
+            "received": self.messages_received
+        }
+
+invalidation_bus = InvalidationBus()
+
+# Company settings cache (per company, stamped with settings_version)
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "300"))
+
+settings_cache = ResponseCache("settings", SETTINGS_CACHE_TTL)
+
+def apply_settings_change(company_id: str, version: Optional[int] = None):
+    """Drop cached settings older than `version` (or unconditionally without one)"""
+    cached = settings_cache.peek(company_id)
+    if cached is None or version is None or cached.get("settings_version", 0) < version:
+        settings_cache.invalidate(company_id)
+
+async def publish_settings_change(company_id: str, version: Optional[int] = None):
+    """Invalidate a company's cached settings in this and every other worker"""
+    apply_settings_change(company_id, version)
+    await invalidation_bus.publish("settings", company_id, version)
+
+invalidation_bus.subscribe("settings", apply_settings_change)
+
+# Conditional GET: ETags from change versions or response hashes
+
+class ChangeVersions:
+    """Per-collection, per-company change tokens stored in MongoDB.
+
+    Every write path for a collection calls `bump`, which stores a fresh
+    random token, so a token never repeats (not even after `bump_all` or a
+    reseed drops the documents). Reading the token is one _id lookup, far
+    cheaper than loading and serialising the data it stands for.
+    """
+
+    COLLECTION = "change_versions"
+
+    @staticmethod
+    def _key(collection: str, company_id: str) -> str:
+        return f"{collection}:{company_id}"
+
+    async def get(self, db, collection: str, company_id: str) -> str:
+        """The current change token (created on first use)"""
+        key = self._key(collection, company_id)
+        doc = await db[self.COLLECTION].find_one({"_id": key}, {"version": 1})
+        if doc is None:
+            doc = await db[self.COLLECTION].find_one_and_update(
+                {"_id": key},
+                {"$setOnInsert": {"version": uuid.uuid4().hex, "collection": collection, "company_id": company_id}},
+                upsert=True,
+                projection={"version": 1},
+                return_document=ReturnDocument.AFTER
+            )
+        return doc["version"]
+
+    async def bump(self, db, collection: str, company_id: Optional[str]):
+        """Record a write to one company's documents (errors are logged, never raised)"""
+        if not company_id:
+            return
+        try:
+            await db[self.COLLECTION].update_one(
+                {"_id": self._key(collection, company_id)},
+                {"$set": {"version": uuid.uuid4().hex, "collection": collection, "company_id": company_id}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to bump {collection} change version for {company_id}: {str(e)}")
+
+    async def bump_all(self, db, collection: str):
+        """Record a write that may touch every company (e.g. a maintenance backfill)"""
+        await db[self.COLLECTION].delete_many({"collection": collection})
+
+change_versions = ChangeVersions()
+
+def weak_etag(*parts: Any) -> str:
+    """Weak ETag over the given parts (versions, ids, or a response body)"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"|")
+    return f'W/"{digest.hexdigest()[:20]}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check using weak comparison (RFC 9110 13.1.2)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+class ConditionalGetMiddleware:
+    """ASGI middleware adding a body-hash ETag to JSON GET responses and answering 304s.
+
+    Responses that already carry an ETag (endpoints using change versions)
+    pass through untouched, as does anything that is not a 200 JSON
+    response - event streams in particular are never buffered. Bodies over
+    `max_body_size` are streamed on without an ETag.
+    """
+
+    def __init__(self, app, max_body_size: int = 4 * 1024 * 1024):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = None
+        for name, value in scope.get("headers", []):
+            if name == b"if-none-match":
+                if_none_match = value.decode("latin-1")
+
+        start_message = None
+        chunks: List[bytes] = []
+        size = 0
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, size, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = {name.lower(): value for name, value in message.get("headers", [])}
+                if (message["status"] != 200 or b"etag" in headers or b"content-encoding" in headers
+                        or not headers.get(b"content-type", b"").startswith(b"application/json")):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if size > self.max_body_size:
+                passthrough = True
+                await send(start_message)
+                await send({"type": "http.response.body", "body": b"".join(chunks), "more_body": message.get("more_body", False)})
+                return
+            if message.get("more_body", False):
+                return
+
+            body = b"".join(chunks)
+            etag = weak_etag(body)
+            headers = [(name, value) for name, value in start_message.get("headers", [])]
+            if etag_matches(if_none_match, etag):
+                headers = [(name, value) for name, value in headers if name.lower() not in (b"content-length", b"content-type")]
+                await send({"type": "http.response.start", "status": 304, "headers": headers + [(b"etag", etag.encode())]})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            await send({**start_message, "headers": headers + [(b"etag", etag.encode())]})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,166 @@
+import os
+import gzip
+import zlib
+from typing import Iterable, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # Pinned in requirements.txt; without it only gzip is offered
+    brotli = None
+
+# Bodies smaller than this are sent as-is (compression would not pay for itself)
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = (
+    b"application/json", b"text/", b"application/javascript", b"application/xml", b"image/svg+xml"
+)
+
+def supported_encodings() -> List[str]:
+    """Encodings this process can produce, preferred first"""
+    return (["br"] if brotli is not None else []) + ["gzip"]
+
+def choose_encoding(accept_encoding: str, available: Optional[List[str]] = None) -> Optional[str]:
+    """Best available encoding the client accepts (honouring q-values), None for identity"""
+    available = available if available is not None else supported_encodings()
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+class _Compressor:
+    """Incremental compressor; `compress(chunk, flush=True)` emits a decodable prefix"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._br = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self._gzip = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk: bytes, flush: bool = False) -> bytes:
+        if self.encoding == "br":
+            return self._br.process(chunk) + (self._br.flush() if flush else b"")
+        return self._gzip.compress(chunk) + (self._gzip.flush(zlib.Z_SYNC_FLUSH) if flush else b"")
+
+    def finish(self, chunk: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._br.process(chunk) + self._br.finish()
+        return self._gzip.compress(chunk) + self._gzip.flush(zlib.Z_FINISH)
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    """One-shot compression of a complete body"""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses with brotli or gzip per Accept-Encoding.
+
+    - Complete bodies under `min_size` go out uncompressed.
+    - Streaming responses (no Content-Length, e.g. StreamingResponse or
+      server-sent events) are compressed chunk by chunk with a sync flush,
+      so each chunk still reaches the client as soon as it is sent.
+    - Paths under `exclude_paths` (webhooks answering with a few bytes)
+      are never touched, nor are responses already carrying a
+      Content-Encoding.
+    """
+
+    def __init__(self, app, min_size: int = COMPRESSION_MIN_SIZE, exclude_paths: Iterable[str] = ()):
+        self.app = app
+        self.min_size = min_size
+        self.exclude_paths = tuple(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        encoding = choose_encoding(accept_encoding)
+
+        start_message = None
+        compressor: Optional[_Compressor] = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                headers = {name.lower(): value for name, value in message.get("headers", [])}
+                content_type = headers.get(b"content-type", b"")
+                content_length = headers.get(b"content-length")
+                if (b"content-encoding" in headers or scope["method"] == "HEAD"
+                        or message["status"] in (204, 304) or not content_type.startswith(COMPRESSIBLE_TYPES)
+                        or (content_length is not None and int(content_length) < self.min_size)):
+                    passthrough = True
+                    await send(message)
+                    return
+                start_message = message
+                if encoding is None:
+                    # Still a cacheable representation that depends on Accept-Encoding
+                    passthrough = True
+                    await send({**message, "headers": _with_vary(message.get("headers", []))})
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                if not more_body:
+                    # Whole body in one message: compress it in one go and keep a Content-Length
+                    if len(body) < self.min_size:
+                        passthrough = True
+                        await send(start_message)
+                        await send(message)
+                        return
+                    compressed = compress_body(body, encoding)
+                    await send({**start_message, "headers": _encoded_headers(start_message, encoding, len(compressed))})
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+
+                compressor = _Compressor(encoding)
+                await send({**start_message, "headers": _encoded_headers(start_message, encoding)})
+
+            if more_body:
+                await send({"type": "http.response.body", "body": compressor.compress(body, flush=True), "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": compressor.finish(body)})
+
+        await self.app(scope, receive, send_wrapper)
+
+def _with_vary(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    for i, (name, value) in enumerate(headers):
+        if name.lower() == b"vary":
+            if b"accept-encoding" in value.lower():
+                return headers
+            return headers[:i] + [(name, value + b", Accept-Encoding")] + headers[i + 1:]
+    return headers + [(b"vary", b"Accept-Encoding")]
+
+def _encoded_headers(start_message, encoding: str, length: Optional[int] = None) -> List[Tuple[bytes, bytes]]:
+    headers = [(name, value) for name, value in start_message.get("headers", []) if name.lower() != b"content-length"]
+    headers.append((b"content-encoding", encoding.encode()))
+    if length is not None:
+        headers.append((b"content-length", str(length).encode()))
+    return _with_vary(headers)
@@ -0,0 +1,232 @@
+import os
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Collections whose changes are pushed to connected dashboards
+WATCHED_COLLECTIONS = ("appointments", "jobs", "call_logs", "notifications")
+
+# Events buffered per connected client before it is told to resync
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+
+# Comment line sent on idle streams so proxies keep the connection open
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+# Server error codes meaning change streams are unavailable (not a replica set / sharded cluster)
+CHANGE_STREAMS_UNSUPPORTED = {40573, 40324}
+CHANGE_STREAM_HISTORY_LOST = 286
+NAMESPACE_NOT_FOUND = 26
+
+RESYNC_EVENT = {"type": "resync"}
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """One server-sent event frame"""
+    return f"event: {event}\ndata: {json.dumps(data, default=_json_default, separators=(',', ':'))}\n\n"
+
+def change_to_event(change: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """(company_id, delta event) for a change stream document, None if it cannot be attributed"""
+    document = change.get("fullDocument") or change.get("fullDocumentBeforeChange") or {}
+    company_id = document.get("company_id")
+    if not company_id:
+        return None  # e.g. a delete without a pre-image, or an update to a since-deleted document
+
+    operation = change["operationType"]
+    event = {
+        "type": "change",
+        "collection": change["ns"]["coll"],
+        "operation": operation,
+        "id": document.get("id")
+    }
+    if operation == "update":
+        description = change.get("updateDescription", {})
+        event["changes"] = description.get("updatedFields", {})
+        if description.get("removedFields"):
+            event["removed"] = description["removedFields"]
+    elif operation in ("insert", "replace"):
+        event["document"] = {key: value for key, value in document.items() if key != "_id"}
+    return company_id, event
+
+class EventBroadcaster:
+    """Fans events out to the connected clients of each company.
+
+    Every client gets a bounded queue. A client that falls behind has its
+    backlog replaced by a single resync event, telling it to refetch
+    rather than apply an incomplete set of deltas.
+    """
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.counters = {"published": 0, "delivered": 0, "resyncs": 0}
+
+    def subscribe(self, company_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(company_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, company_id: str, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(company_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[company_id]
+
+    def publish(self, company_id: str, event: Dict[str, Any]):
+        self.counters["published"] += 1
+        for queue in self._subscribers.get(company_id, ()):
+            try:
+                queue.put_nowait(event)
+                self.counters["delivered"] += 1
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC_EVENT)
+                self.counters["resyncs"] += 1
+
+    def publish_all(self, event: Dict[str, Any]):
+        for company_id in list(self._subscribers):
+            self.publish(company_id, event)
+
+    def stats(self) -> Dict[str, Any]:
+        """Connected clients and counters for the cache stats endpoint"""
+        return {
+            "companies": len(self._subscribers),
+            "clients": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            **self.counters
+        }
+
+class ChangeStreamListener:
+    """Tails one database-level change stream and hands deltas to the broadcaster.
+
+    Change streams need a replica set (a single-node one is enough for
+    development: `mongod --replSet rs0` then `rs.initiate()`). On a
+    standalone server the listener logs a warning and stops; the event
+    endpoint then reports `live: false` and clients keep polling.
+
+    Deletes carry no document, so pre-images are enabled on the watched
+    collections (MongoDB 6.0+) to attribute them to a company. Where that
+    is not possible, a delete makes every client resync instead.
+    """
+
+    RECONNECT_DELAY = 5.0
+    OPERATIONS = ["insert", "update", "replace", "delete"]
+
+    def __init__(
+        self,
+        db,
+        broadcaster: EventBroadcaster,
+        collections: Tuple[str, ...] = WATCHED_COLLECTIONS,
+        on_change: Optional[Callable[[Optional[str], str], None]] = None
+    ):
+        self.db = db
+        self.broadcaster = broadcaster
+        self.collections = collections
+        self.on_change = on_change  # (company_id or None if unknown, collection), e.g. to drop cached dashboards
+        self.live = False
+        self.supported = True
+        self.pre_images = False
+        self._resume_token = None
+        self._task: Optional[asyncio.Task] = None
+        self.changes_seen = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.live = False
+
+    async def _enable_pre_images(self):
+        """Turn on change stream pre-images for the watched collections (creating missing ones)"""
+        try:
+            for collection in self.collections:
+                try:
+                    await self.db.command("collMod", collection, changeStreamPreAndPostImages={"enabled": True})
+                except OperationFailure as e:
+                    if e.code != NAMESPACE_NOT_FOUND:
+                        raise
+                    await self.db.create_collection(collection, changeStreamPreAndPostImages={"enabled": True})
+            self.pre_images = True
+        except Exception as e:
+            logger.warning(f"Change stream pre-images unavailable, deletes will trigger a resync: {str(e)}")
+
+    async def _run(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": list(self.collections)}, "operationType": {"$in": self.OPERATIONS}}}]
+        await self._enable_pre_images()
+        while True:
+            try:
+                options = {"full_document_before_change": "whenAvailable"} if self.pre_images else {}
+                async with self.db.watch(
+                    pipeline, full_document="updateLookup", resume_after=self._resume_token, **options
+                ) as stream:
+                    self.live = True
+                    logger.info(f"Listening for changes on {', '.join(self.collections)}")
+                    async for change in stream:
+                        self._resume_token = stream.resume_token
+                        self._dispatch(change)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAMS_UNSUPPORTED:
+                    self._disable(str(e))
+                    return
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    self._resume_token = None  # Events were missed, so every client refetches
+                    self.broadcaster.publish_all(RESYNC_EVENT)
+                logger.error(f"Change stream error: {str(e)}")
+            except NotImplementedError as e:
+                self._disable(str(e))
+                return
+            except Exception as e:
+                logger.error(f"Change stream error: {str(e)}")
+            self.live = False
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+    def _disable(self, reason: str):
+        self.live = False
+        self.supported = False
+        logger.warning(f"Change streams unavailable, live events disabled: {reason}")
+
+    def _dispatch(self, change: Dict[str, Any]):
+        self.changes_seen += 1
+        result = change_to_event(change)
+        if result is None:
+            if change["operationType"] == "delete":
+                # Some company lost a row and we cannot tell which: everyone refetches
+                self._notify(None, change["ns"]["coll"])
+                self.broadcaster.publish_all(RESYNC_EVENT)
+            return
+        company_id, event = result
+        self._notify(company_id, event["collection"])
+        self.broadcaster.publish(company_id, event)
+
+    def _notify(self, company_id: Optional[str], collection: str):
+        if self.on_change:
+            try:
+                self.on_change(company_id, collection)
+            except Exception as e:
+                logger.error(f"Change callback failed for {company_id}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "live": self.live, "supported": self.supported, "pre_images": self.pre_images,
+            "changes_seen": self.changes_seen
+        }
@@ -0,0 +1,21 @@
+from typing import Any, Dict, Optional
+
+def geojson_point(lat: float, lng: float) -> Dict[str, Any]:
+    """GeoJSON Point for a 2dsphere index (coordinates are longitude first)"""
+    return {"type": "Point", "coordinates": [float(lng), float(lat)]}
+
+def point_from_location(location: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """GeoJSON Point from a {"lat", "lng"} (or latitude/longitude) dict, None if invalid"""
+    if not location:
+        return None
+    lat = location.get("lat", location.get("latitude"))
+    lng = location.get("lng", location.get("longitude"))
+    if lat is None or lng is None:
+        return None
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return geojson_point(lat, lng)
@@ -11,6 +11,10 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from pathlib import Path
 
+from models import Technician
+from phones import normalize_phone_e164
+from geo import geojson_point
+
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -56,7 +60,8 @@ async def clear_existing_data():
     """Clear existing data from all collections"""
     collections = [
         'companies', 'customers', 'technicians', 'appointments', 'jobs', 
-        'invoices', 'inquiries', 'messages', 'ratings', 'notifications'
+        'invoices', 'inquiries', 'messages', 'ratings', 'notifications',
+        'change_versions'
     ]
     
     for collection_name in collections:
@@ -105,6 +110,7 @@ async def create_technicians(companies):
         # 2-3 technicians per company
         for j in range(random.randint(2, 3)):
             tech_name = random.choice(TECHNICIAN_NAMES)
+            lat, lng = round(random.uniform(41.63, 42.13), 6), round(random.uniform(-87.88, -87.38), 6)
             technician = {
                 "id": f"tech-{company['id']}-{j+1:02d}",
                 "company_id": company["id"],
@@ -115,12 +121,21 @@ async def create_technicians(companies):
                 "certifications": random.sample(["EPA Certified", "NATE Certified", "OSHA Certified"], k=random.randint(1, 2)),
                 "hourly_rate": random.uniform(25.0, 45.0),
                 "is_active": True,
+                "status": "available",
+                "current_location": {"lat": lat, "lng": lng},
+                "location": geojson_point(lat, lng),
                 "average_rating": round(random.uniform(3.5, 5.0), 2),
                 "total_ratings": random.randint(5, 50),
                 "total_jobs_completed": random.randint(20, 200),
                 "created_at": datetime.utcnow() - timedelta(days=random.randint(30, 200)),
                 "updated_at": datetime.utcnow()
             }
+            
+            # Derived search keys, as the API maintains them
+            technician_obj = Technician(**technician)
+            technician_obj.calculate_search_fields()
+            technician["search_terms"] = technician_obj.search_terms
+            technician["skill_keys"] = technician_obj.skill_keys
             technicians.append(technician)
     
     await db.technicians.insert_many(technicians)
@@ -135,12 +150,14 @@ async def create_customers(companies):
         # 15 customers per company
         for i in range(15):
             customer_name = random.choice(CUSTOMER_NAMES)
+            phone = f"+1-555-{random.randint(100, 999)}-{random.randint(1000, 9999)}"
             customer = {
                 "id": f"customer-{company['id']}-{i+1:03d}",
                 "company_id": company["id"],
                 "name": customer_name,
                 "email": f"{customer_name.lower().replace(' ', '.')}@gmail.com" if random.choice([True, False]) else None,
-                "phone": f"+1-555-{random.randint(100, 999)}-{random.randint(1000, 9999)}",
+                "phone": phone,
+                "phone_e164": normalize_phone_e164(phone),
                 "address": random.choice(ADDRESSES),
                 "preferred_contact": random.choice(["phone", "email"]),
                 "notes": random.choice(["Regular customer", "Prefers morning appointments", "Has multiple properties", ""]),
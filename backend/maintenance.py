@@ -0,0 +1,181 @@
+"""
+HVAC Assistant - Database Maintenance Commands
+Rebuilds derived data from the source collections
+
+Usage: python maintenance.py <command> [options]
+"""
+
+import argparse
+import asyncio
+import os
+from datetime import datetime
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from pathlib import Path
+from pymongo import UpdateOne
+
+from services import (
+    get_rating_service, get_holdback_release_service, get_technician_search_service, get_geocoding_service,
+    get_invoice_number_allocator
+)
+from phones import normalize_phone_e164
+from geo import point_from_location
+
+# Load environment variables
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# MongoDB connection
+mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+client = AsyncIOMotorClient(mongo_url)
+db = client[os.environ.get('DB_NAME', 'hvac_assistant')]
+
+async def rebuild_ratings(args):
+    """Recompute technician rating sum/count counters from the ratings collection"""
+    rating_service = get_rating_service(db)
+    rebuilt = await rating_service.rebuild_rating_aggregates()
+    print(f"✅ Rebuilt rating counters for {rebuilt} rated technicians")
+
+async def release_holdbacks(args):
+    """Release eligible subcontractor holdbacks for a company"""
+    if not args.company_id:
+        raise ValueError("--company-id is required")
+    
+    release_service = get_holdback_release_service(db)
+    report = await release_service.run_holdback_release(
+        args.company_id, processed_by="maintenance", dry_run=args.dry_run
+    )
+    
+    action = "Would release" if args.dry_run else "Released"
+    print(f"✅ {action} {report['released_count']} holdbacks (${report['released_amount']:.2f})")
+    for blocked in report["blocked"]:
+        print(f"⏸️  {blocked['payment_id']} (job {blocked['job_id']}): {', '.join(blocked['reasons'])}")
+
+async def backfill_technician_search(args):
+    """Populate status and derived search fields on existing technicians"""
+    search_service = get_technician_search_service(db)
+    report = await search_service.backfill_search_fields(args.company_id)
+    print(f"✅ Updated {report['updated']} of {report['scanned']} technicians")
+    if report["invalid"]:
+        print(f"⚠️  Skipped {report['invalid']} technicians that failed validation")
+
+async def normalize_customer_phones(args):
+    """Store the canonical phone_e164 on existing customers"""
+    query = {"company_id": args.company_id} if args.company_id else {}
+    scanned, unparseable, updated = 0, [], 0
+    
+    operations = []
+    async for customer in db.customers.find(query, {"_id": 0, "id": 1, "phone": 1, "phone_e164": 1}):
+        scanned += 1
+        phone_e164 = normalize_phone_e164(customer.get("phone"))
+        if phone_e164 is None:
+            unparseable.append(customer)
+        if phone_e164 != customer.get("phone_e164"):
+            operations.append(UpdateOne({"id": customer["id"]}, {"$set": {"phone_e164": phone_e164}}))
+        
+        if len(operations) >= 1000 and not args.dry_run:
+            updated += (await db.customers.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    
+    if args.dry_run:
+        updated += len(operations)
+    elif operations:
+        updated += (await db.customers.bulk_write(operations, ordered=False)).modified_count
+    
+    action = "Would update" if args.dry_run else "Updated"
+    print(f"✅ {action} {updated} of {scanned} customers")
+    for customer in unparseable:
+        print(f"⚠️  {customer['id']}: could not normalize phone {customer.get('phone')!r}")
+
+async def geocode_customers(args):
+    """Geocode customers that have an address but no location yet"""
+    geocoding_service = get_geocoding_service()
+    query = {"location": None}
+    if args.company_id:
+        query["company_id"] = args.company_id
+    scanned, located = 0, 0
+    
+    operations = []
+    async for customer in db.customers.find(query, {"_id": 0, "id": 1, "address": 1}):
+        scanned += 1
+        location = point_from_location(await geocoding_service.geocode(customer.get("address")))
+        if location is None:
+            continue
+        located += 1
+        operations.append(UpdateOne({"id": customer["id"]}, {"$set": {"location": location}}))
+        
+        if len(operations) >= 1000 and not args.dry_run:
+            await db.customers.bulk_write(operations, ordered=False)
+            operations = []
+    
+    if operations and not args.dry_run:
+        await db.customers.bulk_write(operations, ordered=False)
+    
+    action = "Would geocode" if args.dry_run else "Geocoded"
+    print(f"✅ {action} {located} of {scanned} customers without a location")
+
+async def dedupe_invoice_numbers(args):
+    """Renumber invoices sharing a number within a company, then build the unique index"""
+    match = {"company_id": args.company_id} if args.company_id else {}
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {"company_id": "$company_id", "invoice_number": "$invoice_number"},
+            "invoices": {"$push": {"_id": "$_id", "created_at": "$created_at"}},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    allocator = get_invoice_number_allocator(db)
+    renumbered = 0
+    
+    async for group in db.invoices.aggregate(pipeline, allowDiskUse=True):
+        company_id, invoice_number = group["_id"]["company_id"], group["_id"]["invoice_number"]
+        # The oldest invoice keeps its number; the others get fresh ones from the allocator
+        duplicates = sorted(group["invoices"], key=lambda invoice: str(invoice.get("created_at")))[1:]
+        renumbered += len(duplicates)
+        if args.dry_run:
+            print(f"⚠️  {company_id} {invoice_number}: {len(duplicates)} duplicates")
+            continue
+        
+        numbers = await allocator.reserve(company_id, count=len(duplicates))
+        await db.invoices.bulk_write([
+            UpdateOne({"_id": invoice["_id"]}, {"$set": {"invoice_number": number, "updated_at": datetime.utcnow()}})
+            for invoice, number in zip(duplicates, numbers)
+        ], ordered=False)
+        print(f"🔁 {company_id} {invoice_number}: renumbered to {', '.join(numbers)}")
+    
+    action = "Would renumber" if args.dry_run else "Renumbered"
+    print(f"✅ {action} {renumbered} duplicate invoices")
+    if not args.dry_run and not args.company_id:
+        await db.invoices.create_index([("company_id", 1), ("invoice_number", 1)], unique=True)
+        print("✅ Unique (company_id, invoice_number) index is in place")
+
+COMMANDS = {
+    "rebuild-ratings": rebuild_ratings,
+    "release-holdbacks": release_holdbacks,
+    "backfill-technician-search": backfill_technician_search,
+    "normalize-customer-phones": normalize_customer_phones,
+    "geocode-customers": geocode_customers,
+    "dedupe-invoice-numbers": dedupe_invoice_numbers,
+}
+
+async def main(command: str, args):
+    """Run a single maintenance command"""
+    print(f"🔧 Running '{command}' on {os.environ.get('DB_NAME', 'hvac_assistant')}")
+
+    try:
+        await COMMANDS[command](args)
+    except Exception as e:
+        print(f"❌ Error during '{command}': {str(e)}")
+        raise
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HVAC Assistant database maintenance")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--company-id", help="Company to run the command for")
+    parser.add_argument("--dry-run", action="store_true", help="Report without writing changes")
+    args = parser.parse_args()
+    asyncio.run(main(args.command, args))
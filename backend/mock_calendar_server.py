@@ -0,0 +1,55 @@
+"""
+HVAC Assistant - Mock Calendar Provider
+Local stand-in for the calendar provider's events API, including incremental
+listings with sync tokens (410 Gone when a token has expired)
+
+Usage: uvicorn mock_calendar_server:app --port 8099
+Then point the backend at it with GOOGLE_CALENDAR_API_URL=http://localhost:8099
+"""
+
+from fastapi import FastAPI, HTTPException, Query
+from typing import Optional, Dict, Any
+
+from services import MockGoogleCalendarService, SyncTokenExpired
+
+app = FastAPI(title="Mock Calendar API", version="1.0.0")
+
+calendar = MockGoogleCalendarService()
+
+@app.get("/calendars/{calendar_id}/events")
+async def list_events(
+    calendar_id: str,
+    syncToken: Optional[str] = Query(None),
+    pageToken: Optional[str] = Query(None),
+    maxResults: int = Query(250, ge=1, le=2500)
+):
+    """List events: everything without a sync token, only changes since it otherwise"""
+    try:
+        return await calendar.list_events(
+            calendar_id, sync_token=syncToken, page_token=pageToken, max_results=maxResults
+        )
+    except SyncTokenExpired as e:
+        raise HTTPException(status_code=410, detail=str(e))
+
+@app.post("/calendars/{calendar_id}/events")
+async def create_event(calendar_id: str, event_data: Dict[str, Any], retryCount: int = Query(0)):
+    """Create an event"""
+    try:
+        event_id = await calendar.create_event(event_data, retryCount, calendar_id)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"id": event_id, "status": "confirmed"}
+
+@app.patch("/calendars/{calendar_id}/events/{event_id}")
+async def update_event(calendar_id: str, event_id: str, event_data: Dict[str, Any]):
+    """Update an event (also how tests simulate edits made in the calendar)"""
+    if not await calendar.update_event(event_id, event_data, calendar_id):
+        raise HTTPException(status_code=404, detail="Event not found")
+    return {"id": event_id}
+
+@app.delete("/calendars/{calendar_id}/events/{event_id}")
+async def delete_event(calendar_id: str, event_id: str):
+    """Delete (cancel) an event"""
+    if not await calendar.delete_event(event_id, calendar_id):
+        raise HTTPException(status_code=404, detail="Event not found")
+    return {"id": event_id, "status": "cancelled"}
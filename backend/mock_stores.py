@@ -0,0 +1,133 @@
+import os
+import asyncio
+import logging
+import random
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Records kept per mock store before the oldest are evicted
+MOCK_STORE_CAPACITY = int(os.getenv("MOCK_STORE_CAPACITY", "10000"))
+
+class BoundedStore:
+    """Fixed-capacity record store for mock integrations.
+
+    Records are kept in insertion order and the oldest is evicted once
+    `capacity` is reached (ring-buffer semantics). Lookups by key and by the
+    configured index fields are dict lookups instead of list scans.
+    """
+
+    def __init__(self, key_field: str, index_fields: Iterable[str] = (), capacity: int = MOCK_STORE_CAPACITY):
+        self.key_field = key_field
+        self.capacity = capacity
+        self.total_added = 0  # Monotonic count, safe for generating IDs
+        self._records: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._indexes: Dict[str, Dict[Any, Dict[str, None]]] = {field: {} for field in index_fields}
+
+    def append(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Add (or replace) a record, evicting the oldest when full"""
+        key = record[self.key_field]
+        if key in self._records:
+            self.remove(key)
+        elif len(self._records) >= self.capacity:
+            self.remove(next(iter(self._records)))
+
+        self._records[key] = record
+        self._index(key, record)
+        self.total_added += 1
+        return record
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._records.get(key)
+
+    def find_by(self, field: str, value: Any) -> List[Dict[str, Any]]:
+        """Records whose indexed `field` equals `value` (oldest first)"""
+        return [self._records[key] for key in self._indexes[field].get(value, ())]
+
+    def update(self, key: str, changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Apply changes to a record in place, keeping the indexes in step"""
+        record = self._records.get(key)
+        if record is None:
+            return None
+        self._unindex(key, record)
+        record.update(changes)
+        self._index(key, record)
+        return record
+
+    def remove(self, key: str) -> Optional[Dict[str, Any]]:
+        record = self._records.pop(key, None)
+        if record is not None:
+            self._unindex(key, record)
+        return record
+
+    def clear(self):
+        self._records.clear()
+        for index in self._indexes.values():
+            index.clear()
+
+    def values(self) -> List[Dict[str, Any]]:
+        return list(self._records.values())
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(list(self._records.values()))
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._records
+
+    def _index(self, key: str, record: Dict[str, Any]):
+        for field, index in self._indexes.items():
+            index.setdefault(record.get(field), {})[key] = None
+
+    def _unindex(self, key: str, record: Dict[str, Any]):
+        for field, index in self._indexes.items():
+            keys = index.get(record.get(field))
+            if keys is not None:
+                keys.pop(key, None)
+                if not keys:
+                    del index[record.get(field)]
+
+class MockServiceError(Exception):
+    """Failure injected by MockBehavior"""
+
+class MockBehavior:
+    """Configurable latency and error injection for a mock integration.
+
+    Reads MOCK_<NAME>_LATENCY_MS, MOCK_<NAME>_JITTER_MS and MOCK_<NAME>_ERROR_RATE,
+    falling back to the MOCK_LATENCY_MS / MOCK_JITTER_MS / MOCK_ERROR_RATE defaults.
+    MOCK_SEED makes injected jitter and errors reproducible.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        prefix = f"MOCK_{name.upper()}_"
+        self.latency_ms = float(os.getenv(prefix + "LATENCY_MS", os.getenv("MOCK_LATENCY_MS", "0")))
+        self.jitter_ms = float(os.getenv(prefix + "JITTER_MS", os.getenv("MOCK_JITTER_MS", "0")))
+        self.error_rate = float(os.getenv(prefix + "ERROR_RATE", os.getenv("MOCK_ERROR_RATE", "0")))
+        seed = os.getenv("MOCK_SEED")
+        self._random = random.Random(int(seed) if seed else None)
+        self.calls = 0
+        self.injected_errors = 0
+
+    async def apply(self, operation: str):
+        """Simulate provider latency, then fail with the configured probability"""
+        self.calls += 1
+        delay_ms = self.latency_ms + (self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay_ms > 0:
+            await asyncio.sleep(delay_ms / 1000)
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.injected_errors += 1
+            raise MockServiceError(f"Injected {self.name} failure during {operation}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "latency_ms": self.latency_ms,
+            "jitter_ms": self.jitter_ms,
+            "error_rate": self.error_rate,
+            "calls": self.calls,
+            "injected_errors": self.injected_errors
+        }
@@ -2,8 +2,12 @@ from pydantic import BaseModel, Field, EmailStr
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 from enum import Enum
+import re
 import uuid
 
+from phones import normalize_phone_e164
+from geo import point_from_location
+
 # Base Models
 class BaseDocument(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -32,6 +36,12 @@ class AppointmentStatus(str, Enum):
     CANCELLED = "cancelled"
     NO_SHOW = "no_show"
 
+class TechnicianStatus(str, Enum):
+    AVAILABLE = "available"
+    BUSY = "busy"
+    OFF_DUTY = "off_duty"
+    UNAVAILABLE = "unavailable"
+
 class AppointmentSource(str, Enum):
     AI_VOICE = "ai-voice"
     AI_SMS = "ai-sms"
@@ -120,6 +130,12 @@ class Customer(BaseDocument):
     total_spent: float = 0.0
     last_service: Optional[datetime] = None
     tags: List[str] = Field(default_factory=list)
+    phone_e164: Optional[str] = None  # Derived, see calculate_phone_e164
+    location: Optional[Dict[str, Any]] = None  # GeoJSON Point of the geocoded address
+    
+    def calculate_phone_e164(self):
+        """Derive the canonical phone number used for caller lookups"""
+        self.phone_e164 = normalize_phone_e164(self.phone)
 
 class CustomerCreate(BaseModel):
     company_id: str
@@ -141,10 +157,41 @@ class Technician(BaseDocument):
     certifications: List[str] = Field(default_factory=list)
     hourly_rate: float = 0.0
     is_active: bool = True
-    current_location: Optional[Dict[str, float]] = None
+    status: TechnicianStatus = TechnicianStatus.AVAILABLE
+    current_location: Optional[Dict[str, float]] = None  # {"lat", "lng"}
+    location: Optional[Dict[str, Any]] = None  # GeoJSON Point, see calculate_location
+    location_updated_at: Optional[datetime] = None  # Device time of the last GPS ping
+    location_accuracy_m: Optional[float] = None
     average_rating: float = 0.0
     total_ratings: int = 0
+    rating_sum: int = 0  # Running counters maintained with $inc
+    rating_count: int = 0
     total_jobs_completed: int = 0
+    search_terms: List[str] = Field(default_factory=list)  # Derived, see calculate_search_fields
+    skill_keys: List[str] = Field(default_factory=list)
+    
+    def calculate_average_rating(self):
+        """Derive average rating from the running rating counters"""
+        if self.rating_count > 0:
+            self.average_rating = round(self.rating_sum / self.rating_count, 2)
+            self.total_ratings = self.rating_count
+    
+    def calculate_location(self):
+        """Derive the 2dsphere-indexed GeoJSON point from current_location"""
+        self.location = point_from_location(self.current_location)
+    
+    def calculate_search_fields(self):
+        """Derive the lowercase keys used by indexed prefix and skill search"""
+        terms = set(re.split(r"[^\w'-]+", self.name.lower()))
+        if self.email:
+            email = self.email.lower()
+            terms.update([email, email.split("@")[0]])
+        self.search_terms = sorted(term for term in terms if term)
+        self.skill_keys = sorted({
+            skill.strip().lower()
+            for skill in self.specialties + self.certifications
+            if skill.strip()
+        })
 
 class TechnicianCreate(BaseModel):
     company_id: str
@@ -152,7 +199,21 @@ class TechnicianCreate(BaseModel):
     email: Optional[EmailStr] = None
     phone: str
     specialties: List[str] = Field(default_factory=list)
+    certifications: List[str] = Field(default_factory=list)
     hourly_rate: float = 0.0
+    status: TechnicianStatus = TechnicianStatus.AVAILABLE
+
+class LocationPing(BaseModel):
+    technician_id: str
+    lat: float = Field(..., ge=-90, le=90)
+    lng: float = Field(..., ge=-180, le=180)
+    recorded_at: Optional[datetime] = None  # Device time; server receive time if omitted
+    accuracy_m: Optional[float] = None
+    speed_mps: Optional[float] = None
+    heading: Optional[float] = None
+
+class LocationPingBatch(BaseModel):
+    pings: List[LocationPing]
 
 # Appointment Models  
 class Appointment(BaseDocument):
@@ -179,6 +240,7 @@ class Appointment(BaseDocument):
 class AppointmentCreate(BaseModel):
     company_id: str
     customer_id: str
+    technician_id: Optional[str] = None
     title: str
     description: str
     scheduled_date: datetime
@@ -495,6 +557,9 @@ class QAGate(BaseDocument):
     completed_at: Optional[datetime] = None
     completed_by: Optional[str] = None
     
+    # Bumped by every write to the inputs; guards recomputed status fields
+    version: int = 0
+    
     def calculate_qa_status(self):
         """Calculate overall QA status based on requirements"""
         if not self.startup_metrics:
@@ -581,6 +646,9 @@ class Inspection(BaseDocument):
     # Requirements
     required: bool = True  # Some jobs may not require inspection
 
+class QAStatusBatchRequest(BaseModel):
+    job_ids: List[str]
+
 class SubcontractorPayment(BaseDocument):
     job_id: str
     company_id: str
@@ -37,10 +37,10 @@ class Message(BaseDocument):
     sender_name: str
     content: str
     status: MessageStatus = MessageStatus.SENT
-    read_by: List[Dict[str, datetime]] = Field(default_factory=list)  # [{"user_id": "xxx", "read_at": datetime}]
     sms_message_id: Optional[str] = None  # Twilio message SID
     attachments: List[Dict[str, str]] = Field(default_factory=list)
     is_sms_bridge: bool = False  # True if message was sent/received via SMS
+    seq: Optional[int] = None  # Position of the message in its job thread
 
 class MessageCreate(BaseModel):
     company_id: str
@@ -59,6 +59,22 @@ class MessageThread(BaseDocument):
     last_message_content: str
     unread_counts: Dict[str, int] = Field(default_factory=dict)  # {"user_id": unread_count}
     is_active: bool = True
+    message_seq: int = 0  # Sequence number of the latest message
+    read_watermarks: Dict[str, int] = Field(default_factory=dict)  # {"user_id": last read seq}
+    
+    def calculate_unread_counts(self, user_ids: List[str] = None):
+        """Derive unread counts from the message sequence and read watermarks"""
+        if self.message_seq == 0:
+            return  # Legacy thread without sequence numbers
+        
+        known_users = set(self.read_watermarks)
+        known_users.update(p["user_id"] for p in self.participants if p.get("user_id"))
+        known_users.update(user_id for user_id in user_ids or [] if user_id)
+        
+        self.unread_counts = {
+            user_id: max(0, self.message_seq - self.read_watermarks.get(user_id, 0))
+            for user_id in known_users
+        }
 
 # Customer Rating System Models
 class CustomerRating(BaseDocument):
@@ -164,16 +180,31 @@ class SMSTemplateCreate(BaseModel):
 class CalendarEvent(BaseDocument):
     company_id: str
     appointment_id: str
-    google_event_id: str
+    google_event_id: Optional[str] = None  # Set once the create has synced
     calendar_id: str
     title: str
+    description: str = ""
     start_time: datetime
     end_time: datetime
     attendees: List[str] = Field(default_factory=list)
-    sync_status: str = "synced"  # synced, failed, pending
-    last_sync_at: datetime = Field(default_factory=datetime.utcnow)
+    operation: str = "create"  # create, update, delete
+    sync_status: str = "synced"  # synced, failed, pending, syncing, deleted
+    last_sync_at: Optional[datetime] = None
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
     retry_count: int = 0
     error_message: Optional[str] = None
+    claim_token: Optional[str] = None  # Worker batch currently syncing this event
+    claimed_at: Optional[datetime] = None
+    
+    def to_event_data(self) -> Dict[str, Any]:
+        """Calendar API payload for this event"""
+        return {
+            "summary": self.title,
+            "description": self.description,
+            "start": {"dateTime": self.start_time.isoformat()},
+            "end": {"dateTime": self.end_time.isoformat()},
+            "attendees": [{"email": attendee} for attendee in self.attendees]
+        }
 
 class CalendarEventCreate(BaseModel):
     company_id: str
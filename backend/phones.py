@@ -0,0 +1,36 @@
+import re
+from typing import Optional
+
+# Country calling code assumed for numbers entered without one (NANP)
+DEFAULT_COUNTRY_CODE = "1"
+
+def normalize_phone_e164(phone: Optional[str], default_country_code: str = DEFAULT_COUNTRY_CODE) -> Optional[str]:
+    """Canonical E.164 form of a phone number ("+12055551234"), or None if it is not one.
+
+    Accepts the formats seen in the wild here: "+1-205-555-1234" (seed data),
+    "+12055551234" (SMS webhooks), "2055551234" (voice, +1 stripped) and
+    "(205) 555-1234". Numbers containing letters are rejected.
+    """
+    if not phone:
+        return None
+
+    raw = phone.strip()
+    if re.search(r"[A-Za-z]", raw):
+        return None
+
+    digits = re.sub(r"\D", "", raw)
+    if raw.startswith("+"):
+        number = digits
+    elif raw.startswith("00"):
+        number = digits[2:]  # International dialing prefix
+    elif default_country_code == "1" and len(digits) == 11 and digits.startswith("1"):
+        number = digits
+    else:
+        number = default_country_code + digits
+
+    # E.164 allows at most 15 digits; anything under 8 is not a callable number
+    if not 8 <= len(number) <= 15 or number.startswith("0"):
+        return None
+    if number.startswith("1") and len(number) != 11:
+        return None
+    return "+" + number
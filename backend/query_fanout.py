@@ -0,0 +1,72 @@
+import os
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Per-query timeout in seconds for fan-out queries
+DEFAULT_QUERY_TIMEOUT = float(os.getenv("QUERY_FANOUT_TIMEOUT", "5.0"))
+
+class QueryFanout:
+    """Request-scoped helper that runs independent queries concurrently.
+
+    Each query gets its own timeout; a query that fails or times out yields
+    its default value instead of failing the whole request. Timings are
+    recorded for the Server-Timing response header.
+    """
+
+    def __init__(self, timeout: float = DEFAULT_QUERY_TIMEOUT):
+        self.timeout = timeout
+        self.queries: List[tuple] = []  # (name, awaitable, default, timeout)
+        self.timings: Dict[str, float] = {}  # name -> milliseconds
+        self.errors: Dict[str, str] = {}  # name -> error description
+
+    def add(self, name: str, query: Awaitable, default: Any = None, timeout: Optional[float] = None):
+        """Register a query; `name` must be a header-safe token"""
+        self.queries.append((name, query, default, timeout or self.timeout))
+
+    async def gather(self) -> Dict[str, Any]:
+        """Run all registered queries concurrently and return results by name"""
+        queries, self.queries = self.queries, []
+        started = time.perf_counter()
+
+        results = await asyncio.gather(*[
+            self._run(name, query, default, timeout)
+            for name, query, default, timeout in queries
+        ])
+
+        self.timings["total"] = (time.perf_counter() - started) * 1000
+        return {name: result for (name, _, _, _), result in zip(queries, results)}
+
+    async def _run(self, name: str, query: Awaitable, default: Any, timeout: float) -> Any:
+        """Run one query, substituting its default on timeout or error"""
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(query, timeout)
+        except asyncio.TimeoutError:
+            self.errors[name] = "timeout"
+            logger.warning(f"Query '{name}' timed out after {timeout}s")
+            return default
+        except Exception as e:
+            self.errors[name] = "error"
+            logger.error(f"Query '{name}' failed: {str(e)}")
+            return default
+        finally:
+            self.timings[name] = (time.perf_counter() - started) * 1000
+
+    @property
+    def failed_queries(self) -> List[str]:
+        """Names of queries whose results were replaced by defaults"""
+        return sorted(self.errors)
+
+    def server_timing(self) -> str:
+        """Format recorded timings as a Server-Timing header value"""
+        metrics = []
+        for name, duration in self.timings.items():
+            metric = f"{name};dur={duration:.1f}"
+            if name in self.errors:
+                metric += f';desc="{self.errors[name]}"'
+            metrics.append(metric)
+        return ", ".join(metrics)
@@ -0,0 +1,260 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Straight-line distance is scaled by ROAD_FACTOR to approximate driving distance
+ROAD_FACTOR = 1.3
+AVERAGE_SPEED_KMH = float(os.getenv("ROUTE_AVERAGE_SPEED_KMH", "40"))
+
+# Bounds on 2-opt passes per route (each pass applies at most one improving move)
+MAX_TWO_OPT_PASSES = 50
+
+def haversine_matrix(lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """Pairwise great-circle distances in km between all points"""
+    lat = np.radians(np.asarray(lats, dtype=float))
+    lng = np.radians(np.asarray(lngs, dtype=float))
+    dlat = lat[:, None] - lat[None, :]
+    dlng = lng[:, None] - lng[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def parse_time_window(window: str) -> Tuple[int, int]:
+    """Minutes after midnight for a window like "8-11", "12-3" or "3-6" (afternoon hours are 12-hour)"""
+    start, end = (int(part) for part in window.split("-"))
+    if start < 7:
+        start += 12
+    if end < 7:
+        end += 12
+    return start * 60, end * 60
+
+class RouteOptimizer:
+    """Daily route planning with time windows: cheapest feasible insertion, then 2-opt.
+
+    Technicians are dicts with id, lat, lng, shift_start and shift_end; stops
+    are dicts with id, lat, lng, duration, earliest and latest (the latest
+    service start) and an optional technician_id pinning them to one route.
+    All times are minutes after midnight. Routes are open: a technician's day
+    ends at their last stop, which must finish by shift_end.
+
+    Travel times come from one NumPy haversine matrix. Each insertion scores
+    every position of every route at once, checking time windows with the
+    usual push-forward test against each stop's slack (max_shift), so a day
+    of a few hundred stops plans in well under a second.
+    """
+
+    def __init__(self, average_speed_kmh: float = AVERAGE_SPEED_KMH, road_factor: float = ROAD_FACTOR):
+        self.average_speed_kmh = average_speed_kmh
+        self.road_factor = road_factor
+
+    def optimize(self, technicians: List[Dict[str, Any]], stops: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Ordered routes per technician plus the stops that fit nowhere"""
+
+        self.technicians = technicians
+        self.stops = stops
+        n_tech = len(technicians)
+
+        points = technicians + stops
+        self.distance_km = haversine_matrix([p["lat"] for p in points], [p["lng"] for p in points]) * self.road_factor
+        self.travel = self.distance_km * (60.0 / self.average_speed_kmh)
+
+        # Stop attributes indexed by node (technician start nodes come first)
+        pad = np.zeros(n_tech)
+        self.duration = np.concatenate([pad, [float(s.get("duration") or 0) for s in stops]])
+        self.earliest = np.concatenate([pad, [float(s["earliest"]) for s in stops]])
+        self.latest = np.concatenate([pad, [float(s["latest"]) for s in stops]])
+        self.shift_start = np.array([float(t["shift_start"]) for t in technicians])
+        self.shift_end = np.array([float(t["shift_end"]) for t in technicians])
+
+        self.routes: List[List[int]] = [[r] for r in range(n_tech)]
+        self.begin: List[List[float]] = [[] for _ in range(n_tech)]
+        self._init_candidates()
+
+        route_by_technician = {t["id"]: r for r, t in enumerate(technicians)}
+        unassigned = []
+        for node in self._insertion_order():
+            stop = stops[node - n_tech]
+            pinned = None
+            if stop.get("technician_id"):
+                pinned = route_by_technician.get(stop["technician_id"])
+                if pinned is None:
+                    unassigned.append({"id": stop["id"], "reason": "technician_unavailable"})
+                    continue
+            if not self._insert(node, pinned):
+                unassigned.append({"id": stop["id"], "reason": "no_feasible_slot"})
+
+        for r in range(n_tech):
+            self._two_opt(r)
+
+        return {
+            "routes": [self._describe(r) for r in range(n_tech)],
+            "unassigned": unassigned
+        }
+
+    def _insertion_order(self) -> List[int]:
+        """Pinned stops first, then tightest deadline, then farthest from any technician"""
+        n_tech = len(self.technicians)
+        nodes = np.arange(n_tech, n_tech + len(self.stops))
+        if len(nodes) == 0:
+            return []
+        farthest = self.travel[:n_tech, n_tech:].min(axis=0) if n_tech else np.zeros(len(nodes))
+        pinned = np.array([0 if s.get("technician_id") else 1 for s in self.stops])
+        order = np.lexsort((-farthest, self.latest[n_tech:], pinned))
+        return nodes[order].tolist()
+
+    # Candidate insertion positions, one row per route: position p inserts after the p-th node
+
+    def _init_candidates(self, capacity: int = 16):
+        n_tech = len(self.technicians)
+        self.capacity = capacity
+        shape = (n_tech, capacity)
+        self.cand_valid = np.zeros(shape, dtype=bool)
+        self.cand_prev = np.zeros(shape, dtype=np.intp)
+        self.cand_next = np.zeros(shape, dtype=np.intp)
+        self.cand_has_next = np.zeros(shape, dtype=bool)
+        self.cand_depart = np.zeros(shape)
+        self.cand_begin_next = np.zeros(shape)
+        self.cand_shift_next = np.zeros(shape)
+        for r in range(n_tech):
+            self._refresh_candidates(r)
+
+    def _grow_candidates(self):
+        for name in ("cand_valid", "cand_prev", "cand_next", "cand_has_next",
+                     "cand_depart", "cand_begin_next", "cand_shift_next"):
+            current = getattr(self, name)
+            grown = np.zeros((current.shape[0], self.capacity * 2), dtype=current.dtype)
+            grown[:, :self.capacity] = current
+            setattr(self, name, grown)
+        self.capacity *= 2
+
+    def _refresh_candidates(self, r: int):
+        """Rebuild route r's candidate row after its stops or schedule changed"""
+        nodes, begin = self.routes[r], self.begin[r]
+        m = len(nodes) - 1
+        while m + 1 > self.capacity:
+            self._grow_candidates()
+
+        stops = np.array(nodes[1:], dtype=np.intp)
+        begin = np.array(begin)
+        # Slack: how far each stop's start can be pushed back without breaking it or a later stop
+        max_shift = np.zeros(m)
+        if m:
+            arrive = np.empty(m)
+            arrive[0] = self.shift_start[r] + self.travel[r, stops[0]]
+            arrive[1:] = begin[:-1] + self.duration[stops[:-1]] + self.travel[stops[:-1], stops[1:]]
+            wait = begin - arrive
+            max_shift[-1] = min(self.latest[stops[-1]] - begin[-1],
+                                self.shift_end[r] - begin[-1] - self.duration[stops[-1]])
+            for j in range(m - 2, -1, -1):
+                max_shift[j] = min(self.latest[stops[j]] - begin[j], wait[j + 1] + max_shift[j + 1])
+
+        row = slice(0, m + 1)
+        self.cand_valid[r] = False
+        self.cand_valid[r, row] = True
+        self.cand_prev[r, row] = nodes
+        self.cand_depart[r, 0] = self.shift_start[r]
+        self.cand_has_next[r] = False
+        if m:
+            self.cand_depart[r, 1:m + 1] = begin + self.duration[stops]
+            self.cand_next[r, :m] = stops
+            self.cand_has_next[r, :m] = True
+            self.cand_begin_next[r, :m] = begin
+            self.cand_shift_next[r, :m] = max_shift
+        self.cand_next[r, m] = nodes[-1]
+
+    def _insert(self, node: int, pinned: Optional[int] = None) -> bool:
+        """Insert a stop at its cheapest feasible position; False if none exists"""
+        prev, nxt, has_next = self.cand_prev, self.cand_next, self.cand_has_next
+
+        start = np.maximum(self.cand_depart + self.travel[prev, node], self.earliest[node])
+        finish = start + self.duration[node]
+        push = finish + self.travel[node, nxt] - self.cand_begin_next
+        feasible = (
+            self.cand_valid
+            & (start <= self.latest[node])
+            & (finish <= self.shift_end[:, None])
+            & (~has_next | (push <= self.cand_shift_next))
+        )
+        if pinned is not None:
+            feasible[np.arange(len(feasible)) != pinned] = False
+        if not feasible.any():
+            return False
+
+        cost = self.travel[prev, node] + np.where(has_next, self.travel[node, nxt] - self.travel[prev, nxt], 0.0)
+        r, p = np.unravel_index(np.argmin(np.where(feasible, cost, np.inf)), cost.shape)
+        self.routes[r].insert(p + 1, node)
+        self.begin[r] = self._schedule(r, self.routes[r])
+        self._refresh_candidates(r)
+        return True
+
+    def _schedule(self, r: int, nodes: List[int]) -> Optional[List[float]]:
+        """Service start times along a route, or None if a window or the shift end is missed"""
+        begin = []
+        clock, prev = self.shift_start[r], nodes[0]
+        for node in nodes[1:]:
+            start = max(clock + self.travel[prev, node], self.earliest[node])
+            if start > self.latest[node] + 1e-9:
+                return None
+            clock, prev = start + self.duration[node], node
+            begin.append(start)
+        if clock > self.shift_end[r] + 1e-9:
+            return None
+        return begin
+
+    def _two_opt(self, r: int):
+        """Reverse segments of route r while that shortens it and keeps every window"""
+        for _ in range(MAX_TWO_OPT_PASSES):
+            nodes = np.array(self.routes[r], dtype=np.intp)
+            m = len(nodes) - 1
+            if m < 2:
+                return
+            # Reversing nodes[i..j] replaces edges (i-1, i) and (j, j+1) with (i-1, j) and (i, j+1)
+            i, j = np.triu_indices(m + 1, k=1)
+            keep = i >= 1
+            i, j = i[keep], j[keep]
+            has_next = j < m
+            after = nodes[np.minimum(j + 1, m)]
+            delta = (self.travel[nodes[i - 1], nodes[j]] - self.travel[nodes[i - 1], nodes[i]]
+                     + np.where(has_next, self.travel[nodes[i], after] - self.travel[nodes[j], after], 0.0))
+            improving = np.flatnonzero(delta < -1e-6)
+            if not len(improving):
+                return
+            for k in improving[np.argsort(delta[improving])]:
+                a, b = i[k], j[k]
+                candidate = self.routes[r][:a] + self.routes[r][a:b + 1][::-1] + self.routes[r][b + 1:]
+                begin = self._schedule(r, candidate)
+                if begin is not None:
+                    self.routes[r], self.begin[r] = candidate, begin
+                    break
+            else:
+                return
+
+    def _describe(self, r: int) -> Dict[str, Any]:
+        n_tech = len(self.technicians)
+        nodes, begin = self.routes[r], self.begin[r]
+        stops = []
+        total_km = total_travel = 0.0
+        clock = float(self.shift_start[r])
+        for node, prev, start in zip(nodes[1:], nodes[:-1], begin):
+            travel = float(self.travel[prev, node])
+            arrival, start = clock + travel, float(start)
+            stops.append({
+                "id": self.stops[node - n_tech]["id"],
+                "arrival": round(arrival, 1),
+                "start": round(start, 1),
+                "end": round(start + float(self.duration[node]), 1),
+                "wait_minutes": round(start - arrival, 1),
+                "travel_minutes": round(travel, 1),
+                "distance_km": round(float(self.distance_km[prev, node]), 2)
+            })
+            total_km += self.distance_km[prev, node]
+            total_travel += travel
+            clock = start + float(self.duration[node])
+        return {
+            "technician_id": self.technicians[r]["id"],
+            "stops": stops,
+            "total_distance_km": round(float(total_km), 2),
+            "total_travel_minutes": round(float(total_travel), 1)
+        }
@@ -0,0 +1,339 @@
+import os
+import asyncio
+import logging
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from caching import invalidation_bus
+from models import AppointmentStatus
+
+logger = logging.getLogger(__name__)
+
+# Companies whose schedules are kept in memory at once (least recently used is dropped)
+SCHEDULE_INDEX_MAX_COMPANIES = int(os.getenv("SCHEDULE_INDEX_MAX_COMPANIES", "50"))
+
+# Invalidation bus channel for appointment writes (key "<company_id>:<appointment_id>",
+# an empty appointment id drops the whole company)
+APPOINTMENT_CHANNEL = "appointments"
+
+# Booked time for appointments without an estimated_duration
+DEFAULT_DURATION_MINUTES = 60
+
+# How far before a new booking the post-write re-check looks for bookings still running
+RECHECK_LOOKBACK = timedelta(hours=int(os.getenv("SCHEDULE_RECHECK_LOOKBACK_HOURS", "24")))
+
+# Appointments in these statuses no longer hold their technician's time
+RELEASED_STATUSES = {AppointmentStatus.CANCELLED.value, AppointmentStatus.NO_SHOW.value}
+
+def parse_scheduled_date(value: Any) -> Optional[datetime]:
+    """Naive UTC datetime from a stored scheduled_date (datetime or ISO string)"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def booking_interval(appointment: Dict[str, Any]) -> Optional[Tuple[datetime, datetime]]:
+    """[start, end) an appointment holds its technician for, None if it holds no one's time"""
+    if not appointment.get("technician_id") or appointment.get("status") in RELEASED_STATUSES:
+        return None
+    start = parse_scheduled_date(appointment.get("scheduled_date"))
+    if start is None:
+        return None
+    duration = appointment.get("estimated_duration") or DEFAULT_DURATION_MINUTES
+    return start, start + timedelta(minutes=duration)
+
+def _booking(appointment_id: str, start: datetime, end: datetime) -> Dict[str, Any]:
+    return {"appointment_id": appointment_id, "start": start, "end": end}
+
+class TechnicianSchedule:
+    """One technician's bookings, sorted by start time.
+
+    An overlap query bisects to the first booking that could still be running
+    at `start` (one starting no earlier than start minus the longest booking)
+    and walks forward until bookings start at or after `end`, so a check costs
+    O(log n + k) for appointments of bounded length.
+    """
+
+    def __init__(self):
+        self._entries: List[Tuple[datetime, str, datetime]] = []  # (start, appointment_id, end)
+        self._by_id: Dict[str, Tuple[datetime, datetime]] = {}
+        self.longest = timedelta(0)  # Never shrinks on removal, which only widens the scan
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, appointment_id: str, start: datetime, end: datetime):
+        self.remove(appointment_id)
+        insort(self._entries, (start, appointment_id, end))
+        self._by_id[appointment_id] = (start, end)
+        self.longest = max(self.longest, end - start)
+
+    def remove(self, appointment_id: str):
+        interval = self._by_id.pop(appointment_id, None)
+        if interval is not None:
+            del self._entries[bisect_left(self._entries, (interval[0], appointment_id))]
+
+    def overlapping(self, start: datetime, end: datetime, exclude_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Bookings that overlap [start, end)"""
+        found = []
+        i = bisect_left(self._entries, (start - self.longest,))
+        while i < len(self._entries):
+            entry_start, appointment_id, entry_end = self._entries[i]
+            if entry_start >= end:
+                break
+            if entry_end > start and appointment_id != exclude_id:
+                found.append(_booking(appointment_id, entry_start, entry_end))
+            i += 1
+        return found
+
+    def conflicts(self, start: datetime, end: datetime) -> List[Tuple[Tuple, Tuple]]:
+        """Every pair of overlapping bookings whose overlap falls in [start, end)"""
+        pairs = []
+        running: List[Tuple[datetime, str, datetime]] = []
+        i = bisect_left(self._entries, (start - self.longest,))
+        while i < len(self._entries) and self._entries[i][0] < end:
+            entry = self._entries[i]
+            running = [other for other in running if other[2] > entry[0]]
+            for other in running:
+                if min(other[2], entry[2]) > start:
+                    pairs.append((other, entry))
+            running.append(entry)
+            i += 1
+        return pairs
+
+class ScheduleIndex:
+    """All of one company's technician bookings"""
+
+    def __init__(self, company_id: str):
+        self.company_id = company_id
+        self.schedules: Dict[str, TechnicianSchedule] = {}
+        self._technician_by_appointment: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._technician_by_appointment)
+
+    def upsert(self, appointment: Dict[str, Any]):
+        self.remove(appointment["id"])
+        interval = booking_interval(appointment)
+        if interval is None:
+            return
+        technician_id = appointment["technician_id"]
+        self.schedules.setdefault(technician_id, TechnicianSchedule()).add(appointment["id"], *interval)
+        self._technician_by_appointment[appointment["id"]] = technician_id
+
+    def remove(self, appointment_id: str):
+        technician_id = self._technician_by_appointment.pop(appointment_id, None)
+        if technician_id is not None:
+            self.schedules[technician_id].remove(appointment_id)
+
+    def overlapping(
+        self, technician_id: str, start: datetime, end: datetime, exclude_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        schedule = self.schedules.get(technician_id)
+        return schedule.overlapping(start, end, exclude_id) if schedule else []
+
+    def conflicts(self, start: datetime, end: datetime, technician_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Double bookings in [start, end), ordered by when they begin"""
+        technician_ids = [technician_id] if technician_id else list(self.schedules)
+        report = []
+        for tech_id in technician_ids:
+            schedule = self.schedules.get(tech_id)
+            if schedule is None:
+                continue
+            for first, second in schedule.conflicts(start, end):
+                report.append({
+                    "technician_id": tech_id,
+                    "overlap_start": max(first[0], second[0]),
+                    "overlap_end": min(first[2], second[2]),
+                    "appointments": [_booking(first[1], first[0], first[2]), _booking(second[1], second[0], second[2])]
+                })
+        report.sort(key=lambda conflict: (conflict["overlap_start"], conflict["technician_id"]))
+        return report
+
+class ScheduleRegistry:
+    """Per-company ScheduleIndex instances, loaded lazily from MongoDB.
+
+    Appointment writes reach the loaded indexes through
+    `record_appointment_change` (this worker) and the invalidation bus (other
+    workers). Writes that book a technician should hold `lock(company_id)`
+    across the conflict check and the write so two requests in this worker
+    cannot both take the same slot. The lock does not reach other workers, so
+    after writing they re-check MongoDB with `find_stored_conflicts` and roll
+    back if another worker booked the slot in between.
+    """
+
+    LOAD_BATCH_SIZE = 5000
+    PROJECTION = {"_id": 0, "id": 1, "technician_id": 1, "scheduled_date": 1, "estimated_duration": 1, "status": 1}
+
+    def __init__(self, max_companies: int = SCHEDULE_INDEX_MAX_COMPANIES):
+        self.max_companies = max_companies
+        self._indexes: "OrderedDict[str, ScheduleIndex]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._pending: Dict[str, Set[str]] = {}  # appointments changed while their company was loading
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.load_times_ms: Dict[str, float] = {}
+
+    def lock(self, company_id: str) -> asyncio.Lock:
+        """Serialises check-then-book writes for one company in this worker"""
+        return self._locks.setdefault(company_id, asyncio.Lock())
+
+    async def get_index(self, db, company_id: str) -> ScheduleIndex:
+        """The company's index, loading it on first use (concurrent callers share one load)"""
+        index = self._indexes.get(company_id)
+        if index is not None:
+            self._indexes.move_to_end(company_id)
+            return index
+
+        task = self._loading.get(company_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(db, company_id))
+            self._loading[company_id] = task
+        return await asyncio.shield(task)
+
+    async def _load(self, db, company_id: str) -> ScheduleIndex:
+        started = time.perf_counter()
+        self._pending[company_id] = set()
+        try:
+            index = ScheduleIndex(company_id)
+            cursor = db.appointments.find(
+                {"company_id": company_id, "technician_id": {"$ne": None}, "status": {"$nin": list(RELEASED_STATUSES)}},
+                self.PROJECTION
+            ).batch_size(self.LOAD_BATCH_SIZE)
+            async for appointment in cursor:
+                index.upsert(appointment)
+
+            self._indexes[company_id] = index
+            while len(self._indexes) > self.max_companies:
+                self._indexes.popitem(last=False)
+
+            # Re-read appointments written while the load was running
+            for appointment_id in self._pending.pop(company_id, set()):
+                await self.refresh_appointment(db, company_id, appointment_id)
+        finally:
+            self._pending.pop(company_id, None)
+            self._loading.pop(company_id, None)
+
+        self.load_times_ms[company_id] = (time.perf_counter() - started) * 1000
+        logger.info(f"Loaded schedule index for {company_id}: {len(index)} bookings "
+                    f"in {self.load_times_ms[company_id]:.0f}ms")
+        return index
+
+    async def find_conflicts(
+        self, db, company_id: str, technician_id: str, start: datetime, end: datetime,
+        exclude_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """The technician's bookings that overlap [start, end), other than `exclude_id`"""
+        index = await self.get_index(db, company_id)
+        return index.overlapping(technician_id, start, end, exclude_id)
+
+    async def find_stored_conflicts(
+        self, db, company_id: str, technician_id: str, start: datetime, end: datetime,
+        exclude_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Like find_conflicts, but read from MongoDB so writes other workers just made are seen"""
+        cursor = db.appointments.find(
+            {
+                "company_id": company_id,
+                "technician_id": technician_id,
+                "scheduled_date": {"$gte": start - RECHECK_LOOKBACK, "$lt": end},
+                "status": {"$nin": list(RELEASED_STATUSES)},
+                "id": {"$ne": exclude_id}
+            },
+            self.PROJECTION
+        )
+        found = []
+        async for appointment in cursor:
+            interval = booking_interval(appointment)
+            if interval is not None and interval[1] > start:
+                found.append(_booking(appointment["id"], *interval))
+        return found
+
+    async def conflicts_report(
+        self, db, company_id: str, start: datetime, end: datetime, technician_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Every double booking in [start, end) (see ScheduleIndex.conflicts)"""
+        index = await self.get_index(db, company_id)
+        return index.conflicts(start, end, technician_id)
+
+    async def refresh_appointment(self, db, company_id: str, appointment_id: str):
+        """Re-read one appointment into a loaded index (companies not in memory are skipped)"""
+        if company_id in self._pending:
+            self._pending[company_id].add(appointment_id)
+            return
+        index = self._indexes.get(company_id)
+        if index is None:
+            return
+
+        appointment = await db.appointments.find_one({"id": appointment_id}, {**self.PROJECTION, "company_id": 1})
+        if appointment and appointment.get("company_id") == company_id:
+            index.upsert(appointment)
+        else:
+            index.remove(appointment_id)
+
+    async def apply_change(self, db, company_id: str, appointment_id: str):
+        """Apply an appointment write made by this worker"""
+        try:
+            await self.refresh_appointment(db, company_id, appointment_id)
+        except Exception as e:
+            # Drop the index rather than check against a schedule that misses the write
+            logger.error(f"Failed to refresh appointment {appointment_id} in schedule index: {str(e)}")
+            self.invalidate(company_id)
+
+    def invalidate(self, company_id: str):
+        """Drop a company's index; it is rebuilt on the next check"""
+        self._indexes.pop(company_id, None)
+
+    def apply_remote_change(self, company_id: str, appointment_id: str):
+        """Apply an appointment write announced by another worker"""
+        if company_id not in self._indexes and company_id not in self._pending:
+            return
+        if invalidation_bus.db is None or not appointment_id:
+            self.invalidate(company_id)
+            return
+        task = asyncio.ensure_future(self.refresh_appointment(invalidation_bus.db, company_id, appointment_id))
+        task.add_done_callback(partial(self._remote_refresh_done, company_id))
+
+    def _remote_refresh_done(self, company_id: str, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Failed to apply remote appointment change for {company_id}: {str(task.exception())}")
+            self.invalidate(company_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Loaded companies and their sizes for the cache stats endpoint"""
+        return {
+            "companies": len(self._indexes),
+            "max_companies": self.max_companies,
+            "bookings": {company_id: len(index) for company_id, index in self._indexes.items()},
+            "load_times_ms": {company_id: round(ms, 1) for company_id, ms in self.load_times_ms.items()}
+        }
+
+schedule_index = ScheduleRegistry()
+
+async def record_appointment_change(db, company_id: str, appointment_id: str):
+    """Apply an appointment write to this worker's schedules and announce it to the others"""
+    await schedule_index.apply_change(db, company_id, appointment_id)
+    await invalidation_bus.publish(APPOINTMENT_CHANNEL, f"{company_id}:{appointment_id}")
+
+def invalidate_company_schedule(company_id: str):
+    """Drop a company's schedules everywhere after bulk appointment changes (e.g. calendar sync)"""
+    if not company_id:
+        return
+    schedule_index.invalidate(company_id)
+    asyncio.ensure_future(invalidation_bus.publish(APPOINTMENT_CHANNEL, f"{company_id}:"))
+
+def apply_remote_appointment_change(key: str, version: Optional[int] = None):
+    """Invalidation bus subscriber for appointment writes made by other workers"""
+    company_id, _, appointment_id = key.partition(":")
+    schedule_index.apply_remote_change(company_id, appointment_id)
+
+invalidation_bus.subscribe(APPOINTMENT_CHANNEL, apply_remote_appointment_change)
@@ -0,0 +1,795 @@
+import os
+import asyncio
+import heapq
+import logging
+import re
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from functools import partial
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from caching import invalidation_bus
+from phones import normalize_phone_e164
+
+logger = logging.getLogger(__name__)
+
+# Companies whose customer index is kept in memory at once (least recently used is dropped)
+CUSTOMER_SEARCH_MAX_COMPANIES = int(os.getenv("CUSTOMER_SEARCH_MAX_COMPANIES", "50"))
+
+# Field weights used for ranking
+NAME_WEIGHT = 3.0
+EMAIL_WEIGHT = 2.0
+ADDRESS_WEIGHT = 1.0
+
+# Minimum trigram similarity for a fuzzy (typo-tolerant) term match
+FUZZY_THRESHOLD = 0.4
+
+# Phone -> customer lookups cached for inbound calls and SMS
+CUSTOMER_PHONE_CACHE_SIZE = int(os.getenv("CUSTOMER_PHONE_CACHE_SIZE", "10000"))
+CUSTOMER_PHONE_CACHE_TTL = float(os.getenv("CUSTOMER_PHONE_CACHE_TTL", "300"))
+
+# Invalidation bus channel for customer writes (key "<company_id>:<customer_id>")
+CUSTOMER_CHANNEL = "customers"
+
+# Customer fields returned in search results
+SUMMARY_FIELDS = ("id", "company_id", "name", "phone", "email", "address", "total_jobs", "last_service", "tags")
+
+_WORD_RE = re.compile(r"[^\w@.+'-]+")
+
+def digits_only(value: Optional[str]) -> str:
+    """Strip everything but digits (phone numbers are matched on digits alone)"""
+    return re.sub(r"\D", "", value or "")
+
+def trigrams(value: str) -> Set[str]:
+    """Padded character trigrams of a term"""
+    padded = f"  {value} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def format_address(address: Any) -> str:
+    """Flatten a customer address dict into one line"""
+    if isinstance(address, dict):
+        return ", ".join(str(value) for value in address.values() if value)
+    return str(address or "")
+
+class _TermIndex:
+    """Sorted term list with postings and a trigram index over the terms.
+
+    Each term maps customer id -> weight, and keeps the customers' (name, id)
+    sort keys per weight in order, so matches can be read off best-first
+    without scoring every customer a broad prefix reaches.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.ordered: Dict[str, Dict[float, List[tuple]]] = {}  # term -> weight -> sorted sort keys
+        self.sorted_terms: List[str] = []
+        self.trigram_terms: Dict[str, Set[str]] = {}
+        self.deferred = False  # Bulk loads append unsorted and sort once at the end
+        self._unsorted: Set[Tuple[str, float]] = set()
+
+    def add(self, term: str, sort_key: tuple, weight: float):
+        postings = self.postings.get(term)
+        if postings is None:
+            postings = self.postings[term] = {}
+            self.ordered[term] = {}
+            if self.deferred:
+                self.sorted_terms.append(term)
+            else:
+                insort(self.sorted_terms, term)
+            for gram in trigrams(term):
+                self.trigram_terms.setdefault(gram, set()).add(term)
+        postings[sort_key[1]] = weight
+        keys = self.ordered[term].setdefault(weight, [])
+        if self.deferred:
+            keys.append(sort_key)
+            self._unsorted.add((term, weight))
+        else:
+            insort(keys, sort_key)
+
+    def discard(self, term: str, sort_key: tuple):
+        postings = self.postings.get(term)
+        if postings is None or sort_key[1] not in postings:
+            return
+        weight = postings.pop(sort_key[1])
+        keys = self.ordered[term][weight]
+        del keys[bisect_left(keys, sort_key)]
+        if not keys:
+            del self.ordered[term][weight]
+        if postings:
+            return
+        del self.postings[term]
+        del self.ordered[term]
+        del self.sorted_terms[bisect_left(self.sorted_terms, term)]
+        for gram in trigrams(term):
+            terms = self.trigram_terms[gram]
+            terms.discard(term)
+            if not terms:
+                del self.trigram_terms[gram]
+
+    def finish_bulk_load(self):
+        self.sorted_terms.sort()
+        for term, weight in self._unsorted:
+            self.ordered[term][weight].sort()
+        self._unsorted = set()
+        self.deferred = False
+
+    def prefix_terms(self, word: str) -> Dict[str, float]:
+        """Term -> score multiplier for terms starting with `word` (an exact match scores double)"""
+        start = bisect_left(self.sorted_terms, word)
+        end = bisect_left(self.sorted_terms, word + "\U0010ffff", start)
+        terms = dict.fromkeys(self.sorted_terms[start:end], 1.0)
+        if word in terms:
+            terms[word] = 2.0
+        return terms
+
+    def fuzzy_terms(self, word: str) -> Dict[str, float]:
+        """Term -> score multiplier for terms similar to `word` by trigram overlap"""
+        word_grams = trigrams(word)
+        shared: Dict[str, int] = {}
+        for gram in word_grams:
+            for term in self.trigram_terms.get(gram, ()):
+                shared[term] = shared.get(term, 0) + 1
+
+        terms = {}
+        for term, overlap in shared.items():
+            # Jaccard similarity; a term of length n has n + 1 padded trigrams
+            similarity = overlap / (len(word_grams) + len(term) + 1 - overlap)
+            if similarity >= FUZZY_THRESHOLD:
+                terms[term] = similarity * 0.8
+        return terms
+
+    def sources(self, terms: Dict[str, float]) -> List[tuple]:
+        """(score, sort keys in name order, True) for every term and weight in `terms`"""
+        return [
+            (weight * multiplier, keys, True)
+            for term, multiplier in terms.items()
+            for weight, keys in self.ordered[term].items()
+        ]
+
+class _EmailIndex:
+    """Email addresses and their customers' sort keys as parallel lists ordered by email.
+
+    Emails are nearly one per customer, so a prefix covers thousands of them;
+    keeping them flat makes that one slice rather than thousands of postings.
+    """
+
+    def __init__(self):
+        self.emails: List[str] = []
+        self.keys: List[tuple] = []
+        self.deferred = False  # Bulk loads append unsorted and sort once at the end
+
+    def _position(self, email: str, sort_key: tuple) -> int:
+        start = bisect_left(self.emails, email)
+        return bisect_left(self.keys, sort_key, start, bisect_right(self.emails, email, start))
+
+    def add(self, email: str, sort_key: tuple):
+        if self.deferred:
+            self.emails.append(email)
+            self.keys.append(sort_key)
+            return
+        position = self._position(email, sort_key)
+        self.emails.insert(position, email)
+        self.keys.insert(position, sort_key)
+
+    def discard(self, email: str, sort_key: tuple):
+        position = self._position(email, sort_key)
+        if position < len(self.keys) and self.keys[position] == sort_key:
+            del self.emails[position]
+            del self.keys[position]
+
+    def finish_bulk_load(self):
+        pairs = sorted(zip(self.emails, self.keys))
+        self.emails = [email for email, _ in pairs]
+        self.keys = [sort_key for _, sort_key in pairs]
+        self.deferred = False
+
+    def prefix_sources(self, word: str) -> List[tuple]:
+        """(score, sort keys, in name order?) for emails equal to, then starting with, `word`"""
+        start = bisect_left(self.emails, word)
+        end = bisect_left(self.emails, word + "\U0010ffff", start)
+        exact = bisect_right(self.emails, word, start, end)
+        # Keys are in name order within one email, not across several
+        return [
+            (EMAIL_WEIGHT * 2.0, self.keys[start:exact], True),
+            (EMAIL_WEIGHT, self.keys[exact:end], end - exact <= 1 or self.emails[exact] == self.emails[end - 1])
+        ]
+
+class _Criterion:
+    """One thing a result must match (a query word, phone or email) and how it scores.
+
+    `sources` are (score, sort keys, keys in name order?) triples covering
+    every match; `score` returns a customer's best score, 0 if it does not
+    match. `postings` (customer id collections covering the same matches)
+    make `ids` cheaper when given.
+    """
+
+    # Ordered lists at one score are merged lazily; past this many they are heapified instead
+    MERGE_LISTS = 64
+
+    def __init__(self, sources: List[tuple], score: Callable[[str], float], postings: Optional[List[Any]] = None):
+        self.sources = [source for source in sources if source[1]]
+        self.score = score
+        self.postings = postings
+        self.size = sum(len(keys) for _, keys, _ in self.sources)
+        self.best = max((level for level, _, _ in self.sources), default=0.0)
+
+    def ids(self) -> Set[str]:
+        if self.postings is not None:
+            return set().union(*self.postings)
+        return {sort_key[1] for _, keys, _ in self.sources for sort_key in keys}
+
+    def walk(self) -> Iterator[Tuple[float, tuple]]:
+        """(score, sort key) of every match, best score first then name order, each customer once"""
+        levels: Dict[float, List[tuple]] = {}
+        for level, keys, in_order in self.sources:
+            levels.setdefault(level, []).append((keys, in_order))
+        seen: Set[str] = set()
+        for level in sorted(levels, reverse=True):
+            lists = levels[level]
+            if len(lists) == 1 and lists[0][1]:
+                ordered = iter(lists[0][0])
+            elif len(lists) <= self.MERGE_LISTS and all(in_order for _, in_order in lists):
+                ordered = heapq.merge(*(keys for keys, _ in lists))
+            else:
+                heap = list(chain.from_iterable(keys for keys, _ in lists))
+                heapq.heapify(heap)
+                ordered = (heapq.heappop(heap) for _ in range(len(heap)))
+            for sort_key in ordered:
+                if sort_key[1] not in seen:
+                    seen.add(sort_key[1])
+                    yield level, sort_key
+
+class CustomerSearchIndex:
+    """In-memory type-ahead index over one company's customers.
+
+    - Name and address words are prefix-matched through a sorted term list
+      (bisect), weighted by field; words with few prefix hits fall back to
+      trigram similarity so small typos still find the customer.
+    - Email addresses live in their own term list and are consulted when the
+      text fields come up short or the query looks like an email.
+    - Phone numbers are matched as digit substrings through a digit-trigram
+      index, whatever formatting was typed or stored.
+
+    A search walks the narrowest criterion best-first in name order and
+    stops as soon as no later match can reach the page, so a one-letter
+    query costs about as much as a precise one.
+    """
+
+    # Candidates a multi-word search walks before intersecting id sets instead
+    WALK_BUDGET = 25  # per result wanted
+
+    # Postings across criteria up to which an early-stopped search still counts its total exactly
+    COUNT_LIMIT = 100000
+
+    def __init__(self, company_id: str):
+        self.company_id = company_id
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self._record_terms: Dict[str, Dict[str, float]] = {}  # customer id -> term -> weight
+        self._sort_keys: Dict[str, tuple] = {}  # customer id -> (name, id) tie-break order
+        self._text = _TermIndex()
+        self._emails = _EmailIndex()
+        self._phone_digits: Dict[str, str] = {}  # customer id -> digits
+        self._digit_trigrams: Dict[str, Set[str]] = {}  # digit trigram -> customer ids
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @staticmethod
+    def extract_terms(customer: Dict[str, Any]) -> Dict[str, float]:
+        """Name and address terms of a customer with the weight of the best field they appear in"""
+        terms: Dict[str, float] = {}
+
+        def add(words, weight):
+            for word in words:
+                word = word.strip(".'-")
+                if word and terms.get(word, 0) < weight:
+                    terms[word] = weight
+
+        name = (customer.get("name") or "").lower()
+        # Hyphenated names are searchable whole and by part
+        add(set(_WORD_RE.split(name)) | set(re.split(r"[^\w]+", name)), NAME_WEIGHT)
+        add(re.split(r"[^\w]+", format_address(customer.get("address")).lower()), ADDRESS_WEIGHT)
+        return terms
+
+    def bulk_load(self, customers):
+        """Index many customers, sorting the term lists once at the end"""
+        customers = {customer["id"]: customer for customer in customers}
+        for customer_id in customers:
+            self.remove(customer_id)
+        self._text.deferred = self._emails.deferred = True
+        try:
+            for customer in customers.values():
+                self._add(customer)
+        finally:
+            self._text.finish_bulk_load()
+            self._emails.finish_bulk_load()
+
+    def upsert(self, customer: Dict[str, Any]):
+        """Add a customer or replace its previous entry"""
+        self.remove(customer["id"])
+        self._add(customer)
+
+    def _add(self, customer: Dict[str, Any]):
+        customer_id = customer["id"]
+        record = {field: customer.get(field) for field in SUMMARY_FIELDS}
+        self.records[customer_id] = record
+        sort_key = self._sort_keys[customer_id] = ((record.get("name") or "").lower(), customer_id)
+        terms = self.extract_terms(customer)
+        self._record_terms[customer_id] = terms
+        for term, weight in terms.items():
+            self._text.add(term, sort_key, weight)
+
+        email = (record.get("email") or "").lower()
+        if email:
+            self._emails.add(email, sort_key)
+
+        digits = digits_only(record.get("phone"))
+        if digits:
+            self._phone_digits[customer_id] = digits
+            for i in range(len(digits) - 2):
+                self._digit_trigrams.setdefault(digits[i:i + 3], set()).add(customer_id)
+
+    def remove(self, customer_id: str):
+        """Drop a customer from the index (no-op if absent)"""
+        record = self.records.pop(customer_id, None)
+        if record is None:
+            return
+
+        sort_key = self._sort_keys.pop(customer_id)
+        for term in self._record_terms.pop(customer_id, {}):
+            self._text.discard(term, sort_key)
+        if record.get("email"):
+            self._emails.discard(record["email"].lower(), sort_key)
+
+        digits = self._phone_digits.pop(customer_id, "")
+        for i in range(len(digits) - 2):
+            ids = self._digit_trigrams.get(digits[i:i + 3])
+            if ids is not None:
+                ids.discard(customer_id)
+                if not ids:
+                    del self._digit_trigrams[digits[i:i + 3]]
+
+    def _phone_matches(self, digits: str) -> Dict[str, float]:
+        """Customer id -> score for phones containing `digits`"""
+        grams = sorted({digits[i:i + 3] for i in range(len(digits) - 2)},
+                       key=lambda gram: len(self._digit_trigrams.get(gram, ())))
+        candidates: Optional[Set[str]] = None
+        for gram in grams:
+            ids = self._digit_trigrams.get(gram)
+            if not ids:
+                return {}
+            candidates = set(ids) if candidates is None else candidates & ids
+            if not candidates:
+                return {}
+
+        scores = {}
+        for customer_id in candidates or ():
+            phone = self._phone_digits[customer_id]
+            if digits in phone:
+                # The whole number beats a fragment of it
+                scores[customer_id] = 5.0 if len(digits) >= 10 and phone.endswith(digits) else 3.0
+        return scores
+
+    def _phone_criterion(self, digits: str) -> _Criterion:
+        scores = self._phone_matches(digits) if len(digits) >= 3 else {}
+        levels: Dict[float, List[tuple]] = {}
+        for customer_id, score in scores.items():
+            levels.setdefault(score, []).append(self._sort_keys[customer_id])
+        return _Criterion(
+            [(score, sorted(keys), True) for score, keys in levels.items()],
+            lambda customer_id: scores.get(customer_id, 0), [scores]
+        )
+
+    def _email_score(self, customer_id: str, prefix: str) -> float:
+        email = (self.records[customer_id].get("email") or "").lower()
+        if not email.startswith(prefix):
+            return 0
+        return EMAIL_WEIGHT * 2.0 if email == prefix else EMAIL_WEIGHT
+
+    def _email_criterion(self, prefix: str) -> _Criterion:
+        return _Criterion(self._emails.prefix_sources(prefix), partial(self._email_score, prefix=prefix))
+
+    def _word_criterion(self, word: str, wanted: int) -> _Criterion:
+        """Name and address terms for one query word, widened to emails and typos when they come up short"""
+        text = self._text.prefix_terms(word)
+        sources = self._text.sources(text)
+        with_emails = False
+
+        def short():
+            postings = None if with_emails else [self._text.postings[term] for term in text]
+            criterion = _Criterion(sources, None, postings)
+            if criterion.size < wanted:
+                return True
+            # Postings overcount customers matched through several terms; count exactly when it could matter
+            return criterion.size <= 4 * wanted and len(criterion.ids()) < wanted
+
+        with_emails = "@" in word or "." in word or short()
+        if with_emails:
+            sources += self._emails.prefix_sources(word)
+        if len(word) >= 3 and short():
+            fuzzy = {term: multiplier for term, multiplier in self._text.fuzzy_terms(word).items()
+                     if text.get(term, 0) < multiplier}
+            text.update(fuzzy)
+            sources += self._text.sources(fuzzy)
+
+        def score(customer_id):
+            best = self._email_score(customer_id, word) if with_emails else 0
+            for term, weight in self._record_terms[customer_id].items():
+                multiplier = text.get(term)
+                if multiplier is not None and weight * multiplier > best:
+                    best = weight * multiplier
+            return best
+
+        # Email matches are only in the sources, so their ids come from there
+        postings = None if with_emails else [self._text.postings[term] for term in text]
+        return _Criterion(sources, score, postings)
+
+    def search(
+        self,
+        q: Optional[str] = None,
+        phone: Optional[str] = None,
+        email: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> Tuple[List[Dict[str, Any]], int, bool]:
+        """Ranked matches for the query; every criterion given must match.
+
+        Returns the page, the total matches and whether that total is exact;
+        it is estimated when the search stopped as soon as the page was settled.
+        """
+        criteria: List[_Criterion] = []
+        wanted = offset + limit
+
+        q = (q or "").strip().lower()
+        if q and not re.search(r"[^\d\s()+.-]", q) and len(digits_only(q)) >= 3:
+            # Looks like a phone number
+            criteria.append(self._phone_criterion(digits_only(q)))
+        else:
+            for word in _WORD_RE.split(q):
+                word = word.strip(".'-")
+                if word:
+                    criteria.append(self._word_criterion(word, wanted))
+
+        if phone:
+            criteria.append(self._phone_criterion(digits_only(phone)))
+        if email:
+            criteria.append(self._email_criterion(email.strip().lower()))
+
+        if not criteria:
+            return [], 0, True
+
+        criteria.sort(key=lambda criterion: criterion.size)
+        # Several criteria walk a bounded number of candidates, then intersect instead
+        budget = None if len(criteria) == 1 else self.WALK_BUDGET * wanted
+        walked = self._walk(criteria, wanted, budget)
+        if walked is None:
+            matches, total, complete = self._intersect(criteria)
+        else:
+            matches, total, complete = walked
+            if not complete and len(criteria) > 1 and sum(criterion.size for criterion in criteria) <= self.COUNT_LIMIT:
+                total, complete = len(set.intersection(*(criterion.ids() for criterion in criteria))), True
+
+        page = [
+            {**self.records[sort_key[1]], "score": round(-score, 3)}
+            for score, sort_key in heapq.nsmallest(wanted, matches)[offset:]
+        ]
+        return page, total, complete
+
+    def _walk(self, criteria: List[_Criterion], wanted: int, budget: Optional[int]):
+        """Matches read best-first off the narrowest criterion, stopping once the page is settled.
+
+        Returns (matches, total, exact), or None when `budget` candidates did
+        not settle the page. An unfinished walk estimates the total.
+        """
+        driver, others = criteria[0], criteria[1:]
+        headroom = sum(criterion.best for criterion in others)
+
+        matches: List[tuple] = []  # (-score, sort key)
+        current_level, bound, above, at_bound = None, 0.0, 0, 0
+        for scanned, (level, sort_key) in enumerate(driver.walk()):
+            if level != current_level:
+                # No later match can score more than `bound`; matches above it, and matches
+                # at it from this level (which precede later ones by name), are settled
+                current_level, bound = level, level + headroom
+                above = sum(1 for score, _ in matches if -score > bound)
+                at_bound = 0
+            if above + at_bound >= wanted:
+                return matches, max(len(matches), round(driver.size * len(matches) / scanned)), False
+            if budget is not None and scanned >= budget:
+                return None
+
+            score = level
+            for criterion in others:
+                other = criterion.score(sort_key[1])
+                if not other:
+                    break
+                score += other
+            else:
+                matches.append((-score, sort_key))
+                if score >= bound:
+                    at_bound += 1
+        return matches, len(matches), True
+
+    def _intersect(self, criteria: List[_Criterion]):
+        """Every match, found by intersecting the criteria's id sets smallest first"""
+        candidates = criteria[0].ids()
+        for criterion in criteria[1:]:
+            if criterion.size > 8 * len(candidates):
+                break  # Cheaper to let scoring reject the rest
+            candidates &= criterion.ids()
+
+        matches = []
+        for customer_id in candidates:
+            score = 0.0
+            for criterion in criteria:
+                matched = criterion.score(customer_id)
+                if not matched:
+                    break
+                score += matched
+            else:
+                matches.append((-score, self._sort_keys[customer_id]))
+        return matches, len(matches), True
+
+class CustomerSearchRegistry:
+    """Per-company CustomerSearchIndex instances, loaded lazily from MongoDB.
+
+    Customer writes reach the loaded indexes through `record_customer_change`
+    (this worker) and the invalidation bus (other workers), which re-read
+    just the changed customer.
+
+    Building a large index takes seconds of CPU, so it runs in a thread and
+    searches for that company are answered from MongoDB until it is ready.
+    """
+
+    LOAD_BATCH_SIZE = 5000
+
+    def __init__(self, max_companies: int = CUSTOMER_SEARCH_MAX_COMPANIES):
+        self.max_companies = max_companies
+        self._indexes: "OrderedDict[str, CustomerSearchIndex]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._pending: Dict[str, Set[str]] = {}  # customers changed while their company was loading
+        self.load_times_ms: Dict[str, float] = {}
+
+    async def get_index(self, db, company_id: str) -> CustomerSearchIndex:
+        """The company's index, loading it on first use (concurrent callers share one load)"""
+        index = self._indexes.get(company_id)
+        if index is not None:
+            self._indexes.move_to_end(company_id)
+            return index
+
+        return await asyncio.shield(self._start_load(db, company_id))
+
+    def _start_load(self, db, company_id: str) -> asyncio.Task:
+        task = self._loading.get(company_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(db, company_id))
+            task.add_done_callback(partial(self._load_done, company_id))
+            self._loading[company_id] = task
+        return task
+
+    def _load_done(self, company_id: str, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Failed to load customer search index for {company_id}: {str(task.exception())}")
+
+    async def _load(self, db, company_id: str) -> CustomerSearchIndex:
+        started = time.perf_counter()
+        self._pending[company_id] = set()
+        try:
+            index = CustomerSearchIndex(company_id)
+            projection = {"_id": 0, **{field: 1 for field in SUMMARY_FIELDS}}
+            cursor = db.customers.find({"company_id": company_id}, projection).batch_size(self.LOAD_BATCH_SIZE)
+            customers = []
+            while True:
+                batch = await cursor.to_list(self.LOAD_BATCH_SIZE)
+                if not batch:
+                    break
+                customers.extend(batch)
+            # CPU-bound; the index is private until loaded, and the thread leaves the event loop serving
+            await asyncio.to_thread(index.bulk_load, customers)
+
+            self._indexes[company_id] = index
+            while len(self._indexes) > self.max_companies:
+                self._indexes.popitem(last=False)
+
+            # Re-read customers written while the load was running
+            for customer_id in self._pending.pop(company_id, set()):
+                await self.refresh_customer(db, company_id, customer_id)
+        finally:
+            self._pending.pop(company_id, None)
+            self._loading.pop(company_id, None)
+
+        self.load_times_ms[company_id] = (time.perf_counter() - started) * 1000
+        logger.info(f"Loaded customer search index for {company_id}: {len(index)} customers "
+                    f"in {self.load_times_ms[company_id]:.0f}ms")
+        return index
+
+    async def search(self, db, company_id: str, **criteria) -> Tuple[List[Dict[str, Any]], int, bool]:
+        """Search one company's customers (see CustomerSearchIndex.search)"""
+        index = self._indexes.get(company_id)
+        if index is None:
+            self._start_load(db, company_id)
+            return await self._fallback_search(db, company_id, **criteria)
+        self._indexes.move_to_end(company_id)
+        return index.search(**criteria)
+
+    @staticmethod
+    async def _fallback_search(
+        db,
+        company_id: str,
+        q: Optional[str] = None,
+        phone: Optional[str] = None,
+        email: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> Tuple[List[Dict[str, Any]], int, bool]:
+        """Name/email prefix and phone digit matches in name order, served while the index loads"""
+        clauses = []
+        phones = [phone] if phone else []
+        q = (q or "").strip().lower()
+        if q and not re.search(r"[^\d\s()+.-]", q) and len(digits_only(q)) >= 3:
+            phones.append(q)
+        else:
+            for word in _WORD_RE.split(q):
+                word = re.escape(word.strip(".'-"))
+                if word:
+                    clauses.append({"$or": [
+                        {"name": {"$regex": f"(^|[^\\w]){word}", "$options": "i"}},
+                        {"email": {"$regex": f"^{word}", "$options": "i"}}
+                    ]})
+        for value in phones:
+            if len(digits_only(value)) < 3:
+                return [], 0, True
+            clauses.append({"phone_e164": {"$regex": digits_only(value)}})
+        if email:
+            clauses.append({"email": {"$regex": f"^{re.escape(email.strip())}", "$options": "i"}})
+        if not clauses:
+            return [], 0, True
+
+        projection = {"_id": 0, **{field: 1 for field in SUMMARY_FIELDS}}
+        customers = await db.customers.find({"company_id": company_id, "$and": clauses}, projection).sort(
+            "name", 1
+        ).skip(offset).limit(limit + 1).to_list(limit + 1)
+        return customers[:limit], offset + len(customers[:limit]), len(customers) <= limit
+
+    async def refresh_customer(self, db, company_id: str, customer_id: str):
+        """Re-read one customer into a loaded index (companies not in memory are skipped)"""
+        if company_id in self._pending:
+            self._pending[company_id].add(customer_id)
+            return
+        index = self._indexes.get(company_id)
+        if index is None:
+            return
+
+        customer = await db.customers.find_one({"id": customer_id}, {"_id": 0})
+        if customer and customer.get("company_id") == company_id:
+            index.upsert(customer)
+        else:
+            index.remove(customer_id)
+
+    async def apply_change(self, db, company_id: str, customer_id: str):
+        """Apply a customer write made by this worker"""
+        try:
+            await self.refresh_customer(db, company_id, customer_id)
+        except Exception as e:
+            # Drop the index rather than serve results that miss the write
+            logger.error(f"Failed to refresh customer {customer_id} in search index: {str(e)}")
+            self.invalidate(company_id)
+
+    def invalidate(self, company_id: str):
+        """Drop a company's index; it is rebuilt on the next search"""
+        self._indexes.pop(company_id, None)
+
+    def apply_remote_change(self, company_id: str, customer_id: str):
+        """Apply a customer write announced by another worker"""
+        if company_id not in self._indexes and company_id not in self._pending:
+            return
+        if invalidation_bus.db is None or not customer_id:
+            self.invalidate(company_id)
+            return
+        task = asyncio.ensure_future(self.refresh_customer(invalidation_bus.db, company_id, customer_id))
+        task.add_done_callback(partial(self._remote_refresh_done, company_id))
+
+    def _remote_refresh_done(self, company_id: str, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Failed to apply remote customer change for {company_id}: {str(task.exception())}")
+            self.invalidate(company_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Loaded companies and their sizes for the cache stats endpoint"""
+        return {
+            "companies": len(self._indexes),
+            "max_companies": self.max_companies,
+            "customers": {company_id: len(index) for company_id, index in self._indexes.items()},
+            "loading": sorted(self._loading),
+            "load_times_ms": {company_id: round(ms, 1) for company_id, ms in self.load_times_ms.items()}
+        }
+
+class CustomerPhoneDirectory:
+    """LRU of E.164 phone number -> customer for the inbound call and SMS paths.
+
+    Misses go to the (company_id, phone_e164) index. Only found customers are
+    cached, so a first-time caller is recognised as soon as they are created,
+    and entries are dropped whenever their customer changes in any worker.
+    """
+
+    def __init__(self, max_entries: int = CUSTOMER_PHONE_CACHE_SIZE, ttl: float = CUSTOMER_PHONE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # (company_id, phone) -> (customer, stored_at)
+        self._keys_by_customer: Dict[str, Set[tuple]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def lookup(self, db, phone: Optional[str], company_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """The customer with this phone number in any format, optionally within one company"""
+        phone_e164 = normalize_phone_e164(phone)
+        if not phone_e164:
+            return None
+
+        key = (company_id, phone_e164)
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[1] < self.ttl:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        query = {"phone_e164": phone_e164}
+        if company_id:
+            query["company_id"] = company_id
+        customer = await db.customers.find_one(query, {"_id": 0})
+        if customer is not None:
+            self._store(key, customer)
+        return customer
+
+    def _store(self, key: tuple, customer: Dict[str, Any]):
+        self.forget_key(key)
+        self._entries[key] = (customer, time.monotonic())
+        self._keys_by_customer.setdefault(customer["id"], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self.forget_key(next(iter(self._entries)))
+
+    def forget_key(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._keys_by_customer.get(entry[0]["id"])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_customer[entry[0]["id"]]
+
+    def forget(self, customer_id: str):
+        """Drop every cached lookup that resolved to this customer"""
+        for key in list(self._keys_by_customer.get(customer_id, ())):
+            self.forget_key(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for the cache stats endpoint"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None
+        }
+
+customer_search = CustomerSearchRegistry()
+customer_phone_directory = CustomerPhoneDirectory()
+
+async def record_customer_change(db, company_id: str, customer_id: str):
+    """Apply a customer write to this worker's lookups and announce it to the others"""
+    customer_phone_directory.forget(customer_id)
+    await customer_search.apply_change(db, company_id, customer_id)
+    await invalidation_bus.publish(CUSTOMER_CHANNEL, f"{company_id}:{customer_id}")
+
+def apply_remote_customer_change(key: str, version: Optional[int] = None):
+    """Invalidation bus subscriber for customer writes made by other workers"""
+    company_id, _, customer_id = key.partition(":")
+    customer_phone_directory.forget(customer_id)
+    customer_search.apply_remote_change(company_id, customer_id)
+
+invalidation_bus.subscribe(CUSTOMER_CHANNEL, apply_remote_customer_change)
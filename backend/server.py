@@ -1,22 +1,38 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Request, Query
+from fastapi import FastAPI, HTTPException, Depends, status, Request, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 from dotenv import load_dotenv
 from pathlib import Path
 import os
+import asyncio
 import logging
 import uuid
 import random
+import json
 from collections import defaultdict
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 
 # Import models and services
 from models import *
 from phase2_models import *
 from auth import *
 from services import *
+from query_fanout import QueryFanout
+from caching import *
+from search_index import customer_search, customer_phone_directory, record_customer_change
+from schedule_index import (
+    schedule_index, record_appointment_change, invalidate_company_schedule,
+    booking_interval, parse_scheduled_date
+)
+from phones import normalize_phone_e164
+from geo import point_from_location
+from compression import CompressionMiddleware
+from events import EventBroadcaster, ChangeStreamListener, format_sse, SSE_HEARTBEAT_SECONDS
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
@@ -34,6 +50,31 @@ mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ.get('DB_NAME', 'hvac_assistant')]
 
+def on_calendar_appointments_changed(company_id: str):
+    """Calendar-side edits can move appointments: drop cached dashboards and schedules"""
+    invalidate_company_dashboards(company_id)
+    invalidate_company_schedule(company_id)
+
+# Background calendar sync (push local changes, pull calendar-side edits)
+calendar_sync_worker = CalendarSyncWorker(db, get_calendar_service())
+calendar_sync_engine = CalendarSyncEngine(db, get_calendar_service(), on_calendar_appointments_changed)
+location_ingest = LocationIngestBuffer(db)
+
+def on_live_change(company_id: Optional[str], collection: str):
+    """Changes streamed to dashboards also make their cached snapshot stale"""
+    if collection not in ("appointments", "jobs"):
+        return
+    if company_id:
+        invalidate_company_dashboards(company_id)
+    else:
+        # A delete we could not attribute to a company
+        dashboard_cache.clear()
+        owner_insights_cache.clear()
+
+# Live dashboard events (change streams fanned out over server-sent events)
+event_broadcaster = EventBroadcaster()
+change_listener = ChangeStreamListener(db, event_broadcaster, on_change=on_live_change)
+
 # Create FastAPI app
 app = FastAPI(title="HVAC Assistant API", version="2.0.0")
 
@@ -44,8 +85,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Has-More"],  # Paging flag read by the frontend
 )
 
+# ETag / If-None-Match for JSON GETs that do not set their own ETag
+app.add_middleware(ConditionalGetMiddleware)
+
+# gzip/brotli responses (outermost, so ETags above are computed on the uncompressed body);
+# webhook replies are a few bytes of TwiML/JSON and skip it
+app.add_middleware(CompressionMiddleware, exclude_paths=("/api/webhooks/", "/api/voice/"))
+
+async def version_etag(collection: str, company_id: str, *parts: Any) -> Optional[str]:
+    """Weak ETag for a company's collection at its current change version (None if unavailable).
+    
+    Read the version before the data: a write in between then only costs the
+    client one extra download, never a stale 304.
+    """
+    try:
+        version = await change_versions.get(db, collection, company_id)
+    except Exception as e:
+        logger.warning(f"Could not read {collection} change version: {str(e)}")
+        return None
+    return weak_etag(collection, company_id, version, *parts)
+
+def not_modified(request: Request, etag: Optional[str]) -> Optional[Response]:
+    """A 304 response if the client's If-None-Match already matches `etag`"""
+    if etag and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return None
+
 # ==================== AUTHENTICATION ENDPOINTS ====================
 
 @app.post("/api/admin/login")
@@ -88,6 +156,7 @@ async def create_company(company: CompanyCreate, current_user: dict = Depends(re
     """Create new company (admin only)"""
     company_obj = Company(**company.dict())
     await db.companies.insert_one(company_obj.dict())
+    await publish_settings_change(company_obj.id)
     return company_obj
 
 @app.get("/api/companies", response_model=List[Company])
@@ -107,20 +176,30 @@ async def get_company(company_id: str, current_user: dict = Depends(get_current_
 @app.put("/api/companies/{company_id}", response_model=Company)
 async def update_company(company_id: str, company_data: dict, current_user: dict = Depends(require_owner_or_admin)):
     """Update company information"""
-    await db.companies.update_one(
-        {"id": company_id},
-        {"$set": {**company_data, "updated_at": datetime.utcnow()}}
-    )
+    # Company fields feed the settings payload, so this is a settings write (new version and ETag)
+    company_data.pop("settings_version", None)
+    await write_company_settings(company_id, {"$set": {**company_data, "updated_at": datetime.utcnow()}})
     updated_company = await db.companies.find_one({"id": company_id})
     return Company(**updated_company)
 
 # ==================== CUSTOMER MANAGEMENT ENDPOINTS ====================
 
+async def geocode_customer_address(address: Any) -> Optional[Dict[str, Any]]:
+    """GeoJSON point for a customer address; None (not an error) if geocoding fails"""
+    try:
+        return point_from_location(await geocoding_service.geocode(address))
+    except Exception as e:
+        logger.warning(f"Failed to geocode customer address: {str(e)}")
+        return None
+
 @app.post("/api/customers", response_model=Customer)
 async def create_customer(customer: CustomerCreate, current_user: dict = Depends(get_current_user)):
     """Create new customer"""
     customer_obj = Customer(**customer.dict())
+    customer_obj.calculate_phone_e164()
+    customer_obj.location = await geocode_customer_address(customer_obj.address)
     await db.customers.insert_one(customer_obj.dict())
+    await record_customer_change(db, customer_obj.company_id, customer_obj.id)
     return customer_obj
 
 @app.get("/api/customers", response_model=List[Customer])
@@ -134,6 +213,35 @@ async def list_customers(
     customers = await db.customers.find({"company_id": company_id}).skip(skip).limit(limit).to_list(limit)
     return [Customer(**cust) for cust in customers]
 
+@app.get("/api/customers/search")
+async def search_customers(
+    q: Optional[str] = None,
+    phone: Optional[str] = None,
+    email: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: dict = Depends(get_current_user)
+):
+    """Type-ahead customer search over name, email, address and phone digits, best matches first"""
+    
+    try:
+        company_id = current_user.get("company_id", "company-001")
+        customers, total, total_exact = await customer_search.search(
+            db, company_id, q=q, phone=phone, email=email, limit=limit, offset=offset
+        )
+        
+        return {
+            "customers": customers,
+            "total": total,
+            "total_exact": total_exact,
+            "limit": limit,
+            "offset": offset
+        }
+        
+    except Exception as e:
+        logger.error(f"Failed to search customers: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/customers/{customer_id}", response_model=Customer)
 async def get_customer(customer_id: str, current_user: dict = Depends(get_current_user)):
     """Get customer details"""
@@ -145,19 +253,27 @@ async def get_customer(customer_id: str, current_user: dict = Depends(get_curren
 @app.put("/api/customers/{customer_id}", response_model=Customer)
 async def update_customer(customer_id: str, customer_data: dict, current_user: dict = Depends(get_current_user)):
     """Update customer information"""
+    if "phone" in customer_data:
+        customer_data["phone_e164"] = normalize_phone_e164(customer_data["phone"])
+    if "address" in customer_data:
+        customer_data["location"] = await geocode_customer_address(customer_data["address"])
     await db.customers.update_one(
         {"id": customer_id},
         {"$set": {**customer_data, "updated_at": datetime.utcnow()}}
     )
     updated_customer = await db.customers.find_one({"id": customer_id})
+    if not updated_customer:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    await record_customer_change(db, updated_customer["company_id"], customer_id)
     return Customer(**updated_customer)
 
 @app.delete("/api/customers/{customer_id}")
 async def delete_customer(customer_id: str, current_user: dict = Depends(get_current_user)):
     """Delete customer"""
-    result = await db.customers.delete_one({"id": customer_id})
-    if result.deleted_count == 0:
+    deleted = await db.customers.find_one_and_delete({"id": customer_id}, {"company_id": 1})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Customer not found")
+    await record_customer_change(db, deleted["company_id"], customer_id)
     return {"message": "Customer deleted successfully"}
 
 # ==================== TECHNICIAN MANAGEMENT ENDPOINTS ====================
@@ -166,17 +282,67 @@ async def delete_customer(customer_id: str, current_user: dict = Depends(get_cur
 async def create_technician(technician: TechnicianCreate, current_user: dict = Depends(get_current_user)):
     """Create new technician"""
     technician_obj = Technician(**technician.dict())
+    technician_obj.calculate_search_fields()
+    technician_obj.calculate_location()
     await db.technicians.insert_one(technician_obj.dict())
+    await change_versions.bump(db, "technicians", technician_obj.company_id)
     return technician_obj
 
 @app.get("/api/technicians", response_model=List[Technician])
 async def list_technicians(
+    request: Request,
+    response: Response,
     company_id: str = Query(...),
     current_user: dict = Depends(get_current_user)
 ):
-    """List technicians for company"""
+    """List technicians for company (304 if unchanged since the client's ETag)"""
+    etag = await version_etag("technicians", company_id)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    
     technicians = await db.technicians.find({"company_id": company_id}).to_list(100)
-    return [Technician(**tech) for tech in technicians]
+    technician_objs = [Technician(**tech) for tech in technicians]
+    for technician_obj in technician_objs:
+        technician_obj.calculate_average_rating()
+    if etag:
+        response.headers["ETag"] = etag
+    return technician_objs
+
+@app.get("/api/technicians/search")
+async def search_technicians(
+    q: Optional[str] = None,
+    status: Optional[TechnicianStatus] = None,
+    skill: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=TechnicianSearchService.MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Search technicians by name/email prefix, status and skill.
+    
+    Pass the returned `next_cursor` as `cursor` to page through results;
+    `offset` is still accepted for older clients.
+    """
+    
+    try:
+        company_id = current_user.get("company_id", "company-001")
+        search_service = get_technician_search_service(db)
+        return await search_service.search(
+            company_id,
+            q=q,
+            status=status.value if status else None,
+            skill=skill,
+            limit=limit,
+            cursor=cursor,
+            offset=offset
+        )
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to search technicians: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/technicians/{technician_id}", response_model=Technician)
 async def get_technician(technician_id: str, current_user: dict = Depends(get_current_user)):
@@ -184,7 +350,9 @@ async def get_technician(technician_id: str, current_user: dict = Depends(get_cu
     technician = await db.technicians.find_one({"id": technician_id})
     if not technician:
         raise HTTPException(status_code=404, detail="Technician not found")
-    return Technician(**technician)
+    technician_obj = Technician(**technician)
+    technician_obj.calculate_average_rating()
+    return technician_obj
 
 @app.put("/api/technicians/{technician_id}", response_model=Technician)
 async def update_technician(technician_id: str, technician_data: dict, current_user: dict = Depends(get_current_user)):
@@ -194,36 +362,195 @@ async def update_technician(technician_id: str, technician_data: dict, current_u
         {"$set": {**technician_data, "updated_at": datetime.utcnow()}}
     )
     updated_technician = await db.technicians.find_one({"id": technician_id})
-    return Technician(**updated_technician)
+    if not updated_technician:
+        raise HTTPException(status_code=404, detail="Technician not found")
+    technician_obj = Technician(**updated_technician)
+    technician_obj.calculate_average_rating()
+    
+    # Keep the derived search keys and geo point in step with the edit
+    technician_obj.calculate_search_fields()
+    technician_obj.calculate_location()
+    await db.technicians.update_one(
+        {"id": technician_id},
+        {"$set": {
+            "search_terms": technician_obj.search_terms,
+            "skill_keys": technician_obj.skill_keys,
+            "location": technician_obj.location
+        }}
+    )
+    await change_versions.bump(db, "technicians", technician_obj.company_id)
+    return technician_obj
+
+# ==================== DISPATCH ENDPOINTS ====================
+
+MAX_LOCATION_PINGS = 1000
+
+@app.post("/api/technicians/locations:batch", status_code=202)
+async def ingest_technician_locations(batch: LocationPingBatch, current_user: dict = Depends(get_current_user)):
+    """Accept GPS pings from technician apps; positions are written in bulk every few seconds"""
+    
+    if len(batch.pings) > MAX_LOCATION_PINGS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_LOCATION_PINGS} pings per request")
+    
+    company_id = current_user.get("company_id", "company-001")
+    technician_ids = {ping.technician_id for ping in batch.pings}
+    if technician_ids:
+        query = {"company_id": company_id, "id": {"$in": list(technician_ids)}}
+        if current_user.get("role") == UserRole.TECHNICIAN.value:
+            # A technician's device reports only its own position
+            query["user_id"] = current_user.get("sub")
+        unknown = technician_ids - set(await db.technicians.distinct("id", query))
+        if unknown:
+            raise HTTPException(
+                status_code=403, detail=f"Not allowed to report locations for: {', '.join(sorted(unknown))}"
+            )
+    
+    for ping in batch.pings:
+        location_ingest.add(company_id, ping.dict())
+    
+    return {"accepted": len(batch.pings)}
+
+@app.get("/api/dispatch/nearest")
+async def get_nearest_technicians(
+    customer_id: Optional[str] = None,
+    job_id: Optional[str] = None,
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    specialty: Optional[str] = None,
+    k: int = Query(5, ge=1, le=DispatchService.MAX_RESULTS),
+    max_distance_km: Optional[float] = Query(None, gt=0),
+    current_user: dict = Depends(get_current_user)
+):
+    """Closest available technicians to a job, customer or point, optionally with a specialty"""
+    
+    try:
+        company_id = current_user.get("company_id", "company-001")
+        
+        if lat is None or lng is None:
+            if job_id:
+                job = await db.jobs.find_one({"id": job_id, "company_id": company_id}, {"customer_id": 1})
+                if not job:
+                    raise HTTPException(status_code=404, detail="Job not found")
+                customer_id = job.get("customer_id")
+            if not customer_id:
+                raise HTTPException(status_code=400, detail="Provide lat/lng, customer_id or job_id")
+            
+            customer = await db.customers.find_one(
+                {"id": customer_id, "company_id": company_id}, {"location": 1, "address": 1}
+            )
+            if not customer:
+                raise HTTPException(status_code=404, detail="Customer not found")
+            
+            location = customer.get("location")
+            if not location:
+                # Customers created before geocoding: geocode once and keep the result
+                location = await geocode_customer_address(customer.get("address"))
+                if not location:
+                    raise HTTPException(status_code=422, detail="Customer address could not be geocoded")
+                await db.customers.update_one({"id": customer_id}, {"$set": {"location": location}})
+            lng, lat = location["coordinates"]
+        
+        dispatch_service = get_dispatch_service(db)
+        technicians = await dispatch_service.nearest_technicians(
+            company_id, lat, lng, specialty=specialty, k=k, max_distance_km=max_distance_km
+        )
+        
+        return {
+            "origin": {"lat": lat, "lng": lng},
+            "technicians": technicians
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to find nearest technicians: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/dispatch/routes")
+async def plan_technician_routes(
+    date: str = Query(..., description="Date in YYYY-MM-DD format"),
+    technician_id: Optional[List[str]] = Query(None),
+    respect_assignments: bool = True,
+    current_user: dict = Depends(get_current_user)
+):
+    """Ordered routes for the day's appointments that respect time windows and durations"""
+    
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date, expected YYYY-MM-DD")
+    
+    try:
+        company_id = current_user.get("company_id", "company-001")
+        route_planning_service = get_route_planning_service(db)
+        return await route_planning_service.plan_day(
+            company_id, day, technician_ids=technician_id, respect_assignments=respect_assignments
+        )
+    except Exception as e:
+        logger.error(f"Failed to plan technician routes: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
 # ==================== APPOINTMENT MANAGEMENT ENDPOINTS ====================
 
+def double_booking_error(technician_id: str, conflicts: List[Dict[str, Any]]) -> HTTPException:
+    return HTTPException(
+        status_code=409,
+        detail={
+            "message": "Technician is already booked at this time",
+            "technician_id": technician_id,
+            "conflicts": jsonable_encoder(conflicts)
+        }
+    )
+
+async def ensure_technician_free(company_id: str, appointment: Dict[str, Any], exclude_id: Optional[str] = None):
+    """Raise 409 if the appointment would double-book its technician"""
+    interval = booking_interval(appointment)
+    if interval is None:
+        return
+    conflicts = await schedule_index.find_conflicts(
+        db, company_id, appointment["technician_id"], *interval, exclude_id=exclude_id
+    )
+    if conflicts:
+        raise double_booking_error(appointment["technician_id"], conflicts)
+
+async def find_stored_double_booking(
+    company_id: str, appointment: Dict[str, Any], exclude_id: Optional[str] = None
+) -> Optional[HTTPException]:
+    """The 409 to raise if a booking just written overlaps another stored one, else None
+
+    schedule_index.lock only serialises bookings within one worker, so two
+    workers can both pass ensure_technician_free for the same slot. Callers
+    re-check MongoDB after writing and roll their write back on a conflict;
+    if two racing writes see each other both roll back and neither books.
+    """
+    interval = booking_interval(appointment)
+    if interval is None:
+        return None
+    conflicts = await schedule_index.find_stored_conflicts(
+        db, company_id, appointment["technician_id"], *interval, exclude_id=exclude_id
+    )
+    return double_booking_error(appointment["technician_id"], conflicts) if conflicts else None
+
 @app.post("/api/appointments", response_model=Appointment)
 async def create_appointment(appointment: AppointmentCreate, current_user: dict = Depends(get_current_user)):
-    """Create new appointment"""
+    """Create new appointment (409 if it would double-book the technician)"""
     appointment_obj = Appointment(**appointment.dict())
-    await db.appointments.insert_one(appointment_obj.dict())
-    
-    # Create Google Calendar event if enabled
+    async with schedule_index.lock(appointment_obj.company_id):
+        await ensure_technician_free(appointment_obj.company_id, appointment_obj.dict())
+        await db.appointments.insert_one(appointment_obj.dict())
+        error = await find_stored_double_booking(appointment_obj.company_id, appointment_obj.dict(), appointment_obj.id)
+        if error:
+            await db.appointments.delete_one({"id": appointment_obj.id})
+            raise error
+        await record_appointment_change(db, appointment_obj.company_id, appointment_obj.id)
+    invalidate_company_dashboards(appointment_obj.company_id)
+    
+    # Queue Google Calendar event creation (synced in the background)
     if appointment.scheduled_date:
-        calendar_service = get_calendar_service()
         try:
-            event_data = {
-                "summary": f"HVAC: {appointment.title}",
-                "description": appointment.description,
-                "start": {"dateTime": appointment.scheduled_date.isoformat()},
-                "end": {"dateTime": (appointment.scheduled_date + timedelta(minutes=appointment.estimated_duration)).isoformat()},
-            }
-            event_id = await calendar_service.create_event(event_data)
-            
-            # Update appointment with calendar event ID
-            await db.appointments.update_one(
-                {"id": appointment_obj.id},
-                {"$set": {"calendar_event_id": event_id}}
-            )
-            
+            await calendar_sync_worker.enqueue(appointment_obj.dict(), "create")
         except Exception as e:
-            logger.error(f"Failed to create calendar event: {str(e)}")
+            logger.error(f"Failed to queue calendar event: {str(e)}")
     
     return appointment_obj
 
@@ -254,6 +581,139 @@ async def list_appointments(
     appointments = await db.appointments.find(filters).sort("scheduled_date", 1).to_list(100)
     return [Appointment(**appt) for appt in appointments]
 
+@app.get("/api/appointments/conflicts")
+async def get_appointment_conflicts(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    technician_id: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Technician double bookings between start and end (default: the current week)"""
+    
+    if start is None:
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        start = today - timedelta(days=today.weekday())
+    start = parse_scheduled_date(start)
+    end = parse_scheduled_date(end) if end else start + timedelta(days=7)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    
+    try:
+        company_id = current_user.get("company_id", "company-001")
+        conflicts = await schedule_index.conflicts_report(db, company_id, start, end, technician_id)
+        return {
+            "start": start,
+            "end": end,
+            "conflicts": conflicts,
+            "total": len(conflicts)
+        }
+    except Exception as e:
+        logger.error(f"Failed to build conflicts report: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def etag_json_response(request: Request, payload: Any) -> Response:
+    """Compact JSON response with a content ETag; 304 if the client already has this version"""
+    body = json.dumps(jsonable_encoder(payload), separators=(",", ":")).encode()
+    etag = weak_etag(body)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def parse_range_param(value: Optional[str], name: str, end_of_day: bool = False) -> Optional[datetime]:
+    """Datetime from a YYYY-MM-DD or ISO query parameter; a bare end date includes that whole day"""
+    if not value:
+        return None
+    parsed = parse_scheduled_date(value)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, expected YYYY-MM-DD or an ISO datetime")
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+@app.get("/api/appointments/calendar")
+async def get_appointments_calendar(
+    request: Request,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    view: Optional[str] = "month",
+    technician_id: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get appointments in calendar format (defaults to the current day, week or month)"""
+    
+    start = parse_range_param(start_date, "start_date")
+    end = parse_range_param(end_date, "end_date", end_of_day=True)
+    if start is None:
+        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        if view == "day":
+            start = today
+        elif view == "week":
+            start = today - timedelta(days=today.weekday())
+        else:
+            start = today.replace(day=1)
+    if end is None:
+        if view == "day":
+            end = start + timedelta(days=1)
+        elif view == "week":
+            end = start + timedelta(days=7)
+        else:
+            end = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end_date must be after start_date")
+    
+    try:
+        company_id = current_user.get("company_id", "company-001")
+        calendar_service = get_appointment_calendar_service(db)
+        result = await calendar_service.calendar(company_id, start, end, technician_id=technician_id)
+        
+        return etag_json_response(request, {
+            **result,
+            "view": view,
+            "start_date": start,
+            "end_date": end
+        })
+        
+    except Exception as e:
+        logger.error(f"Failed to get calendar appointments: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/appointments/filter")
+async def filter_appointments(
+    request: Request,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    technician: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=AppointmentCalendarService.MAX_EVENTS),
+    current_user: dict = Depends(get_current_user)
+):
+    """Filter appointments by status, date range and technician (id or name)"""
+    
+    start = parse_range_param(date_from, "date_from")
+    end = parse_range_param(date_to, "date_to", end_of_day=True)
+    
+    try:
+        company_id = current_user.get("company_id", "company-001")
+        calendar_service = get_appointment_calendar_service(db)
+        result = await calendar_service.filter(
+            company_id, status=status, date_from=start, date_to=end, technician=technician, limit=limit
+        )
+        
+        return etag_json_response(request, {
+            **result,
+            "filters": {
+                "status": status,
+                "date_from": date_from,
+                "date_to": date_to,
+                "technician": technician
+            }
+        })
+        
+    except Exception as e:
+        logger.error(f"Failed to filter appointments: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/appointments/{appointment_id}", response_model=Appointment)
 async def get_appointment(appointment_id: str, current_user: dict = Depends(get_current_user)):
     """Get appointment details"""
@@ -264,12 +724,39 @@ async def get_appointment(appointment_id: str, current_user: dict = Depends(get_
 
 @app.put("/api/appointments/{appointment_id}", response_model=Appointment)
 async def update_appointment(appointment_id: str, appointment_data: dict, current_user: dict = Depends(get_current_user)):
-    """Update appointment"""
-    await db.appointments.update_one(
-        {"id": appointment_id},
-        {"$set": {**appointment_data, "updated_at": datetime.utcnow()}}
-    )
+    """Update appointment (409 if it would double-book the technician)"""
+    existing = await db.appointments.find_one({"id": appointment_id}, {"_id": 0})
+    if not existing:
+        raise HTTPException(status_code=404, detail="Appointment not found")
+    if "scheduled_date" in appointment_data:
+        scheduled_date = parse_scheduled_date(appointment_data["scheduled_date"])
+        if scheduled_date is None:
+            raise HTTPException(status_code=400, detail="Invalid scheduled_date")
+        appointment_data["scheduled_date"] = scheduled_date
+    
+    company_id = existing.get("company_id")
+    async with schedule_index.lock(company_id):
+        await ensure_technician_free(company_id, {**existing, **appointment_data}, exclude_id=appointment_id)
+        await db.appointments.update_one(
+            {"id": appointment_id},
+            {"$set": {**appointment_data, "updated_at": datetime.utcnow()}}
+        )
+        error = await find_stored_double_booking(company_id, {**existing, **appointment_data}, appointment_id)
+        if error:
+            await db.appointments.replace_one({"id": appointment_id}, existing)
+            raise error
+        await record_appointment_change(db, company_id, appointment_id)
     updated_appointment = await db.appointments.find_one({"id": appointment_id})
+    invalidate_company_dashboards(company_id)
+    
+    # Queue the matching calendar change (cancelled appointments leave the calendar)
+    if updated_appointment.get("scheduled_date"):
+        operation = "delete" if updated_appointment.get("status") == AppointmentStatus.CANCELLED.value else "update"
+        try:
+            await calendar_sync_worker.enqueue(updated_appointment, operation)
+        except Exception as e:
+            logger.error(f"Failed to queue calendar event: {str(e)}")
+    
     return Appointment(**updated_appointment)
 
 # ==================== AI VOICE SCHEDULING ENDPOINTS ====================
@@ -392,11 +879,12 @@ async def manage_call_log(call_sid: str, phone_number: str, form_data) -> 'CallL
             call_log = CallLog(**existing_log)
         else:
             # Find customer by phone
-            customer = await db.customers.find_one({"phone": phone_number})
+            company_id = "company-001"
+            customer = await customer_phone_directory.lookup(db, phone_number, company_id)
             
             # Create new call log
             call_log_data = CallLogCreate(
-                company_id="company-001",
+                company_id=company_id,
                 phone_number=phone_number,
                 call_sid=call_sid,
                 customer_name=customer.get("name", "Unknown") if customer else "Unknown"
@@ -681,19 +1169,23 @@ async def create_voice_appointment(session_data: dict, phone_number: str) -> App
     """Create appointment from voice session data"""
     try:
         # Find or create customer
-        customer = await db.customers.find_one({"phone": phone_number})
+        company_id = "company-001"  # Default company
+        customer = await customer_phone_directory.lookup(db, phone_number, company_id)
         
         if not customer:
             # Create new customer
             customer_data = CustomerCreate(
-                company_id="company-001",  # Default company
+                company_id=company_id,
                 name=session_data.get("name", "Voice Customer"),
                 phone=phone_number,
                 address={"full": session_data.get("address", "")},
                 preferred_contact="phone"
             )
             customer_obj = Customer(**customer_data.dict())
+            customer_obj.calculate_phone_e164()
+            customer_obj.location = await geocode_customer_address(customer_obj.address)
             await db.customers.insert_one(customer_obj.dict())
+            await record_customer_change(db, customer_obj.company_id, customer_obj.id)
             customer_id = customer_obj.id
         else:
             customer_id = customer["id"]
@@ -723,6 +1215,7 @@ async def create_voice_appointment(session_data: dict, phone_number: str) -> App
         
         appointment_obj = Appointment(**appointment_data.dict())
         await db.appointments.insert_one(appointment_obj.dict())
+        invalidate_company_dashboards(appointment_obj.company_id)
         
         # Update availability (increment booked count)
         await db.availability.update_one(
@@ -1370,6 +1863,30 @@ async def create_qa_gate(
         logger.error(f"Error creating QA gate: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Fields derived by QAGate.calculate_qa_status
+QA_GATE_STATUS_FIELDS = [
+    "qa_status", "microns_pass", "photos_pass", "metrics_pass",
+    "overall_pass", "failure_reasons", "completed_at"
+]
+
+async def recompute_qa_gate_status(qa_gate_data: dict) -> QAGate:
+    """Recalculate QA status and store only the derived fields.
+    
+    The write is conditioned on the version the status was computed from; if
+    another upload bumped the version meanwhile, its own recompute (which sees
+    both changes) wins and this one is skipped.
+    """
+    qa_gate = QAGate(**qa_gate_data)
+    qa_gate.calculate_qa_status()
+    
+    status_fields = qa_gate.dict(include=set(QA_GATE_STATUS_FIELDS))
+    await db.qa_gates.update_one(
+        {"id": qa_gate.id, "version": qa_gate_data.get("version", 0)},
+        {"$set": {**status_fields, "updated_at": datetime.utcnow()}}
+    )
+    
+    return qa_gate
+
 @app.put("/api/jobs/{job_id}/qa-gate/startup-metrics")
 async def update_startup_metrics(
     job_id: str,
@@ -1378,18 +1895,18 @@ async def update_startup_metrics(
 ):
     """Update startup metrics for QA gate"""
     try:
-        qa_gate_data = await db.qa_gates.find_one({"job_id": job_id})
+        qa_gate_data = await db.qa_gates.find_one_and_update(
+            {"job_id": job_id},
+            {
+                "$set": {"startup_metrics": metrics.dict(), "updated_at": datetime.utcnow()},
+                "$inc": {"version": 1}
+            },
+            return_document=ReturnDocument.AFTER
+        )
         if not qa_gate_data:
             raise HTTPException(status_code=404, detail="QA Gate not found")
         
-        qa_gate = QAGate(**qa_gate_data)
-        qa_gate.startup_metrics = metrics
-        qa_gate.calculate_qa_status()
-        
-        await db.qa_gates.update_one(
-            {"job_id": job_id},
-            {"$set": qa_gate.dict()}
-        )
+        qa_gate = await recompute_qa_gate_status(qa_gate_data)
         
         logger.info(f"Updated startup metrics for job {job_id}: microns={metrics.microns}")
         
@@ -1417,12 +1934,6 @@ async def add_qa_photo(
 ):
     """Add photo to QA gate"""
     try:
-        qa_gate_data = await db.qa_gates.find_one({"job_id": job_id})
-        if not qa_gate_data:
-            raise HTTPException(status_code=404, detail="QA Gate not found")
-        
-        qa_gate = QAGate(**qa_gate_data)
-        
         # Add photo
         photo_entry = {
             "type": photo_type,
@@ -1431,15 +1942,21 @@ async def add_qa_photo(
             "uploaded_at": datetime.utcnow().isoformat(),
             "uploaded_by": current_user.get("username", "unknown")
         }
-        qa_gate.photos.append(photo_entry)
-        
-        # Recalculate QA status
-        qa_gate.calculate_qa_status()
         
-        await db.qa_gates.update_one(
+        qa_gate_data = await db.qa_gates.find_one_and_update(
             {"job_id": job_id},
-            {"$set": qa_gate.dict()}
+            {
+                "$push": {"photos": photo_entry},
+                "$set": {"updated_at": datetime.utcnow()},
+                "$inc": {"version": 1}
+            },
+            return_document=ReturnDocument.AFTER
         )
+        if not qa_gate_data:
+            raise HTTPException(status_code=404, detail="QA Gate not found")
+        
+        # Recalculate QA status
+        qa_gate = await recompute_qa_gate_status(qa_gate_data)
         
         logger.info(f"Added {photo_type} photo for job {job_id}")
         
@@ -1508,14 +2025,18 @@ async def close_job(
             "status": "completed",
             "completed_at": datetime.utcnow().isoformat(),
             "completed_by": current_user.get("username", "unknown"),
-            "qa_passed": True
+            "qa_passed": True,
+            "updated_at": datetime.utcnow()
         }
         
         # Update job status (assuming jobs collection exists)
-        await db.jobs.update_one(
+        job = await db.jobs.find_one_and_update(
             {"id": job_id},
-            {"$set": job_data}
+            {"$set": job_data},
+            projection={"company_id": 1}
         )
+        if job:
+            invalidate_company_dashboards(job.get("company_id"))
         
         logger.info(f"Job {job_id} closed successfully - all QA gates passed")
         
@@ -1717,66 +2238,35 @@ async def release_holdback(
         payment = SubcontractorPayment(**payment_data)
         job_id = payment.job_id
         
-        # Check QA gate status
         qa_gate_data = await db.qa_gates.find_one({"job_id": job_id})
-        if qa_gate_data:
-            qa_gate = QAGate(**qa_gate_data)
-            qa_gate.calculate_qa_status()
-            payment.qa_gate_passed = qa_gate.overall_pass
-        
-        # Check warranty registration
         warranty_data = await db.warranty_registrations.find_one({"job_id": job_id})
-        payment.warranty_registered = warranty_data and warranty_data.get("registered", False)
-        
-        # Check inspection if required
-        if payment.inspection_required:
-            inspection_data = await db.inspections.find_one({"job_id": job_id})
-            payment.inspection_passed = (
-                inspection_data and 
-                inspection_data.get("completed", False) and 
-                inspection_data.get("inspection_pass", False)
-            )
-        else:
-            payment.inspection_passed = True  # Not required
+        inspection_data = (
+            await db.inspections.find_one({"job_id": job_id})
+            if payment.inspection_required else None
+        )
         
         # Check release conditions
-        can_release = payment.check_release_conditions()
+        can_release = apply_release_conditions(payment, qa_gate_data, warranty_data, inspection_data)
         
         if not can_release:
             # Build detailed error message
-            blocking_reasons = []
-            if not payment.qa_gate_passed:
-                blocking_reasons.append("QA Gate not passed")
-            if not payment.warranty_registered:
-                blocking_reasons.append("Warranty not registered")
-            if payment.inspection_required and not payment.inspection_passed:
-                blocking_reasons.append("Required inspection not passed")
-            
             error_message = "Holdback release blocked - Requirements not met:"
-            for reason in blocking_reasons:
+            for reason in holdback_blocking_reasons(payment):
                 error_message += f"\n• {reason}"
             
             raise HTTPException(status_code=400, detail=error_message)
         
-        # Release holdback
-        payment.holdback_released = True
-        payment.holdback_released_at = datetime.utcnow()
-        payment.payment_status = PaymentStatus.RELEASED
-        
-        # Add holdback release to payment history
-        release_payment = {
-            "amount": payment.holdback_amount,
-            "type": "holdback_release",
-            "date": payment.holdback_released_at.isoformat(),
-            "processed_by": current_user.get("username", "unknown")
-        }
-        payment.payments_made.append(release_payment)
-        payment.total_paid += payment.holdback_amount
-        
-        await db.subcontractor_payments.update_one(
-            {"id": payment_id},
-            {"$set": payment.dict()}
+        # Release holdback (only if nobody released it in the meantime)
+        released_at = datetime.utcnow()
+        result = await db.subcontractor_payments.update_one(
+            {"id": payment_id, "holdback_released": {"$ne": True}},
+            holdback_release_update(payment, current_user.get("username", "unknown"), released_at)
         )
+        if result.modified_count == 0:
+            raise HTTPException(status_code=409, detail="Holdback already released")
+        
+        payment.holdback_released_at = released_at
+        payment.total_paid += payment.holdback_amount
         
         logger.info(f"Holdback released for payment {payment_id}: ${payment.holdback_amount}")
         
@@ -1793,72 +2283,145 @@ async def release_holdback(
         logger.error(f"Error releasing holdback: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/jobs/{job_id}/qa-status")
-async def get_qa_status(job_id: str):
-    """Get comprehensive QA status for job"""
+@app.post("/api/subcontractor-payments/release-holdbacks")
+async def release_holdbacks_bulk(
+    company_id: str = Query("company-001"),
+    dry_run: bool = Query(False, description="Evaluate without releasing"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Release all eligible holdbacks for a company and report the blocked payments"""
     try:
-        # QA Gate
-        qa_gate_data = await db.qa_gates.find_one({"job_id": job_id})
-        qa_status = None
-        if qa_gate_data:
-            qa_gate = QAGate(**qa_gate_data)
-            qa_gate.calculate_qa_status()
-            qa_status = {
-                "status": qa_gate.qa_status,
-                "overall_pass": qa_gate.overall_pass,
-                "microns_pass": qa_gate.microns_pass,
-                "photos_pass": qa_gate.photos_pass,
-                "metrics_pass": qa_gate.metrics_pass,
-                "failure_reasons": qa_gate.failure_reasons,
-                "startup_metrics": qa_gate.startup_metrics.dict() if qa_gate.startup_metrics else None,
-                "photos_count": len(qa_gate.photos)
-            }
-        
-        # Warranty
-        warranty_data = await db.warranty_registrations.find_one({"job_id": job_id})
-        warranty_status = {
-            "registered": warranty_data.get("registered", False) if warranty_data else False,
-            "registration_number": warranty_data.get("registration_number") if warranty_data else None
-        }
-        
-        # Inspection
-        inspection_data = await db.inspections.find_one({"job_id": job_id})
-        inspection_status = {
-            "required": inspection_data.get("required", True) if inspection_data else True,
-            "scheduled": inspection_data.get("scheduled_date") is not None if inspection_data else False,
-            "completed": inspection_data.get("completed", False) if inspection_data else False,
-            "passed": inspection_data.get("inspection_pass", False) if inspection_data else False
-        }
-        
-        # Overall status
-        can_close = (
-            qa_status and qa_status["overall_pass"] and
-            warranty_status["registered"] and
-            (not inspection_status["required"] or inspection_status["passed"])
+        release_service = get_holdback_release_service(db)
+        return await release_service.run_holdback_release(
+            company_id,
+            processed_by=current_user.get("username", "unknown"),
+            dry_run=dry_run
         )
         
-        return {
-            "job_id": job_id,
-            "can_close": can_close,
-            "qa_gate": qa_status,
-            "warranty": warranty_status,
-            "inspection": inspection_status
-        }
-        
     except Exception as e:
-        logger.error(f"Error getting QA status: {str(e)}")
+        logger.error(f"Error releasing holdbacks: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# ==================== EXISTING SIMPLE CALLS API (PHASE 6 - MINIMAL) ====================
+MAX_QA_STATUS_BATCH = 5000
 
-@app.get("/api/calls")
-async def get_calls(
-    from_date: Optional[str] = Query(None, alias="from", description="Start date (YYYY-MM-DD)"),
-    to_date: Optional[str] = Query(None, alias="to", description="End date (YYYY-MM-DD)"),
-    q: Optional[str] = Query(None, description="Search query for name or phone"),
-    ai_answered: Optional[bool] = Query(None, description="Filter by AI answered calls"),
-    transferred: Optional[bool] = Query(None, description="Filter by transferred calls"),
-    limit: int = Query(20, description="Number of results"),
+def build_qa_status(
+    job_id: str,
+    qa_gate_data: Optional[dict],
+    warranty_data: Optional[dict],
+    inspection_data: Optional[dict]
+) -> dict:
+    """Build the QA status summary for a job from its QA gate, warranty and inspection documents"""
+    
+    # QA Gate
+    qa_status = None
+    if qa_gate_data:
+        qa_gate = QAGate(**qa_gate_data)
+        qa_gate.calculate_qa_status()
+        qa_status = {
+            "status": qa_gate.qa_status,
+            "overall_pass": qa_gate.overall_pass,
+            "microns_pass": qa_gate.microns_pass,
+            "photos_pass": qa_gate.photos_pass,
+            "metrics_pass": qa_gate.metrics_pass,
+            "failure_reasons": qa_gate.failure_reasons,
+            "startup_metrics": qa_gate.startup_metrics.dict() if qa_gate.startup_metrics else None,
+            "photos_count": len(qa_gate.photos)
+        }
+    
+    # Warranty
+    warranty_status = {
+        "registered": warranty_data.get("registered", False) if warranty_data else False,
+        "registration_number": warranty_data.get("registration_number") if warranty_data else None
+    }
+    
+    # Inspection
+    inspection_status = {
+        "required": inspection_data.get("required", True) if inspection_data else True,
+        "scheduled": inspection_data.get("scheduled_date") is not None if inspection_data else False,
+        "completed": inspection_data.get("completed", False) if inspection_data else False,
+        "passed": inspection_data.get("inspection_pass", False) if inspection_data else False
+    }
+    
+    # Overall status
+    can_close = (
+        qa_status and qa_status["overall_pass"] and
+        warranty_status["registered"] and
+        (not inspection_status["required"] or inspection_status["passed"])
+    )
+    
+    return {
+        "job_id": job_id,
+        "can_close": can_close,
+        "qa_gate": qa_status,
+        "warranty": warranty_status,
+        "inspection": inspection_status
+    }
+
+@app.post("/api/jobs/qa-status:batch")
+async def get_qa_status_batch(request: QAStatusBatchRequest):
+    """Get QA status for many jobs, querying each collection once"""
+    try:
+        job_ids = list(dict.fromkeys(request.job_ids))
+        if len(job_ids) > MAX_QA_STATUS_BATCH:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_QA_STATUS_BATCH} job IDs per request")
+        
+        if not job_ids:
+            return {"statuses": {}}
+        
+        qa_gates, warranties, inspections = await asyncio.gather(
+            find_first_by_job_id(db.qa_gates, job_ids, {"_id": 0}),
+            find_first_by_job_id(
+                db.warranty_registrations, job_ids,
+                {"_id": 0, "job_id": 1, "registered": 1, "registration_number": 1}
+            ),
+            find_first_by_job_id(
+                db.inspections, job_ids,
+                {"_id": 0, "job_id": 1, "required": 1, "scheduled_date": 1, "completed": 1, "inspection_pass": 1}
+            )
+        )
+        
+        statuses = {
+            job_id: build_qa_status(
+                job_id,
+                qa_gates.get(job_id),
+                warranties.get(job_id),
+                inspections.get(job_id)
+            )
+            for job_id in job_ids
+        }
+        
+        return {"statuses": statuses}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting batch QA status: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/jobs/{job_id}/qa-status")
+async def get_qa_status(job_id: str):
+    """Get comprehensive QA status for job"""
+    try:
+        qa_gate_data = await db.qa_gates.find_one({"job_id": job_id})
+        warranty_data = await db.warranty_registrations.find_one({"job_id": job_id})
+        inspection_data = await db.inspections.find_one({"job_id": job_id})
+        
+        return build_qa_status(job_id, qa_gate_data, warranty_data, inspection_data)
+        
+    except Exception as e:
+        logger.error(f"Error getting QA status: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# ==================== EXISTING SIMPLE CALLS API (PHASE 6 - MINIMAL) ====================
+
+@app.get("/api/calls")
+async def get_calls(
+    from_date: Optional[str] = Query(None, alias="from", description="Start date (YYYY-MM-DD)"),
+    to_date: Optional[str] = Query(None, alias="to", description="End date (YYYY-MM-DD)"),
+    q: Optional[str] = Query(None, description="Search query for name or phone"),
+    ai_answered: Optional[bool] = Query(None, description="Filter by AI answered calls"),
+    transferred: Optional[bool] = Query(None, description="Filter by transferred calls"),
+    limit: int = Query(20, description="Number of results"),
     cursor: Optional[str] = Query(None, description="Pagination cursor")
 ):
     """Simple calls API matching the frontend spec"""
@@ -2261,6 +2824,7 @@ For changes, call (555) HVAC-PRO. Reply STOP to opt out."""
             # Also add to mock sent messages for testing
             if hasattr(sms_service, 'sent_messages'):
                 sms_service.sent_messages.append({
+                    "sid": f"mock_confirmation_{uuid.uuid4().hex[:12]}",
                     "to": phone_number,
                     "body": message,
                     "status": "mock_sent",
@@ -2278,6 +2842,7 @@ async def create_job(job: JobCreate, current_user: dict = Depends(get_current_us
     """Create new job"""
     job_obj = Job(**job.dict())
     await db.jobs.insert_one(job_obj.dict())
+    invalidate_company_dashboards(job_obj.company_id)
     return job_obj
 
 @app.get("/api/jobs", response_model=List[Job])
@@ -2317,22 +2882,54 @@ async def update_job(job_id: str, job_data: dict, current_user: dict = Depends(g
         {"$set": {**job_data, "updated_at": datetime.utcnow()}}
     )
     updated_job = await db.jobs.find_one({"id": job_id})
+    invalidate_company_dashboards(updated_job.get("company_id"))
     return Job(**updated_job)
 
 @app.post("/api/jobs/{job_id}/assign")
 async def assign_technician(job_id: str, assignment_data: dict, current_user: dict = Depends(get_current_user)):
-    """Assign technician to job"""
+    """Assign technician to job (409 if they are already booked for the job's appointment)"""
     technician_id = assignment_data.get("technician_id")
     
-    # Update job
-    await db.jobs.update_one(
-        {"id": job_id},
-        {"$set": {"technician_id": technician_id, "status": "assigned", "updated_at": datetime.utcnow()}}
-    )
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    company_id = job.get("company_id")
+    
+    async with schedule_index.lock(company_id):
+        # The job's appointment (or, without one, its own scheduled_date) is the time being booked
+        appointment = None
+        if job.get("appointment_id"):
+            appointment = await db.appointments.find_one({"id": job["appointment_id"]}, {"_id": 0})
+        booking = appointment or {"id": None, "scheduled_date": job.get("scheduled_date")}
+        await ensure_technician_free(company_id, {**booking, "technician_id": technician_id}, exclude_id=booking["id"])
+        
+        # Update job
+        await db.jobs.update_one(
+            {"id": job_id},
+            {"$set": {"technician_id": technician_id, "status": "assigned", "updated_at": datetime.utcnow()}}
+        )
+        if appointment:
+            await db.appointments.update_one(
+                {"id": appointment["id"]},
+                {"$set": {"technician_id": technician_id, "updated_at": datetime.utcnow()}}
+            )
+            error = await find_stored_double_booking(
+                company_id, {**appointment, "technician_id": technician_id}, appointment["id"]
+            )
+            if error:
+                await db.appointments.replace_one({"id": appointment["id"]}, appointment)
+                await db.jobs.update_one(
+                    {"id": job_id},
+                    {"$set": {key: job.get(key) for key in ("technician_id", "status", "updated_at")}}
+                )
+                raise error
+            await record_appointment_change(db, company_id, appointment["id"])
     
     # Send notification to technician via SMS
     job = await db.jobs.find_one({"id": job_id})
     technician = await db.technicians.find_one({"id": technician_id})
+    if job:
+        invalidate_company_dashboards(job.get("company_id"))
     
     if job and technician and technician.get("phone"):
         sms_service = twilio_service
@@ -2350,7 +2947,7 @@ async def complete_job(job_id: str, completion_data: dict, current_user: dict =
     """Mark job as completed"""
     
     # Update job
-    await db.jobs.update_one(
+    job = await db.jobs.find_one_and_update(
         {"id": job_id},
         {
             "$set": {
@@ -2361,8 +2958,11 @@ async def complete_job(job_id: str, completion_data: dict, current_user: dict =
                 "notes": completion_data.get("notes", ""),
                 "updated_at": datetime.utcnow()
             }
-        }
+        },
+        projection={"company_id": 1}
     )
+    if job:
+        invalidate_company_dashboards(job.get("company_id"))
     
     # Send rating request SMS
     rating_service = get_rating_service(db)
@@ -2373,31 +2973,129 @@ async def complete_job(job_id: str, completion_data: dict, current_user: dict =
     
     return {"message": "Job marked as completed"}
 
+@app.get("/api/sync")
+async def sync_technician_data(
+    technician_id: str = Query(...),
+    since: Optional[str] = Query(None, description="Token from the previous sync; omit for a full sync"),
+    limit: int = Query(200, ge=1, le=1000, description="Maximum changed documents per collection"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Jobs, appointments, job messages and QA gates changed since the last sync of a technician's device"""
+    company_id = current_user.get("company_id", "company-001")
+    technician = await db.technicians.find_one(
+        {"id": technician_id, "company_id": company_id}, {"_id": 0, "id": 1, "user_id": 1}
+    )
+    if not technician:
+        raise HTTPException(status_code=404, detail="Technician not found")
+    # Only the technician's own device, or the company's management, may pull their data
+    if current_user.get("role") not in (UserRole.ADMIN.value, UserRole.OWNER.value) and (
+        not technician.get("user_id") or technician["user_id"] != current_user.get("sub")
+    ):
+        raise HTTPException(status_code=403, detail="Not allowed to sync this technician")
+    
+    try:
+        sync_service = get_technician_sync_service(db)
+        return await sync_service.sync(company_id, technician_id, token=since, limit=limit)
+    except InvalidSyncToken as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to sync technician {technician_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ==================== INVOICE MANAGEMENT ENDPOINTS ====================
 
-@app.post("/api/invoices", response_model=Invoice)
-async def create_invoice(invoice: InvoiceCreate, current_user: dict = Depends(get_current_user)):
-    """Create new invoice"""
+INVOICE_NUMBER_RETRIES = 3
+MAX_BULK_INVOICES = 500
+
+def build_invoice(invoice: InvoiceCreate, invoice_number: str) -> Invoice:
+    """Build an invoice document with calculated totals"""
     
     # Calculate totals
     subtotal = sum(item.total for item in invoice.items)
     tax_amount = subtotal * invoice.tax_rate
     total_amount = subtotal + tax_amount
     
-    # Generate invoice number
-    invoice_count = await db.invoices.count_documents({"company_id": invoice.company_id})
-    invoice_number = f"INV-{datetime.now().year}-{invoice_count + 1:04d}"
-    
-    invoice_obj = Invoice(
+    return Invoice(
         **invoice.dict(),
         invoice_number=invoice_number,
         subtotal=subtotal,
         tax_amount=tax_amount,
         total_amount=total_amount
     )
+
+@app.post("/api/invoices", response_model=Invoice)
+async def create_invoice(invoice: InvoiceCreate, current_user: dict = Depends(get_current_user)):
+    """Create new invoice"""
+    
+    allocator = get_invoice_number_allocator(db)
+    
+    # Retry if a number was taken outside the allocator (unique index rejects duplicates)
+    for attempt in range(INVOICE_NUMBER_RETRIES):
+        invoice_number = (await allocator.reserve(invoice.company_id))[0]
+        invoice_obj = build_invoice(invoice, invoice_number)
+        try:
+            await db.invoices.insert_one(invoice_obj.dict())
+            return invoice_obj
+        except DuplicateKeyError:
+            logger.warning(f"Invoice number {invoice_number} already in use, allocating another")
+    
+    raise HTTPException(status_code=409, detail="Could not allocate a unique invoice number")
+
+@app.post("/api/invoices/bulk", response_model=List[Invoice])
+async def create_invoices_bulk(invoices: List[InvoiceCreate], current_user: dict = Depends(get_current_user)):
+    """Create a batch of invoices, reserving invoice numbers per company in one step"""
+    
+    if not invoices:
+        return []
+    if len(invoices) > MAX_BULK_INVOICES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_INVOICES} invoices per request")
+    
+    allocator = get_invoice_number_allocator(db)
+    invoice_objs = [None] * len(invoices)
+    pending = list(range(len(invoices)))
+    failed = {}
+    
+    # Numbers taken outside the allocator fail only their own invoice (ordered=False);
+    # those invoices get fresh numbers and are retried, the rest stay inserted
+    for attempt in range(INVOICE_NUMBER_RETRIES):
+        # Group by company so each company's range is reserved with a single $inc
+        by_company = defaultdict(list)
+        for index in pending:
+            by_company[invoices[index].company_id].append(index)
+        for company_id, indexes in by_company.items():
+            numbers = await allocator.reserve(company_id, count=len(indexes))
+            for index, invoice_number in zip(indexes, numbers):
+                invoice_objs[index] = build_invoice(invoices[index], invoice_number)
+        
+        try:
+            await db.invoices.insert_many([invoice_objs[index].dict() for index in pending], ordered=False)
+            pending = []
+        except BulkWriteError as e:
+            retry = []
+            for error in e.details.get("writeErrors", []):
+                index = pending[error["index"]]
+                if error.get("code") == 11000:
+                    retry.append(index)
+                else:
+                    failed[index] = error.get("errmsg", "Insert failed")
+            logger.warning(f"Bulk invoice insert: {len(retry)} invoice numbers already in use, allocating others")
+            pending = retry
+        if not pending:
+            break
+    
+    for index in pending:
+        failed[index] = "Could not allocate a unique invoice number"
+    if failed:
+        raise HTTPException(status_code=409, detail=jsonable_encoder({
+            "message": "Some invoices could not be created",
+            "created": [
+                {"index": index, "id": invoice_obj.id, "invoice_number": invoice_obj.invoice_number}
+                for index, invoice_obj in enumerate(invoice_objs) if index not in failed
+            ],
+            "failed": [{"index": index, "error": error} for index, error in sorted(failed.items())]
+        }))
     
-    await db.invoices.insert_one(invoice_obj.dict())
-    return invoice_obj
+    return invoice_objs
 
 @app.get("/api/invoices", response_model=List[Invoice])
 async def list_invoices(
@@ -2429,7 +3127,8 @@ async def create_inquiry(inquiry: InquiryCreate, current_user: dict = Depends(ge
     
     # Generate AI response
     llm_service = get_llm_service()
-    context = {"company_name": "Elite HVAC Solutions"}
+    settings = await get_cached_company_settings(inquiry.company_id)
+    context = settings_llm_context(settings)
     ai_response = await llm_service.generate_sms_response(inquiry.initial_message, context)
     
     inquiry_obj = Inquiry(
@@ -2554,127 +3253,163 @@ async def twilio_webhook(request: Request):
 
 # ==================== PHASE 2: OWNER INSIGHTS ENDPOINTS ====================
 
+async def sum_job_revenue(filters: dict) -> float:
+    """Sum actual_cost over the jobs matching `filters`"""
+    result = await db.jobs.aggregate([
+        {"$match": filters},
+        {"$group": {"_id": None, "revenue": {"$sum": {"$ifNull": ["$actual_cost", 0]}}}}
+    ]).to_list(1)
+    return float(result[0]["revenue"]) if result else 0.0
+
+def apply_cache_headers(response: Optional[Response], cache_status: str, server_timing: str):
+    """Report cache outcome and (for fresh computations) query timings"""
+    if response is None:
+        return
+    response.headers["X-Cache"] = cache_status.upper()
+    if cache_status == CACHE_MISS:
+        response.headers["Server-Timing"] = server_timing
+    else:
+        response.headers["Server-Timing"] = f'cache;desc="{cache_status}"'
+
 @app.get("/api/owner-insights")
 async def get_owner_insights(
-    company_id: str = Query(...)
+    company_id: str = Query(...),
+    response: Response = None
 ):
     """Get owner dashboard insights with analytics"""
+    (insights, server_timing), cache_status = await owner_insights_cache.get_or_compute(
+        company_id, lambda: build_owner_insights(company_id)
+    )
+    apply_cache_headers(response, cache_status, server_timing)
+    return insights
+
+async def build_owner_insights(company_id: str) -> tuple:
+    """Compute owner insights; returns (insights, Server-Timing header value)"""
     
     today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     week_ago = today - timedelta(days=7)
     
+    fanout = QueryFanout()
+    
     # Today's performance
-    today_appointments = await db.appointments.count_documents({
+    fanout.add("today_appointments", db.appointments.count_documents({
         "company_id": company_id,
         "scheduled_date": {"$gte": today, "$lt": today + timedelta(days=1)}
-    })
+    }), default=0)
     
-    completed_today = await db.jobs.count_documents({
+    fanout.add("completed_today", db.jobs.count_documents({
         "company_id": company_id,
         "status": "completed",
         "completed_at": {"$gte": today}
-    })
+    }), default=0)
     
     # Revenue calculation
-    today_revenue = 0.0
-    completed_jobs_today = await db.jobs.find({
+    fanout.add("today_revenue", sum_job_revenue({
         "company_id": company_id,
         "status": "completed",
         "completed_at": {"$gte": today}
-    }).to_list(100)
-    
-    for job in completed_jobs_today:
-        if job.get("actual_cost"):
-            today_revenue += job["actual_cost"]
+    }), default=0.0)
     
     # 7-day trends
-    daily_stats = []
+    trend_days = []
     for i in range(7):
         day_start = today - timedelta(days=i)
         day_end = day_start + timedelta(days=1)
+        trend_days.append(day_start)
         
-        day_appointments = await db.appointments.count_documents({
+        fanout.add(f"day{i}_appointments", db.appointments.count_documents({
             "company_id": company_id,
             "scheduled_date": {"$gte": day_start, "$lt": day_end}
-        })
+        }), default=0)
         
-        day_completed = await db.jobs.count_documents({
+        fanout.add(f"day{i}_completed", db.jobs.count_documents({
             "company_id": company_id,
             "status": "completed",
             "completed_at": {"$gte": day_start, "$lt": day_end}
-        })
+        }), default=0)
         
-        day_revenue = 0.0
-        day_jobs = await db.jobs.find({
+        fanout.add(f"day{i}_revenue", sum_job_revenue({
             "company_id": company_id,
             "status": "completed",
             "completed_at": {"$gte": day_start, "$lt": day_end}
-        }).to_list(100)
-        
-        for job in day_jobs:
-            if job.get("actual_cost"):
-                day_revenue += job["actual_cost"]
-        
-        daily_stats.append({
-            "date": day_start.strftime("%Y-%m-%d"),
-            "appointments": day_appointments,
-            "completed": day_completed,
-            "revenue": day_revenue
-        })
+        }), default=0.0)
     
     # Performance metrics
-    week_inquiries = await db.inquiries.count_documents({
+    fanout.add("week_inquiries", db.inquiries.count_documents({
         "company_id": company_id,
         "created_at": {"$gte": week_ago}
-    })
+    }), default=0)
     
-    week_converted = await db.inquiries.count_documents({
+    fanout.add("week_converted", db.inquiries.count_documents({
         "company_id": company_id,
         "created_at": {"$gte": week_ago},
         "converted_to_appointment": True
-    })
+    }), default=0)
     
+    # Technician leaderboard: technicians plus one grouped count of their completed jobs
+    fanout.add("technicians", db.technicians.find({"company_id": company_id}).to_list(100), default=[])
+    fanout.add("technician_jobs", db.jobs.aggregate([
+        {"$match": {
+            "company_id": company_id,
+            "status": "completed",
+            "completed_at": {"$gte": week_ago}
+        }},
+        {"$group": {"_id": "$technician_id", "jobs_completed": {"$sum": 1}}}
+    ]).to_list(None), default=[])
+    
+    results = await fanout.gather()
+    
+    daily_stats = [
+        {
+            "date": day_start.strftime("%Y-%m-%d"),
+            "appointments": results[f"day{i}_appointments"],
+            "completed": results[f"day{i}_completed"],
+            "revenue": results[f"day{i}_revenue"]
+        }
+        for i, day_start in enumerate(trend_days)
+    ]
+    
+    week_inquiries = results["week_inquiries"]
+    week_converted = results["week_converted"]
     conversion_rate = (week_converted / week_inquiries * 100) if week_inquiries > 0 else 0
     
     # Calculate average response time (mock calculation)
     avg_response_time = 15.5  # minutes - mock data
     
-    # Technician leaderboard
-    technicians = await db.technicians.find({"company_id": company_id}).to_list(100)
+    jobs_by_technician = {row["_id"]: row["jobs_completed"] for row in results["technician_jobs"]}
     leaderboard = []
     
-    for tech in technicians:
-        tech_jobs = await db.jobs.count_documents({
-            "company_id": company_id,
-            "technician_id": tech["id"],
-            "status": "completed",
-            "completed_at": {"$gte": week_ago}
-        })
+    for tech in results["technicians"]:
+        technician_obj = Technician(**tech)
+        technician_obj.calculate_average_rating()
         
         leaderboard.append({
             "id": tech["id"],
             "name": tech["name"],
-            "jobs_completed": tech_jobs,
-            "average_rating": tech.get("average_rating", 0.0),
-            "total_ratings": tech.get("total_ratings", 0)
+            "jobs_completed": jobs_by_technician.get(tech["id"], 0),
+            "average_rating": technician_obj.average_rating,
+            "total_ratings": technician_obj.total_ratings
         })
     
     # Sort by jobs completed
     leaderboard.sort(key=lambda x: x["jobs_completed"], reverse=True)
     
-    return {
+    insights = {
         "today_performance": {
-            "appointments": today_appointments,
-            "completed": completed_today,
-            "revenue": today_revenue
+            "appointments": results["today_appointments"],
+            "completed": results["completed_today"],
+            "revenue": results["today_revenue"]
         },
         "seven_day_trends": daily_stats[::-1],  # Reverse for chronological order
         "performance_metrics": {
             "avg_response_time": avg_response_time,
             "conversion_rate": conversion_rate
         },
-        "technician_leaderboard": leaderboard[:10]  # Top 10
+        "technician_leaderboard": leaderboard[:10],  # Top 10
+        "failed_queries": fanout.failed_queries
     }
+    
+    return insights, fanout.server_timing()
 
 # ==================== PHASE 2: MESSAGING SYSTEM ENDPOINTS ====================
 
@@ -2684,10 +3419,39 @@ async def send_message(message: MessageCreate, current_user: dict = Depends(get_
     messaging_service = get_messaging_service(db)
     return await messaging_service.send_message(message)
 
+def parse_message_cursor(value: Optional[str], name: str) -> Optional[tuple]:
+    """(created_at, id) from a "created_at,id" cursor; a bare ISO datetime leaves id None"""
+    if not value:
+        return None
+    created_at, _, message_id = value.partition(",")
+    parsed = parse_scheduled_date(created_at)
+    if parsed is None:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, expected <ISO created_at>,<message id>")
+    return parsed, message_id or None
+
 @app.get("/api/jobs/{job_id}/messages", response_model=List[Message])
-async def get_job_messages(job_id: str, current_user: dict = Depends(get_current_user)):
-    """Get messages for job thread"""
-    messages = await db.messages.find({"job_id": job_id}).sort("created_at", 1).to_list(100)
+async def get_job_messages(
+    job_id: str,
+    response: Response,
+    after: Optional[str] = Query(None, description="Cursor (created_at,id) of the newest message the client has"),
+    before: Optional[str] = Query(None, description="Cursor (created_at,id) of the oldest message the client has"),
+    limit: int = Query(100, ge=1, le=500),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get messages for job thread, oldest first
+    
+    Without cursors this is the latest `limit` messages; `after` fetches only
+    newer ones and `before` pages back through history. X-Has-More is true when
+    more messages lie beyond the page in the direction fetched.
+    """
+    messaging_service = get_messaging_service(db)
+    messages, has_more = await messaging_service.list_messages(
+        job_id,
+        after=parse_message_cursor(after, "after"),
+        before=parse_message_cursor(before, "before"),
+        limit=limit
+    )
+    response.headers["X-Has-More"] = "true" if has_more else "false"
     return [Message(**msg) for msg in messages]
 
 @app.post("/api/jobs/{job_id}/messages/read")
@@ -2700,15 +3464,29 @@ async def mark_messages_read(job_id: str, current_user: dict = Depends(get_curre
 
 @app.get("/api/message-threads", response_model=List[MessageThread])
 async def get_message_threads(
+    request: Request,
+    response: Response,
     company_id: str = Query(...),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get message threads for company"""
+    """Get message threads for company (304 if unchanged since the client's ETag)"""
+    # Unread counts are per user, so the user is part of the tag
+    etag = await version_etag("message_threads", company_id, current_user.get("sub"))
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    
     threads = await db.message_threads.find({
         "company_id": company_id,
         "is_active": True
     }).sort("last_message_at", -1).to_list(100)
-    return [MessageThread(**thread) for thread in threads]
+    
+    thread_objs = [MessageThread(**thread) for thread in threads]
+    for thread_obj in thread_objs:
+        thread_obj.calculate_unread_counts([current_user.get("sub")])
+    if etag:
+        response.headers["ETag"] = etag
+    return thread_objs
 
 # ==================== PHASE 2: RATING SYSTEM ENDPOINTS ====================
 
@@ -2792,14 +3570,13 @@ async def test_notifications(
 
 # ==================== SETTINGS ENDPOINTS ====================
 
-@app.get("/api/settings/{company_id}")
-async def get_company_settings(company_id: str):
-    """Get comprehensive company settings"""
+async def load_company_settings(company_id: str) -> Optional[dict]:
+    """Build a company's settings from its saved overrides (None if the company is unknown)"""
     
     # Get settings from company document
-    company = await db.companies.find_one({"id": company_id})
+    company = await db.companies.find_one({"id": company_id}, {"settings": 1, "settings_version": 1})
     if not company:
-        raise HTTPException(status_code=404, detail="Company not found")
+        return None
     
     # Default settings structure
     default_settings = CompanySettings().dict()
@@ -2824,6 +3601,54 @@ async def get_company_settings(company_id: str):
         }
     }
     
+    settings["settings_version"] = company.get("settings_version", 0)
+    
+    return settings
+
+async def get_cached_company_settings(company_id: str) -> Optional[dict]:
+    """Company settings from the in-process cache (loaded on first use)"""
+    settings, _ = await settings_cache.get_or_compute(company_id, lambda: load_company_settings(company_id))
+    return settings
+
+async def write_company_settings(company_id: str, update: dict, upsert: bool = False):
+    """Apply a settings update, bump settings_version and invalidate cached settings everywhere"""
+    company = await db.companies.find_one_and_update(
+        {"id": company_id},
+        {**update, "$inc": {"settings_version": 1}},
+        upsert=upsert,
+        projection={"settings_version": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    await publish_settings_change(company_id, company.get("settings_version") if company else None)
+
+def settings_llm_context(settings: Optional[dict]) -> dict:
+    """Company details the SMS assistant needs, from cached settings"""
+    context = {"company_name": "Elite HVAC Solutions"}
+    if not settings:
+        return context
+    
+    context["company_name"] = settings.get("business_name") or context["company_name"]
+    business_hours = settings.get("business_hours")
+    if isinstance(business_hours, dict) and business_hours:
+        context["business_hours"] = ", ".join(f"{day} {hours}" for day, hours in business_hours.items())
+    elif isinstance(business_hours, str) and business_hours:
+        context["business_hours"] = business_hours
+    
+    return context
+
+@app.get("/api/settings/{company_id}")
+async def get_company_settings(company_id: str, request: Request, response: Response):
+    """Get comprehensive company settings (304 if settings_version is unchanged)"""
+    
+    settings = await get_cached_company_settings(company_id)
+    if settings is None:
+        raise HTTPException(status_code=404, detail="Company not found")
+    
+    etag = weak_etag("settings", company_id, settings.get("settings_version", 0))
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    response.headers["ETag"] = etag
     return settings
 
 @app.put("/api/settings/{company_id}")
@@ -2833,8 +3658,8 @@ async def update_company_settings(
 ):
     """Update company settings"""
     
-    await db.companies.update_one(
-        {"id": company_id},
+    await write_company_settings(
+        company_id,
         {
             "$set": {
                 "settings": settings,
@@ -2853,8 +3678,8 @@ async def save_calendar_settings(calendar_settings: dict, current_user: dict = D
     
     company_id = current_user.get("company_id", "company-001")
     
-    await db.companies.update_one(
-        {"id": company_id},
+    await write_company_settings(
+        company_id,
         {
             "$set": {
                 "settings.calendar": calendar_settings,
@@ -2902,14 +3727,23 @@ async def create_calendar_event(event_data: dict, current_user: dict = Depends(g
             "message": "Failed to create test event"
         }
 
+@app.post("/api/calendar/sync")
+async def pull_calendar_changes(current_user: dict = Depends(require_owner_or_admin)):
+    """Pull calendar-side changes now instead of waiting for the next scheduled sync"""
+    try:
+        return {"calendars": await calendar_sync_engine.sync_all()}
+    except Exception as e:
+        logger.error(f"Calendar sync failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/settings/notifications")
 async def save_notifications_settings(notifications_settings: dict, current_user: dict = Depends(get_current_user)):
     """Save notifications settings"""
     
     company_id = current_user.get("company_id", "company-001")
     
-    await db.companies.update_one(
-        {"id": company_id},
+    await write_company_settings(
+        company_id,
         {
             "$set": {
                 "settings.notifications": notifications_settings,
@@ -2937,8 +3771,8 @@ async def create_billing_checkout(billing_data: dict, current_user: dict = Depen
     
     # Save billing info
     company_id = current_user.get("company_id", "company-001")
-    await db.companies.update_one(
-        {"id": company_id},
+    await write_company_settings(
+        company_id,
         {
             "$set": {
                 "settings.billing.plan": billing_data.get("plan", "trial"),
@@ -2960,8 +3794,8 @@ async def save_service_areas_settings(service_areas: dict, current_user: dict =
     
     company_id = current_user.get("company_id", "company-001")
     
-    await db.companies.update_one(
-        {"id": company_id},
+    await write_company_settings(
+        company_id,
         {
             "$set": {
                 "settings.serviceAreas": service_areas,
@@ -2988,8 +3822,8 @@ async def save_integration_settings(provider: str, integration_data: dict, curre
         "connected_at": datetime.utcnow() if mock_status == "connected" else None
     }
     
-    await db.companies.update_one(
-        {"id": company_id},
+    await write_company_settings(
+        company_id,
         {
             "$set": {
                 f"settings.integrations.{provider}": integration_settings,
@@ -3027,8 +3861,8 @@ async def update_all_settings(settings_data: dict, current_user: dict = Depends(
         update_operations["settings.updated_by"] = current_user.get("email", "unknown")
         
         # Perform the database update
-        result = await db.companies.update_one(
-            {"id": company_id},
+        await write_company_settings(
+            company_id,
             {"$set": update_operations},
             upsert=True
         )
@@ -3272,113 +4106,6 @@ async def test_phase4():
     """Test endpoint for PHASE 4"""
     return {"message": "PHASE 4 endpoints are working"}
 
-@app.get("/api/technicians/search")
-async def search_technicians(
-    q: Optional[str] = None,
-    status: Optional[str] = None,
-    skill: Optional[str] = None,
-    limit: int = 20,
-    offset: int = 0,
-    current_user: dict = Depends(get_current_user)
-):
-    """Search technicians with filters"""
-    
-    try:
-        company_id = current_user.get("company_id", "company-001")
-        
-        # Mock technicians data
-        all_technicians = [
-            {
-                "id": "tech-001",
-                "name": "Mike Johnson",
-                "email": "mike.j@hvactech.com",
-                "phone": "+1-555-TECH-01",
-                "status": "available",
-                "company_id": company_id,
-                "skills": ["hvac", "installation", "repair"],
-                "rating": 4.8,
-                "jobs_completed": 147,
-                "years_experience": 8,
-                "certifications": ["EPA 608", "NATE Certified"],
-                "current_job": None,
-                "availability": "09:00-17:00",
-                "created_at": "2024-01-15T08:00:00Z"
-            },
-            {
-                "id": "tech-002", 
-                "name": "Sarah Davis",
-                "email": "sarah.d@hvactech.com",
-                "phone": "+1-555-TECH-02",
-                "status": "busy",
-                "company_id": company_id,
-                "skills": ["hvac", "maintenance", "diagnostics"],
-                "rating": 4.9,
-                "jobs_completed": 203,
-                "years_experience": 12,
-                "certifications": ["EPA 608", "NATE Certified", "R-410A"],
-                "current_job": "appt-002",
-                "availability": "08:00-16:00", 
-                "created_at": "2024-01-10T09:30:00Z"
-            },
-            {
-                "id": "tech-003",
-                "name": "David Wilson",
-                "email": "david.w@hvactech.com", 
-                "phone": "+1-555-TECH-03",
-                "status": "off_duty",
-                "company_id": company_id,
-                "skills": ["hvac", "electrical", "plumbing"],
-                "rating": 4.7,
-                "jobs_completed": 89,
-                "years_experience": 5,
-                "certifications": ["EPA 608", "Electrical License"],
-                "current_job": None,
-                "availability": "10:00-18:00",
-                "created_at": "2024-01-20T10:15:00Z"
-            },
-            {
-                "id": "tech-004",
-                "name": "Jennifer Brown",
-                "email": "jennifer.b@hvactech.com",
-                "phone": "+1-555-TECH-04", 
-                "status": "unavailable",
-                "company_id": company_id,
-                "skills": ["hvac", "commercial", "industrial"],
-                "rating": 4.6,
-                "jobs_completed": 156,
-                "years_experience": 10,
-                "certifications": ["EPA 608", "NATE Certified", "Commercial HVAC"],
-                "current_job": None,
-                "availability": "07:00-15:00",
-                "created_at": "2024-01-05T11:45:00Z"
-            }
-        ]
-        
-        # Apply filters
-        filtered_technicians = all_technicians
-        
-        if q:
-            filtered_technicians = [t for t in filtered_technicians 
-                                  if q.lower() in t["name"].lower() or q.lower() in t["email"].lower()]
-        if status:
-            filtered_technicians = [t for t in filtered_technicians if t["status"] == status]
-        if skill:
-            filtered_technicians = [t for t in filtered_technicians if skill.lower() in [s.lower() for s in t["skills"]]]
-            
-        # Apply pagination
-        paginated_technicians = filtered_technicians[offset:offset + limit]
-        
-        return {
-            "technicians": paginated_technicians,
-            "total": len(filtered_technicians),
-            "limit": limit,
-            "offset": offset
-        }
-        
-    except Exception as e:
-        logger.error(f"Failed to search technicians: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-
 @app.post("/api/technicians")
 async def add_technician(technician_data: dict, current_user: dict = Depends(get_current_user)):
     """Add a new technician"""
@@ -3563,258 +4290,6 @@ async def simple_test():
     """Simple test endpoint"""
     return {"message": "Simple test works", "customers": [{"name": "Jennifer Martinez", "phone": "+1-555-123-4567"}]}
 
-@app.get("/api/customers/search")
-async def search_customers(
-    q: Optional[str] = None,
-    phone: Optional[str] = None,
-    email: Optional[str] = None, 
-    limit: int = 20,
-    offset: int = 0,
-    current_user: dict = Depends(get_current_user)
-):
-    """Search customers with filters"""
-    
-    try:
-        company_id = current_user.get("company_id", "company-001")
-        
-        # Mock search results - in real implementation would query database
-        all_customers = [
-            {
-                "id": "customer-001",
-                "name": "Jennifer Martinez",
-                "phone": "+1-555-123-4567",
-                "email": "jennifer@email.com",
-                "address": {"full": "123 Main St, Anytown, ST 12345"},
-                "company_id": company_id,
-                "created_at": "2025-01-20T10:00:00Z",
-                "last_service": "2025-01-15T14:30:00Z",
-                "total_jobs": 3,
-                "status": "active"
-            },
-            {
-                "id": "customer-002", 
-                "name": "Robert Thompson",
-                "phone": "+1-555-987-6543",
-                "email": "robert.t@email.com",
-                "address": {"full": "456 Oak Ave, Somewhere, ST 67890"},
-                "company_id": company_id,
-                "created_at": "2025-01-18T09:15:00Z",
-                "last_service": "2025-01-10T16:00:00Z",
-                "total_jobs": 5,
-                "status": "active"
-            },
-            {
-                "id": "customer-003",
-                "name": "Lisa Anderson",
-                "phone": "+1-555-456-7890",
-                "email": "lisa.anderson@email.com", 
-                "address": {"full": "789 Pine Dr, Elsewhere, ST 11111"},
-                "company_id": company_id,
-                "created_at": "2025-01-16T11:30:00Z",
-                "last_service": "2025-01-05T13:45:00Z",
-                "total_jobs": 2,
-                "status": "active"
-            }
-        ]
-        
-        # Apply search filters
-        filtered_customers = all_customers
-        if q:
-            filtered_customers = [c for c in filtered_customers 
-                                if q.lower() in c["name"].lower() or q.lower() in c["phone"]]
-        if phone:
-            filtered_customers = [c for c in filtered_customers if phone in c["phone"]]
-        if email:
-            filtered_customers = [c for c in filtered_customers if email.lower() in c["email"].lower()]
-        
-        # Apply pagination
-        paginated_customers = filtered_customers[offset:offset + limit]
-        
-        return {
-            "customers": paginated_customers,
-            "total": len(filtered_customers),
-            "limit": limit,
-            "offset": offset
-        }
-        
-    except Exception as e:
-        logger.error(f"Failed to search customers: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.get("/api/appointments/calendar")
-async def get_appointments_calendar(
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-    view: Optional[str] = "month",
-    current_user: dict = Depends(get_current_user)
-):
-    """Get appointments in calendar format"""
-    
-    try:
-        company_id = current_user.get("company_id", "company-001")
-        
-        # Mock calendar appointments data
-        calendar_appointments = [
-            {
-                "id": "appt-001",
-                "title": "HVAC Maintenance - Martinez",
-                "customer_name": "Jennifer Martinez",
-                "customer_id": "customer-001",
-                "start": "2025-01-24T09:00:00",
-                "end": "2025-01-24T11:00:00", 
-                "status": "scheduled",
-                "service_type": "maintenance",
-                "technician": "Mike Johnson",
-                "address": "123 Main St, Anytown, ST 12345",
-                "source": "manual"
-            },
-            {
-                "id": "appt-002", 
-                "title": "No Heat Service - Thompson",
-                "customer_name": "Robert Thompson",
-                "customer_id": "customer-002",
-                "start": "2025-01-24T14:00:00",
-                "end": "2025-01-24T16:00:00",
-                "status": "confirmed", 
-                "service_type": "no_heat",
-                "technician": "Sarah Davis",
-                "address": "456 Oak Ave, Somewhere, ST 67890",
-                "source": "ai-voice",
-                "is_ai_generated": True
-            },
-            {
-                "id": "appt-003",
-                "title": "AC Installation - Anderson", 
-                "customer_name": "Lisa Anderson",
-                "customer_id": "customer-003",
-                "start": "2025-01-25T08:00:00",
-                "end": "2025-01-25T12:00:00",
-                "status": "in_progress",
-                "service_type": "installation",
-                "technician": "Mike Johnson",
-                "address": "789 Pine Dr, Elsewhere, ST 11111",
-                "source": "manual"
-            },
-            {
-                "id": "appt-004",
-                "title": "System Check - Davis",
-                "customer_name": "Michael Davis", 
-                "customer_id": "customer-004",
-                "start": "2025-01-25T15:00:00",
-                "end": "2025-01-25T17:00:00",
-                "status": "completed",
-                "service_type": "maintenance",
-                "technician": "Sarah Davis",
-                "address": "321 Elm St, Newtown, ST 22222",
-                "source": "manual"
-            }
-        ]
-        
-        return {
-            "appointments": calendar_appointments,
-            "view": view,
-            "start_date": start_date,
-            "end_date": end_date
-        }
-        
-    except Exception as e:
-        logger.error(f"Failed to get calendar appointments: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-@app.get("/api/appointments/filter")
-async def filter_appointments(
-    status: Optional[str] = None,
-    date_from: Optional[str] = None,
-    date_to: Optional[str] = None,
-    technician: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
-):
-    """Filter appointments by status and other criteria"""
-    
-    try:
-        company_id = current_user.get("company_id", "company-001")
-        
-        # Get all appointments (same as calendar data)
-        all_appointments = [
-            {
-                "id": "appt-001",
-                "title": "HVAC Maintenance - Martinez",
-                "customer_name": "Jennifer Martinez", 
-                "customer_id": "customer-001",
-                "scheduled_date": "2025-01-24T09:00:00",
-                "status": "scheduled",
-                "service_type": "maintenance",
-                "technician": "Mike Johnson",
-                "address": "123 Main St, Anytown, ST 12345",
-                "source": "manual",
-                "description": "Regular HVAC system maintenance"
-            },
-            {
-                "id": "appt-002",
-                "title": "No Heat Service - Thompson", 
-                "customer_name": "Robert Thompson",
-                "customer_id": "customer-002", 
-                "scheduled_date": "2025-01-24T14:00:00",
-                "status": "confirmed",
-                "service_type": "no_heat", 
-                "technician": "Sarah Davis",
-                "address": "456 Oak Ave, Somewhere, ST 67890",
-                "source": "ai-voice",
-                "is_ai_generated": True,
-                "description": "Customer called via AI Voice system reporting no heat issue"
-            },
-            {
-                "id": "appt-003",
-                "title": "AC Installation - Anderson",
-                "customer_name": "Lisa Anderson",
-                "customer_id": "customer-003",
-                "scheduled_date": "2025-01-25T08:00:00", 
-                "status": "in_progress",
-                "service_type": "installation",
-                "technician": "Mike Johnson",
-                "address": "789 Pine Dr, Elsewhere, ST 11111",
-                "source": "manual",
-                "description": "New AC unit installation"
-            },
-            {
-                "id": "appt-004",
-                "title": "System Check - Davis",
-                "customer_name": "Michael Davis",
-                "customer_id": "customer-004",
-                "scheduled_date": "2025-01-23T15:00:00",
-                "status": "completed", 
-                "service_type": "maintenance",
-                "technician": "Sarah Davis",
-                "address": "321 Elm St, Newtown, ST 22222",
-                "source": "manual",
-                "description": "Completed system maintenance check"
-            }
-        ]
-        
-        # Apply status filter
-        filtered_appointments = all_appointments
-        if status:
-            filtered_appointments = [a for a in filtered_appointments if a["status"] == status]
-        
-        # Apply technician filter
-        if technician:
-            filtered_appointments = [a for a in filtered_appointments if technician.lower() in a["technician"].lower()]
-            
-        return {
-            "appointments": filtered_appointments,
-            "total": len(filtered_appointments),
-            "filters": {
-                "status": status,
-                "date_from": date_from,
-                "date_to": date_to,
-                "technician": technician
-            }
-        }
-        
-    except Exception as e:
-        logger.error(f"Failed to filter appointments: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-
 @app.post("/api/settings/test-sms")
 async def test_sms_settings(
     test_data: dict,
@@ -3847,6 +4322,19 @@ async def test_sms_settings(
 
 # ==================== ADMIN ANALYTICS ENDPOINTS ====================
 
+@app.get("/api/admin/cache-stats")
+async def get_cache_stats(current_user: dict = Depends(require_admin)):
+    """Response cache hit/miss counters for TTL tuning"""
+    return {
+        "caches": [dashboard_cache.stats(), owner_insights_cache.stats(), settings_cache.stats()],
+        "invalidation_bus": invalidation_bus.stats(),
+        "customer_search": customer_search.stats(),
+        "schedule_index": schedule_index.stats(),
+        "customer_phone_directory": customer_phone_directory.stats(),
+        "location_ingest": location_ingest.stats(),
+        "live_events": {**change_listener.stats(), **event_broadcaster.stats()}
+    }
+
 @app.get("/api/admin/analytics")
 async def get_admin_analytics(current_user: dict = Depends(require_admin)):
     """Get multi-tenant admin analytics"""
@@ -3937,58 +4425,107 @@ async def export_company_data(company_id: str, current_user: dict = Depends(requ
 
 # ==================== DASHBOARD DATA ENDPOINTS ====================
 
+@app.get("/api/events/{company_id}")
+async def stream_company_events(company_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    """Server-sent events with appointment, job, call and notification deltas for one company.
+
+    The first event is `status` with `live: false` when change streams are
+    unavailable (clients should keep polling). A `resync` event means deltas
+    were dropped and the client should refetch its views.
+    """
+    if current_user.get("company_id") != company_id and current_user.get("role") != UserRole.ADMIN.value:
+        raise HTTPException(status_code=403, detail="Not allowed to follow this company")
+
+    queue = event_broadcaster.subscribe(company_id)
+
+    async def event_stream():
+        try:
+            yield format_sse("status", {"live": change_listener.live})
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event["type"], event)
+        finally:
+            event_broadcaster.unsubscribe(company_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/dashboard/{company_id}")
-async def get_dashboard_data(company_id: str):
+async def get_dashboard_data(company_id: str, response: Response = None):
     """Get main dashboard data"""
+    (dashboard, server_timing), cache_status = await dashboard_cache.get_or_compute(
+        company_id, lambda: build_dashboard_data(company_id)
+    )
+    apply_cache_headers(response, cache_status, server_timing)
+    return dashboard
+
+async def build_dashboard_data(company_id: str) -> tuple:
+    """Compute main dashboard data; returns (dashboard, Server-Timing header value)"""
     
     today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     
+    fanout = QueryFanout()
+    
     # Quick stats
-    total_customers = await db.customers.count_documents({"company_id": company_id})
-    pending_jobs = await db.jobs.count_documents({"company_id": company_id, "status": "pending"})
-    active_technicians = await db.technicians.count_documents({"company_id": company_id, "is_active": True})
+    fanout.add("total_customers", db.customers.count_documents({"company_id": company_id}), default=0)
+    fanout.add("pending_jobs", db.jobs.count_documents({"company_id": company_id, "status": "pending"}), default=0)
+    fanout.add("active_technicians", db.technicians.count_documents({"company_id": company_id, "is_active": True}), default=0)
     
     # Today's appointments
-    todays_appointments = await db.appointments.find({
+    fanout.add("todays_appointments", db.appointments.find({
         "company_id": company_id,
         "scheduled_date": {"$gte": today, "$lt": today + timedelta(days=1)}
-    }).sort("scheduled_date", 1).to_list(10)
+    }).sort("scheduled_date", 1).to_list(10), default=[])
     
     # Recent inquiries
-    recent_inquiries = await db.inquiries.find({
+    fanout.add("recent_inquiries", db.inquiries.find({
         "company_id": company_id
-    }).sort("created_at", -1).limit(5).to_list(5)
+    }).sort("created_at", -1).limit(5).to_list(5), default=[])
     
     # Urgent jobs
-    urgent_jobs = await db.jobs.find({
+    fanout.add("urgent_jobs", db.jobs.find({
         "company_id": company_id,
         "priority": {"$in": ["high", "emergency"]},
         "status": {"$ne": "completed"}
-    }).sort("created_at", -1).limit(5).to_list(5)
+    }).sort("created_at", -1).limit(5).to_list(5), default=[])
     
-    return {
+    results = await fanout.gather()
+    
+    todays_appointments = results["todays_appointments"]
+    
+    dashboard = {
         "stats": {
-            "total_customers": total_customers,
-            "pending_jobs": pending_jobs,
-            "active_technicians": active_technicians,
+            "total_customers": results["total_customers"],
+            "pending_jobs": results["pending_jobs"],
+            "active_technicians": results["active_technicians"],
             "todays_appointments": len(todays_appointments)
         },
         "todays_appointments": [Appointment(**appt).dict() for appt in todays_appointments],
-        "recent_inquiries": [Inquiry(**inq).dict() for inq in recent_inquiries],
-        "urgent_jobs": [Job(**job).dict() for job in urgent_jobs]
+        "recent_inquiries": [Inquiry(**inq).dict() for inq in results["recent_inquiries"]],
+        "urgent_jobs": [Job(**job).dict() for job in results["urgent_jobs"]],
+        "failed_queries": fanout.failed_queries
     }
+    
+    return dashboard, fanout.server_timing()
 
     # Add duplicate endpoints at root level for production compatibility
     
 @app.get("/dashboard/{company_id}")
-async def get_dashboard_data_root(company_id: str):
+async def get_dashboard_data_root(company_id: str, response: Response):
     """Get main dashboard data - root level"""
-    return await get_dashboard_data(company_id)
+    return await get_dashboard_data(company_id, response)
 
 @app.get("/owner-insights")
-async def get_owner_insights_root(company_id: str = Query(...)):
+async def get_owner_insights_root(response: Response, company_id: str = Query(...)):
     """Get owner insights - root level"""
-    return await get_owner_insights(company_id)
+    return await get_owner_insights(company_id, response)
 
 @app.get("/settings/{company_id}")
 async def get_company_settings_root(company_id: str):
@@ -4007,12 +4544,14 @@ async def health_check():
         db_status = "healthy"
     except Exception as e:
         db_status = f"error: {str(e)}"
+    indexes_status = f"missing unique: {'; '.join(missing_unique_indexes)}" if missing_unique_indexes else "healthy"
     
     return {
-        "status": "healthy" if db_status == "healthy" else "degraded",
+        "status": "healthy" if db_status == "healthy" and indexes_status == "healthy" else "degraded",
         "timestamp": datetime.utcnow().isoformat(),
         "services": {
             "database": db_status,
+            "indexes": indexes_status,
             "sms": "mock",
             "calendar": "mock",
             "llm": "mock"
@@ -4043,12 +4582,14 @@ async def health_check_root():
         db_status = "healthy"
     except Exception as e:
         db_status = f"error: {str(e)}"
+    indexes_status = f"missing unique: {'; '.join(missing_unique_indexes)}" if missing_unique_indexes else "healthy"
     
     return {
-        "status": "healthy" if db_status == "healthy" else "degraded",
+        "status": "healthy" if db_status == "healthy" and indexes_status == "healthy" else "degraded",
         "timestamp": datetime.utcnow().isoformat(),
         "services": {
             "database": db_status,
+            "indexes": indexes_status,
             "sms": "mock",
             "calendar": "mock",
             "llm": "mock"
@@ -4071,10 +4612,77 @@ async def internal_error_handler(request: Request, exc: Exception):
         content={"detail": "Internal server error"}
     )
 
+# MongoDB indexes ensured at startup: (collection, keys, options)
+MONGO_INDEXES = [
+    ("invoices", [("company_id", 1), ("invoice_number", 1)], {"unique": True}),
+    ("qa_gates", [("job_id", 1)], {}),
+    ("warranty_registrations", [("job_id", 1)], {}),
+    ("inspections", [("job_id", 1)], {}),
+    ("subcontractor_payments", [("company_id", 1), ("payment_status", 1)], {}),
+    ("calendar_events", [("appointment_id", 1)], {"unique": True}),
+    ("calendar_events", [("sync_status", 1), ("next_attempt_at", 1)], {}),
+    ("calendar_events", [("claim_token", 1)], {}),
+    ("calendar_events", [("google_event_id", 1)], {}),
+    ("appointments", [("calendar_event_id", 1)], {}),
+    ("appointments", [("company_id", 1), ("technician_id", 1), ("scheduled_date", 1)], {}),
+    *[("appointments", keys, options) for keys, options in AppointmentCalendarService.INDEXES],
+    ("customers", [("company_id", 1), ("id", 1)], {}),
+    ("customers", [("company_id", 1), ("phone_e164", 1)], {}),
+    ("customers", [("phone_e164", 1)], {}),
+    *[("technicians", keys, options) for keys, options in TechnicianSearchService.INDEXES],
+    *[("technicians", keys, options) for keys, options in DispatchService.INDEXES],
+    ("customers", [("location", "2dsphere")], {}),
+    *TechnicianSyncService.INDEXES,
+    *[("messages", keys, options) for keys, options in MessagingService.INDEXES],
+]
+
+# Indexes replaced by a different layout of the same keys
+SUPERSEDED_INDEXES = [
+    *[("technicians", name) for name in DispatchService.SUPERSEDED_INDEXES],
+]
+
+# maintenance.py commands that remove the duplicates blocking a unique index
+UNIQUE_INDEX_REPAIRS = {
+    "invoices": "dedupe-invoice-numbers",
+}
+
+# Unique indexes that failed to build; reported by the health checks
+missing_unique_indexes: List[str] = []
+
+async def ensure_indexes():
+    """Create the MongoDB indexes the API relies on (no-op if they already exist)"""
+    missing_unique_indexes.clear()
+    for collection, name in SUPERSEDED_INDEXES:
+        try:
+            await db[collection].drop_index(name)
+            logger.info(f"Dropped superseded index {name} on {collection}")
+        except OperationFailure:
+            pass  # Already gone
+    for collection, keys, options in MONGO_INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except Exception as e:
+            if not options.get("unique"):
+                logger.error(f"Failed to create index {keys} on {collection}: {str(e)}")
+                continue
+            # Without the index duplicates are silently accepted again
+            missing_unique_indexes.append(f"{collection} {keys}")
+            repair = UNIQUE_INDEX_REPAIRS.get(collection)
+            logger.critical(
+                f"Unique index {keys} on {collection} could not be built, duplicates are NOT prevented: {str(e)}"
+                + (f". Run `python maintenance.py {repair}` and restart." if repair else "")
+            )
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
     """Initialize application on startup"""
+    await ensure_indexes()
+    await invalidation_bus.start(db)
+    calendar_sync_worker.start()
+    calendar_sync_engine.start()
+    location_ingest.start()
+    change_listener.start()
     logger.info("HVAC Assistant API v2.0 started successfully")
     logger.info(f"MongoDB connected: {mongo_url}")
     logger.info("Mock services initialized for development")
@@ -4083,5 +4691,10 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean up resources on shutdown"""
+    await invalidation_bus.stop()
+    await calendar_sync_worker.stop()
+    await calendar_sync_engine.stop()
+    await location_ingest.stop()
+    await change_listener.stop()
     client.close()
     logger.info("HVAC Assistant API shutdown complete")
\ No newline at end of file
@@ -1,15 +1,27 @@
 import os
 import asyncio
 import logging
-from typing import Optional, Dict, Any, List
-from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List, Callable
+from datetime import datetime, timedelta, timezone
 import json
+import re
+import uuid
+import base64
+import hashlib
 import httpx
+from collections import deque
+from pymongo import ReturnDocument, UpdateOne
 from phase2_models import (
     Message, MessageCreate, MessageThread, 
     CustomerRating, RatingCreate, OwnerNotification, NotificationCreate,
     SMSTemplate, CalendarEvent, CalendarEventCreate
 )
+from models import QAGate, SubcontractorPayment, PaymentStatus, Technician, TechnicianStatus, AppointmentStatus
+from mock_stores import BoundedStore, MockBehavior
+from search_index import customer_phone_directory
+from geo import geojson_point, point_from_location
+from caching import change_versions
+from route_optimizer import RouteOptimizer, parse_time_window
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +33,8 @@ class MockTwilioService:
         self.account_sid = os.getenv("TWILIO_ACCOUNT_SID", "mock_account_sid")
         self.auth_token = os.getenv("TWILIO_AUTH_TOKEN", "mock_auth_token")
         self.phone_number = os.getenv("TWILIO_PHONE_NUMBER", "+1234567890")
-        self.sent_messages = []  # Store mock sent messages
+        self.sent_messages = BoundedStore("sid", index_fields=["to"])  # Recent mock sent messages
+        self.behavior = MockBehavior("sms")
         
     async def send_message(self, to_number: str, message: str) -> Dict[str, Any]:
         """Send message (alias for send_sms)"""
@@ -31,10 +44,12 @@ class MockTwilioService:
         """Mock SMS sending"""
         if not from_number:
             from_number = self.phone_number
+        
+        await self.behavior.apply("send_sms")
             
         # Simulate SMS sending
         message_data = {
-            "sid": f"mock_sms_{len(self.sent_messages) + 1}",
+            "sid": f"mock_sms_{self.sent_messages.total_added + 1}",
             "to": to,
             "from": from_number,
             "body": body,
@@ -51,7 +66,12 @@ class MockTwilioService:
         
     async def get_message_status(self, message_sid: str) -> str:
         """Mock message status check"""
-        return "delivered"
+        message = self.sent_messages.get(message_sid)
+        return "delivered" if message is None or message["status"] == "sent" else message["status"]
+    
+    def messages_to(self, to: str) -> List[Dict[str, Any]]:
+        """Recent mock messages sent to a number"""
+        return self.sent_messages.find_by("to", to)
         
     def process_webhook(self, webhook_data: Dict[str, Any]) -> Dict[str, Any]:
         """Process incoming SMS webhook (mock)"""
@@ -62,70 +82,232 @@ class MockTwilioService:
             "message_sid": webhook_data.get("MessageSid", f"mock_incoming_{datetime.utcnow().timestamp()}")
         }
 
-class MockGoogleCalendarService:
+class CalendarBatchMixin:
+    """Batch execution shared by calendar clients"""
+    
+    async def execute_batch(self, calendar_id: str, operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Run create/update/delete operations for one calendar as a batch.
+        
+        Each operation is {"operation", "event_id", "event_data", "retry_count"}; results
+        come back in the same order as {"ok": bool, "event_id": str, "error": str}.
+        """
+        results = []
+        for op in operations:
+            try:
+                if op["operation"] == "create":
+                    event_id = await self.create_event(op["event_data"], op.get("retry_count", 0), calendar_id)
+                elif op["operation"] == "update":
+                    event_id = op["event_id"]
+                    if not await self.update_event(event_id, op["event_data"], calendar_id):
+                        raise Exception(f"Event {event_id} not found")
+                elif op["operation"] == "delete":
+                    event_id = op["event_id"]
+                    await self.delete_event(event_id, calendar_id)  # Already gone counts as deleted
+                else:
+                    raise ValueError(f"Unknown calendar operation: {op['operation']}")
+                results.append({"ok": True, "event_id": event_id})
+            except Exception as e:
+                results.append({"ok": False, "error": str(e)})
+        
+        logger.info(f"Calendar batch on {calendar_id}: {len(operations)} operations")
+        return results
+
+class SyncTokenExpired(Exception):
+    """Sync token too old for an incremental listing (the provider answers 410 Gone)"""
+
+class MockGoogleCalendarService(CalendarBatchMixin):
     """Mock Google Calendar service for development"""
     
+    # Changes kept for incremental listings; older sync tokens expire
+    CHANGE_LOG_LIMIT = 1000
+    
     def __init__(self):
         self.client_id = os.getenv("GOOGLE_CLIENT_ID", "mock_client_id")
         self.client_secret = os.getenv("GOOGLE_CLIENT_SECRET", "mock_secret")
         self.refresh_token = os.getenv("GOOGLE_REFRESH_TOKEN", "mock_refresh_token")
         self.calendar_id = os.getenv("GOOGLE_CALENDAR_ID", "mock_calendar_id")
-        self.created_events = []
+        self.created_events = BoundedStore("id", index_fields=["calendar_id"])
+        self.deleted_events = BoundedStore("id")  # Cancelled events (tombstones)
+        self.change_log = deque(maxlen=self.CHANGE_LOG_LIMIT)  # (change_seq, event_id)
+        self.change_seq = 0
+        self.behavior = MockBehavior("calendar")
+    
+    def _record_change(self, event: Dict[str, Any]):
+        """Append an event change to the log used for incremental listings"""
+        self.change_seq += 1
+        event["updated"] = datetime.utcnow().isoformat()
+        self.change_log.append((self.change_seq, event["id"]))
+        
+    async def create_event(self, event_data: Dict[str, Any], retry_count: int = 0, calendar_id: Optional[str] = None) -> Optional[str]:
+        """Mock calendar event creation (retries are scheduled by CalendarSyncWorker)"""
+        await self.behavior.apply("create_event")
+        
+        # Simulate occasional first-attempt failures for retry testing
+        if retry_count == 0 and self.created_events.total_added % 5 == 4:
+            logger.error(f"Mock calendar event creation failed (attempt {retry_count + 1})")
+            raise Exception("Mock calendar service temporarily unavailable")
+        
+        # Create mock event
+        event_id = f"mock_event_{self.created_events.total_added + 1}_{datetime.utcnow().timestamp()}"
+        
+        mock_event = {
+            "id": event_id,
+            "calendar_id": calendar_id or self.calendar_id,
+            "summary": event_data.get("summary", "HVAC Appointment"),
+            "start": event_data.get("start", {}),
+            "end": event_data.get("end", {}),
+            "attendees": event_data.get("attendees", []),
+            "description": event_data.get("description", ""),
+            "created": datetime.utcnow().isoformat(),
+            "status": "confirmed"
+        }
         
-    async def create_event(self, event_data: Dict[str, Any], retry_count: int = 0) -> Optional[str]:
-        """Mock calendar event creation with retry logic"""
-        try:
-            # Simulate potential failures for retry testing
-            if retry_count == 0 and len(self.created_events) % 5 == 4:
-                raise Exception("Mock calendar service temporarily unavailable")
-            
-            # Create mock event
-            event_id = f"mock_event_{len(self.created_events) + 1}_{datetime.utcnow().timestamp()}"
-            
-            mock_event = {
-                "id": event_id,
-                "summary": event_data.get("summary", "HVAC Appointment"),
-                "start": event_data.get("start", {}),
-                "end": event_data.get("end", {}),
-                "attendees": event_data.get("attendees", []),
-                "description": event_data.get("description", ""),
-                "created": datetime.utcnow().isoformat(),
-                "status": "confirmed"
-            }
-            
-            self.created_events.append(mock_event)
-            
-            logger.info(f"Mock calendar event created: {event_id}")
-            return event_id
-            
-        except Exception as e:
-            logger.error(f"Mock calendar event creation failed (attempt {retry_count + 1}): {str(e)}")
-            
-            # Implement exponential backoff retry (max 3 attempts)
-            if retry_count < 2:
-                await asyncio.sleep(2 ** retry_count)
-                return await self.create_event(event_data, retry_count + 1)
-            
-            raise e
+        self.created_events.append(mock_event)
+        self._record_change(mock_event)
+        
+        logger.info(f"Mock calendar event created: {event_id}")
+        return event_id
+    
+    def _in_calendar(self, event_id: str, calendar_id: Optional[str]) -> bool:
+        """Whether the event exists in `calendar_id` (any calendar when None)"""
+        event = self.created_events.get(event_id)
+        return event is not None and (calendar_id is None or event["calendar_id"] == calendar_id)
     
-    async def update_event(self, event_id: str, event_data: Dict[str, Any]) -> bool:
+    async def update_event(self, event_id: str, event_data: Dict[str, Any], calendar_id: Optional[str] = None) -> bool:
         """Mock event update"""
-        for event in self.created_events:
-            if event["id"] == event_id:
-                event.update(event_data)
-                event["updated"] = datetime.utcnow().isoformat()
-                logger.info(f"Mock calendar event updated: {event_id}")
-                return True
-        return False
-    
-    async def delete_event(self, event_id: str) -> bool:
+        await self.behavior.apply("update_event")
+        
+        if not self._in_calendar(event_id, calendar_id):
+            return False
+        event = self.created_events.update(event_id, event_data)
+        if event is None:
+            return False
+        
+        self._record_change(event)
+        logger.info(f"Mock calendar event updated: {event_id}")
+        return True
+    
+    async def delete_event(self, event_id: str, calendar_id: Optional[str] = None) -> bool:
         """Mock event deletion"""
-        for i, event in enumerate(self.created_events):
-            if event["id"] == event_id:
-                del self.created_events[i]
-                logger.info(f"Mock calendar event deleted: {event_id}")
-                return True
-        return False
+        await self.behavior.apply("delete_event")
+        
+        if not self._in_calendar(event_id, calendar_id):
+            return False
+        event = self.created_events.remove(event_id)
+        if event is None:
+            return False
+        
+        event["status"] = "cancelled"
+        self.deleted_events.append(event)
+        self._record_change(event)
+        logger.info(f"Mock calendar event deleted: {event_id}")
+        return True
+    
+    async def list_events(
+        self,
+        calendar_id: str,
+        sync_token: Optional[str] = None,
+        page_token: Optional[str] = None,
+        max_results: int = 250
+    ) -> Dict[str, Any]:
+        """Mock events.list: a full listing without a sync token, only changes since it otherwise.
+        
+        Returns {"items": [...], "nextPageToken": ...} or, on the last page,
+        {"items": [...], "nextSyncToken": ...}. Cancelled events appear in
+        incremental listings. Raises SyncTokenExpired for tokens older than
+        the retained change log.
+        """
+        await self.behavior.apply("list_events")
+        
+        if page_token:
+            since, offset, snapshot_seq = page_token.split(":")
+            since = None if since == "full" else int(since)
+            offset, snapshot_seq = int(offset), int(snapshot_seq)
+        else:
+            since = int(sync_token) if sync_token else None
+            offset, snapshot_seq = 0, self.change_seq
+        
+        if since is None:
+            items = sorted(self.created_events.find_by("calendar_id", calendar_id), key=lambda e: e["id"])
+        else:
+            oldest_retained = self.change_log[0][0] if self.change_log else self.change_seq + 1
+            if since < oldest_retained - 1:
+                raise SyncTokenExpired(f"Sync token {since} is no longer valid")
+            
+            changed_ids = list(dict.fromkeys(
+                event_id for seq, event_id in self.change_log if since < seq <= snapshot_seq
+            ))
+            items = [
+                event for event in (
+                    self.created_events.get(event_id) or self.deleted_events.get(event_id)
+                    for event_id in changed_ids
+                )
+                if event and event.get("calendar_id", self.calendar_id) == calendar_id
+            ]
+        
+        page = [dict(event) for event in items[offset:offset + max_results]]
+        if offset + max_results < len(items):
+            return {
+                "items": page,
+                "nextPageToken": f"{'full' if since is None else since}:{offset + max_results}:{snapshot_seq}"
+            }
+        return {"items": page, "nextSyncToken": str(snapshot_seq)}
+
+class CalendarApiClient(CalendarBatchMixin):
+    """Calendar provider client over HTTP (e.g. the stand-in in mock_calendar_server.py)"""
+    
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.calendar_id = os.getenv("GOOGLE_CALENDAR_ID", "mock_calendar_id")
+        self._client: Optional[httpx.AsyncClient] = None
+    
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=10.0)
+        return await self._client.request(method, path, **kwargs)
+    
+    async def create_event(self, event_data: Dict[str, Any], retry_count: int = 0, calendar_id: Optional[str] = None) -> Optional[str]:
+        response = await self._request(
+            "POST", f"/calendars/{calendar_id or self.calendar_id}/events",
+            json=event_data, params={"retryCount": retry_count}
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+    
+    async def update_event(self, event_id: str, event_data: Dict[str, Any], calendar_id: Optional[str] = None) -> bool:
+        response = await self._request(
+            "PATCH", f"/calendars/{calendar_id or self.calendar_id}/events/{event_id}", json=event_data
+        )
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+    
+    async def delete_event(self, event_id: str, calendar_id: Optional[str] = None) -> bool:
+        response = await self._request("DELETE", f"/calendars/{calendar_id or self.calendar_id}/events/{event_id}")
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+    
+    async def list_events(
+        self,
+        calendar_id: str,
+        sync_token: Optional[str] = None,
+        page_token: Optional[str] = None,
+        max_results: int = 250
+    ) -> Dict[str, Any]:
+        params = {"maxResults": max_results}
+        if sync_token:
+            params["syncToken"] = sync_token
+        if page_token:
+            params["pageToken"] = page_token
+        
+        response = await self._request("GET", f"/calendars/{calendar_id}/events", params=params)
+        if response.status_code == 410:
+            raise SyncTokenExpired(response.text)
+        response.raise_for_status()
+        return response.json()
 
 class LLMService:
     """Real LLM service using Emergent LLM Key"""
@@ -249,11 +431,15 @@ class MockEmailService:
     def __init__(self):
         self.api_key = os.getenv("SENDGRID_API_KEY", "mock_sendgrid_key")
         self.from_email = os.getenv("FROM_EMAIL", "noreply@hvactech.com")
-        self.sent_emails = []
+        self.sent_emails = BoundedStore("message_id", index_fields=["to"])
+        self.behavior = MockBehavior("email")
         
     async def send_email(self, to: str, subject: str, content: str, content_type: str = "text/html") -> bool:
         """Mock email sending"""
+        await self.behavior.apply("send_email")
+        
         email_data = {
+            "message_id": f"mock_email_{self.sent_emails.total_added + 1}",
             "to": to,
             "from": self.from_email,
             "subject": subject,
@@ -267,24 +453,104 @@ class MockEmailService:
         logger.info(f"Mock email sent to {to}: {subject}")
         return True
 
+class MockGeocodingService:
+    """Mock geocoder: deterministically places an address near the service area center"""
+    
+    # Seed data is in northern Illinois
+    CENTER = (41.8781, -87.6298)
+    SPREAD_DEGREES = 0.5
+    
+    def __init__(self):
+        self.geocoded = BoundedStore("address")
+        self.behavior = MockBehavior("geocoding")
+    
+    @staticmethod
+    def format_address(address: Any) -> str:
+        """One-line address from the customer address dict ({"full"} or street/city/state/zip)"""
+        if isinstance(address, dict):
+            return ", ".join(str(value).strip() for value in address.values() if value and str(value).strip())
+        return str(address or "").strip()
+    
+    async def geocode(self, address: Any) -> Optional[Dict[str, float]]:
+        """Coordinates ({"lat", "lng"}) for an address, None if it is empty"""
+        line = self.format_address(address).lower()
+        if not line:
+            return None
+        
+        cached = self.geocoded.get(line)
+        if cached:
+            return cached["location"]
+        
+        await self.behavior.apply("geocode")
+        digest = hashlib.sha256(line.encode()).digest()
+        lat_offset = int.from_bytes(digest[:4], "big") / 0xFFFFFFFF - 0.5
+        lng_offset = int.from_bytes(digest[4:8], "big") / 0xFFFFFFFF - 0.5
+        location = {
+            "lat": round(self.CENTER[0] + lat_offset * self.SPREAD_DEGREES, 6),
+            "lng": round(self.CENTER[1] + lng_offset * self.SPREAD_DEGREES, 6)
+        }
+        self.geocoded.append({"address": line, "location": location})
+        return location
+
 # Phase 2 Service Classes
 class MessagingService:
     """In-app messaging with SMS bridge"""
     
+    # (keys, options) for the messages collection
+    INDEXES = [
+        ([("job_id", 1), ("created_at", 1), ("id", 1)], {}),
+    ]
+    
     def __init__(self, sms_service: MockTwilioService, db):
         self.sms_service = sms_service
         self.db = db
+    
+    @staticmethod
+    def _cursor_filter(cursor: tuple, op: str) -> Dict[str, Any]:
+        created_at, message_id = cursor
+        if message_id is None:
+            return {"created_at": {op: created_at}}
+        return {"$or": [{"created_at": {op: created_at}}, {"created_at": created_at, "id": {op: message_id}}]}
+    
+    async def list_messages(
+        self, job_id: str, after: Optional[tuple] = None, before: Optional[tuple] = None, limit: int = 100
+    ) -> tuple:
+        """A page of a job's messages in (created_at, id) order, plus whether more lie beyond it
+        
+        With `after` the page starts just past that cursor (new messages);
+        otherwise it is the `limit` messages ending just before `before`, or
+        the newest ones. Cursors are (created_at, id), id None for a bare time.
+        """
+        query: Dict[str, Any] = {"job_id": job_id}
+        bounds = []
+        if after:
+            bounds.append(self._cursor_filter(after, "$gt"))
+        if before:
+            bounds.append(self._cursor_filter(before, "$lt"))
+        if bounds:
+            query["$and"] = bounds
+        
+        direction = 1 if after else -1
+        messages = await self.db.messages.find(query, {"_id": 0}).sort(
+            [("created_at", direction), ("id", direction)]
+        ).to_list(limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if direction < 0:
+            messages.reverse()
+        return messages, has_more
         
     async def send_message(self, message_data: MessageCreate) -> Message:
         """Send message and optionally bridge to SMS"""
         
+        message = Message(**message_data.dict(), thread_id=message_data.job_id)
+        
+        # Update thread and take the message's sequence number
+        message.seq = await self.update_message_thread(message)
+        
         # Create message in database
-        message = Message(**message_data.dict())
         await self.db.messages.insert_one(message.dict())
         
-        # Update thread
-        await self.update_message_thread(message)
-        
         # Bridge to SMS if customer is involved and not already SMS
         if message.sender_type != "customer" and not message.is_sms_bridge:
             await self.bridge_to_sms(message)
@@ -321,59 +587,59 @@ class MessagingService:
         except Exception as e:
             logger.error(f"Failed to bridge message to SMS: {str(e)}")
     
-    async def update_message_thread(self, message: Message):
-        """Update message thread with new message"""
-        
-        thread_filter = {"job_id": message.job_id}
-        
-        thread_update = {
-            "$set": {
-                "last_message_at": message.created_at,
-                "last_message_content": message.content[:100],
-                "updated_at": datetime.utcnow()
-            },
-            "$inc": {f"unread_counts.{message.sender_id}": 0}  # Don't increment for sender
-        }
+    async def update_message_thread(self, message: Message) -> int:
+        """Update message thread with new message and return its sequence number
         
-        # Increment unread count for other participants
-        existing_thread = await self.db.message_threads.find_one(thread_filter)
-        if existing_thread:
-            for participant in existing_thread.get("participants", []):
-                if participant["user_id"] != message.sender_id:
-                    thread_update["$inc"][f"unread_counts.{participant['user_id']}"] = 1
+        A single pipeline update bumps message_seq and moves the sender's read
+        watermark to it, so concurrent messages cannot lose unread increments.
+        """
         
-        await self.db.message_threads.update_one(
-            thread_filter,
-            thread_update,
-            upsert=True
+        now = datetime.utcnow()
+        
+        thread = await self.db.message_threads.find_one_and_update(
+            {"job_id": message.job_id},
+            [
+                {
+                    "$set": {
+                        "id": {"$ifNull": ["$id", {"$literal": str(uuid.uuid4())}]},
+                        "company_id": {"$ifNull": ["$company_id", {"$literal": message.company_id}]},
+                        "participants": {"$ifNull": ["$participants", []]},
+                        "is_active": {"$ifNull": ["$is_active", True]},
+                        "created_at": {"$ifNull": ["$created_at", now]},
+                        "message_seq": {"$add": [{"$ifNull": ["$message_seq", 0]}, 1]},
+                        "last_message_at": message.created_at,
+                        "last_message_content": {"$literal": message.content[:100]},
+                        "updated_at": now
+                    }
+                },
+                {"$set": {f"read_watermarks.{message.sender_id}": "$message_seq"}}
+            ],
+            projection={"message_seq": 1, "company_id": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
+        await change_versions.bump(self.db, "message_threads", thread.get("company_id"))
+        
+        return thread["message_seq"]
     
     async def mark_messages_read(self, job_id: str, user_id: str) -> int:
-        """Mark messages as read for a user"""
-        
-        # Add read receipt to messages
-        await self.db.messages.update_many(
-            {
-                "job_id": job_id,
-                "sender_id": {"$ne": user_id}
-            },
-            {
-                "$addToSet": {
-                    "read_by": {
-                        "user_id": user_id,
-                        "read_at": datetime.utcnow()
-                    }
-                }
-            }
-        )
+        """Mark messages as read for a user and return the new read watermark"""
         
-        # Reset unread count for user
-        await self.db.message_threads.update_one(
+        # Move the user's watermark up to the latest message in the thread; the stored
+        # count is cleared too, since legacy threads (no message_seq) are not recomputed
+        thread = await self.db.message_threads.find_one_and_update(
             {"job_id": job_id},
-            {"$set": {f"unread_counts.{user_id}": 0}}
+            [{"$set": {
+                f"read_watermarks.{user_id}": {"$ifNull": ["$message_seq", 0]},
+                f"unread_counts.{user_id}": 0
+            }}],
+            projection={"message_seq": 1, "company_id": 1}
         )
+        if not thread:
+            return 0
+        await change_versions.bump(self.db, "message_threads", thread.get("company_id"))
         
-        return 1
+        return thread.get("message_seq", 0)
 
 class RatingService:
     """Customer rating system with SMS automation"""
@@ -442,7 +708,7 @@ Reply with just the number. Thank you!"""
             return False
         
         # Find pending rating request
-        customer = await self.db.customers.find_one({"phone": customer_phone})
+        customer = await customer_phone_directory.lookup(self.db, customer_phone)
         if not customer:
             return False
         
@@ -456,9 +722,9 @@ Reply with just the number. Thank you!"""
         if not pending_rating:
             return False
         
-        # Update rating
-        await self.db.ratings.update_one(
-            {"id": pending_rating["id"]},
+        # Update rating (the filter on rating=0 makes duplicate replies a no-op)
+        result = await self.db.ratings.update_one(
+            {"id": pending_rating["id"], "rating": 0},
             {
                 "$set": {
                     "rating": rating_value,
@@ -468,8 +734,11 @@ Reply with just the number. Thank you!"""
             }
         )
         
-        # Update technician average rating
-        await self.update_technician_rating(pending_rating["technician_id"])
+        if result.modified_count == 0:
+            return False
+        
+        # Update technician rating counters
+        await self.record_technician_rating(pending_rating["technician_id"], rating_value)
         
         # Send low rating notification if needed
         if rating_value <= 3:
@@ -478,31 +747,86 @@ Reply with just the number. Thank you!"""
         logger.info(f"Rating {rating_value} processed for job {pending_rating['job_id']}")
         return True
     
-    async def update_technician_rating(self, technician_id: str):
-        """Update technician's rolling average rating"""
+    async def record_technician_rating(self, technician_id: str, rating_value: int):
+        """Add a rating to the technician's running sum/count counters
         
-        # Get all ratings for technician
-        ratings = await self.db.ratings.find({
-            "technician_id": technician_id,
-            "rating": {"$gt": 0}
-        }).to_list(1000)
+        Technicians without counters yet (legacy documents, or a first rating)
+        get them initialised from the ratings collection, which already holds
+        this rating, so historical ratings are never replaced by the new one.
+        """
         
-        if not ratings:
-            return
+        increment = {"$inc": {"rating_sum": rating_value, "rating_count": 1}}
+        technician = await self.db.technicians.find_one_and_update(
+            {"id": technician_id, "rating_count": {"$gt": 0}}, increment, projection={"company_id": 1}
+        )
+        if not technician:
+            totals = await self.db.ratings.aggregate([
+                {"$match": {"technician_id": technician_id, "rating": {"$gt": 0}}},
+                {"$group": {"_id": None, "rating_sum": {"$sum": "$rating"}, "rating_count": {"$sum": 1}}}
+            ]).to_list(1)
+            total = totals[0] if totals else {"rating_sum": rating_value, "rating_count": 1}
+            technician = await self.db.technicians.find_one_and_update(
+                {"id": technician_id, "$or": [{"rating_count": {"$exists": False}}, {"rating_count": {"$lte": 0}}]},
+                {"$set": {"rating_sum": total["rating_sum"], "rating_count": total["rating_count"]}},
+                projection={"company_id": 1}
+            )
+            if not technician:
+                # A concurrent first rating initialised the counters in between, so count this one on top
+                technician = await self.db.technicians.find_one_and_update(
+                    {"id": technician_id, "rating_count": {"$gt": 0}}, increment, projection={"company_id": 1}
+                )
+        if technician:
+            await change_versions.bump(self.db, "technicians", technician.get("company_id"))
+    
+    async def update_technician_rating(self, technician_id: str):
+        """Recompute a single technician's rating counters from the ratings collection"""
+        await self.rebuild_rating_aggregates(technician_id)
+    
+    async def rebuild_rating_aggregates(self, technician_id: Optional[str] = None) -> int:
+        """Recompute technician rating counters from the ratings collection
+        
+        Ratings recorded while a rebuild is running may be overwritten, so run
+        this from maintenance.py during a quiet period.
+        """
         
-        total_rating = sum(r["rating"] for r in ratings)
-        average_rating = total_rating / len(ratings)
+        match = {"rating": {"$gt": 0}}
+        if technician_id:
+            match["technician_id"] = technician_id
         
-        # Update technician record
-        await self.db.technicians.update_one(
-            {"id": technician_id},
+        pipeline = [
+            {"$match": match},
             {
-                "$set": {
-                    "average_rating": round(average_rating, 2),
-                    "total_ratings": len(ratings)
+                "$group": {
+                    "_id": "$technician_id",
+                    "rating_sum": {"$sum": "$rating"},
+                    "rating_count": {"$sum": 1}
                 }
             }
+        ]
+        
+        totals = await self.db.ratings.aggregate(pipeline).to_list(None)
+        
+        operations = [
+            UpdateOne(
+                {"id": total["_id"]},
+                {"$set": {"rating_sum": total["rating_sum"], "rating_count": total["rating_count"]}}
+            )
+            for total in totals
+        ]
+        if operations:
+            await self.db.technicians.bulk_write(operations, ordered=False)
+        
+        # Technicians without any ratings start from zero
+        unrated_filter = {"id": {"$nin": [total["_id"] for total in totals]}}
+        if technician_id:
+            unrated_filter["id"]["$eq"] = technician_id
+        await self.db.technicians.update_many(
+            unrated_filter,
+            {"$set": {"rating_sum": 0, "rating_count": 0}}
         )
+        await change_versions.bump_all(self.db, "technicians")
+        
+        return len(totals)
     
     async def send_low_rating_notification(self, rating_data: dict, rating_value: int):
         """Send notification for low ratings"""
@@ -536,6 +860,1432 @@ Reply with just the number. Thank you!"""
         
         await notification_service.send_notification(notification)
 
+class InvoiceNumberAllocator:
+    """Per-company, per-year invoice number sequences kept in the counters collection"""
+    
+    # Counters already seeded from pre-existing invoices in this process
+    _seeded_counters = set()
+    
+    def __init__(self, db):
+        self.db = db
+    
+    @staticmethod
+    def format_invoice_number(year: int, seq: int) -> str:
+        """Format a sequence value as an invoice number"""
+        return f"INV-{year}-{seq:04d}"
+    
+    async def reserve(self, company_id: str, count: int = 1, year: Optional[int] = None) -> List[str]:
+        """Atomically reserve `count` consecutive invoice numbers"""
+        
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        
+        year = year or datetime.now().year
+        counter_id = f"invoice:{company_id}:{year}"
+        
+        if counter_id not in self._seeded_counters:
+            await self._seed_counter(counter_id, company_id, year)
+        
+        counter = await self.db.counters.find_one_and_update(
+            {"_id": counter_id},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        
+        last_seq = counter["seq"]
+        return [
+            self.format_invoice_number(year, seq)
+            for seq in range(last_seq - count + 1, last_seq + 1)
+        ]
+    
+    async def _seed_counter(self, counter_id: str, company_id: str, year: int):
+        """Start the counter after numbers issued before the allocator existed"""
+        
+        prefix = f"INV-{year}-"
+        highest_seq = 0
+        
+        invoices = self.db.invoices.find(
+            {"company_id": company_id, "invoice_number": {"$regex": f"^{re.escape(prefix)}"}},
+            {"invoice_number": 1}
+        )
+        async for invoice in invoices:
+            suffix = invoice["invoice_number"][len(prefix):]
+            if suffix.isdigit():
+                highest_seq = max(highest_seq, int(suffix))
+        
+        await self.db.counters.update_one(
+            {"_id": counter_id},
+            {
+                "$max": {"seq": highest_seq},
+                "$setOnInsert": {"company_id": company_id, "year": year, "kind": "invoice"}
+            },
+            upsert=True
+        )
+        
+        self._seeded_counters.add(counter_id)
+
+async def find_first_by_job_id(collection, job_ids: List[str], projection: Optional[dict] = None) -> Dict[str, dict]:
+    """Load one document per job ID with a single $in query (first match wins, like find_one)"""
+    documents = {}
+    async for document in collection.find({"job_id": {"$in": job_ids}}, projection):
+        documents.setdefault(document["job_id"], document)
+    return documents
+
+def apply_release_conditions(
+    payment: SubcontractorPayment,
+    qa_gate_data: Optional[dict],
+    warranty_data: Optional[dict],
+    inspection_data: Optional[dict]
+) -> bool:
+    """Refresh a payment's release conditions from its job's QA records and check them"""
+    
+    # QA gate status (keep the stored flag when the job has no gate)
+    if qa_gate_data:
+        qa_gate = QAGate(**qa_gate_data)
+        qa_gate.calculate_qa_status()
+        payment.qa_gate_passed = qa_gate.overall_pass
+    
+    # Warranty registration
+    payment.warranty_registered = bool(warranty_data and warranty_data.get("registered", False))
+    
+    # Inspection if required
+    if payment.inspection_required:
+        payment.inspection_passed = bool(
+            inspection_data and
+            inspection_data.get("completed", False) and
+            inspection_data.get("inspection_pass", False)
+        )
+    else:
+        payment.inspection_passed = True  # Not required
+    
+    return payment.check_release_conditions()
+
+def holdback_blocking_reasons(payment: SubcontractorPayment) -> List[str]:
+    """List the unmet conditions keeping a payment's holdback"""
+    blocking_reasons = []
+    if not payment.qa_gate_passed:
+        blocking_reasons.append("QA Gate not passed")
+    if not payment.warranty_registered:
+        blocking_reasons.append("Warranty not registered")
+    if payment.inspection_required and not payment.inspection_passed:
+        blocking_reasons.append("Required inspection not passed")
+    return blocking_reasons
+
+def holdback_release_update(payment: SubcontractorPayment, processed_by: str, released_at: datetime) -> Dict[str, Any]:
+    """Build the update that releases a payment's holdback"""
+    return {
+        "$set": {
+            "holdback_released": True,
+            "holdback_released_at": released_at,
+            "payment_status": PaymentStatus.RELEASED.value,
+            "qa_gate_passed": payment.qa_gate_passed,
+            "warranty_registered": payment.warranty_registered,
+            "inspection_passed": payment.inspection_passed,
+            "updated_at": released_at
+        },
+        "$push": {
+            "payments_made": {
+                "amount": payment.holdback_amount,
+                "type": "holdback_release",
+                "date": released_at.isoformat(),
+                "processed_by": processed_by
+            }
+        },
+        "$inc": {"total_paid": payment.holdback_amount}
+    }
+
+class HoldbackReleaseService:
+    """Bulk evaluation and release of subcontractor holdbacks"""
+    
+    BATCH_SIZE = 500
+    
+    def __init__(self, db):
+        self.db = db
+    
+    async def run_holdback_release(self, company_id: str, processed_by: str, dry_run: bool = False) -> Dict[str, Any]:
+        """Release every eligible holdback for a company and report the blocked ones"""
+        
+        # Stamped on the payments this run releases, so the report leaves out concurrent releases
+        release_run_id = str(uuid.uuid4())
+        report = {
+            "company_id": company_id,
+            "dry_run": dry_run,
+            "evaluated": 0,
+            "released_count": 0,
+            "released_amount": 0.0,
+            "released": [],
+            "blocked": []
+        }
+        
+        payments = self.db.subcontractor_payments.find({
+            "company_id": company_id,
+            "payment_status": PaymentStatus.HOLDBACK.value,
+            "holdback_released": {"$ne": True}
+        })
+        
+        batch = []
+        async for payment_data in payments:
+            batch.append(payment_data)
+            if len(batch) >= self.BATCH_SIZE:
+                await self._process_batch(batch, processed_by, dry_run, report, release_run_id)
+                batch = []
+        if batch:
+            await self._process_batch(batch, processed_by, dry_run, report, release_run_id)
+        
+        report["released_amount"] = round(report["released_amount"], 2)
+        
+        logger.info(
+            f"Holdback release for {company_id}: {report['released_count']} released, "
+            f"{len(report['blocked'])} blocked{' (dry run)' if dry_run else ''}"
+        )
+        return report
+    
+    async def _process_batch(
+        self, batch: List[dict], processed_by: str, dry_run: bool, report: Dict[str, Any], release_run_id: str
+    ):
+        """Evaluate one batch of payments against QA records loaded with $in queries"""
+        
+        job_ids = list({payment_data["job_id"] for payment_data in batch})
+        qa_gates, warranties, inspections = await asyncio.gather(
+            find_first_by_job_id(self.db.qa_gates, job_ids, {"_id": 0}),
+            find_first_by_job_id(
+                self.db.warranty_registrations, job_ids,
+                {"_id": 0, "job_id": 1, "registered": 1}
+            ),
+            find_first_by_job_id(
+                self.db.inspections, job_ids,
+                {"_id": 0, "job_id": 1, "completed": 1, "inspection_pass": 1}
+            )
+        )
+        
+        released_at = datetime.utcnow()
+        operations = []
+        released = []
+        
+        for payment_data in batch:
+            payment = SubcontractorPayment(**payment_data)
+            job_id = payment.job_id
+            report["evaluated"] += 1
+            
+            can_release = apply_release_conditions(
+                payment, qa_gates.get(job_id), warranties.get(job_id), inspections.get(job_id)
+            )
+            
+            if not can_release:
+                report["blocked"].append({
+                    "payment_id": payment.id,
+                    "job_id": job_id,
+                    "subcontractor_id": payment.subcontractor_id,
+                    "holdback_amount": payment.holdback_amount,
+                    "reasons": holdback_blocking_reasons(payment)
+                })
+                continue
+            
+            update = holdback_release_update(payment, processed_by, released_at)
+            update["$set"]["holdback_release_run_id"] = release_run_id
+            operations.append(UpdateOne({"id": payment.id, "holdback_released": {"$ne": True}}, update))
+            released.append({
+                "payment_id": payment.id,
+                "job_id": job_id,
+                "subcontractor_id": payment.subcontractor_id,
+                "amount": payment.holdback_amount
+            })
+        
+        if operations and not dry_run:
+            result = await self.db.subcontractor_payments.bulk_write(operations, ordered=False)
+            if result.modified_count < len(operations):
+                logger.warning(
+                    f"{len(operations) - result.modified_count} holdbacks were released concurrently"
+                )
+                # Report only the payments this run released
+                ours = await self.db.subcontractor_payments.find(
+                    {"id": {"$in": [entry["payment_id"] for entry in released]}, "holdback_release_run_id": release_run_id},
+                    {"_id": 0, "id": 1}
+                ).to_list(None)
+                ours = {payment["id"] for payment in ours}
+                released = [entry for entry in released if entry["payment_id"] in ours]
+        
+        report["released_count"] += len(released)
+        report["released"].extend(released)
+        report["released_amount"] += sum(entry["amount"] for entry in released)
+
+class TechnicianSearchService:
+    """Indexed technician search with prefix matching and keyset pagination.
+
+    Matches run against the derived `search_terms` / `skill_keys` arrays
+    (see Technician.calculate_search_fields), so every query is an anchored
+    index range scan scoped to one company. Results are ordered by
+    (name, id); `next_cursor` continues after the last row without skipping.
+    """
+    
+    MAX_LIMIT = 100
+    BACKFILL_BATCH_SIZE = 1000
+    
+    # (keys, options) for the technicians collection
+    INDEXES = [
+        ([("company_id", 1), ("name", 1), ("id", 1)], {}),
+        ([("company_id", 1), ("status", 1), ("name", 1), ("id", 1)], {}),
+        ([("company_id", 1), ("search_terms", 1)], {}),
+        ([("company_id", 1), ("skill_keys", 1)], {}),
+    ]
+    
+    # Internal fields left out of search results
+    HIDDEN_FIELDS = {"_id": 0, "search_terms": 0, "skill_keys": 0}
+    
+    def __init__(self, db):
+        self.db = db
+    
+    @staticmethod
+    def encode_cursor(name: str, technician_id: str) -> str:
+        """Opaque cursor for the row after (name, id)"""
+        raw = json.dumps([name, technician_id]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple:
+        """Inverse of encode_cursor; raises ValueError on malformed input"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            name, technician_id = json.loads(raw)
+        except Exception:
+            raise ValueError("Invalid cursor")
+        if not isinstance(name, str) or not isinstance(technician_id, str):
+            raise ValueError("Invalid cursor")
+        return name, technician_id
+    
+    @staticmethod
+    def build_filter(company_id: str, q: Optional[str] = None, status: Optional[str] = None,
+                     skill: Optional[str] = None) -> Dict[str, Any]:
+        """Mongo filter for a search; every word of `q` must prefix-match a term"""
+        query: Dict[str, Any] = {"company_id": company_id}
+        
+        words = [word for word in re.split(r"\s+", (q or "").strip().lower()) if word]
+        prefixes = [{"search_terms": {"$regex": f"^{re.escape(word)}"}} for word in words]
+        if len(prefixes) == 1:
+            query.update(prefixes[0])
+        elif prefixes:
+            query["$and"] = prefixes
+        
+        if status:
+            query["status"] = status
+        if skill:
+            query["skill_keys"] = skill.strip().lower()
+        
+        return query
+    
+    async def search(
+        self,
+        company_id: str,
+        q: Optional[str] = None,
+        status: Optional[str] = None,
+        skill: Optional[str] = None,
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        offset: int = 0
+    ) -> Dict[str, Any]:
+        """One page of matching technicians plus the total match count"""
+        
+        limit = max(1, min(limit, self.MAX_LIMIT))
+        query = self.build_filter(company_id, q, status, skill)
+        
+        page_query = query
+        if cursor:
+            after_name, after_id = self.decode_cursor(cursor)
+            page_query = {
+                **query,
+                "$or": [
+                    {"name": {"$gt": after_name}},
+                    {"name": after_name, "id": {"$gt": after_id}}
+                ]
+            }
+        
+        # Fetch one extra row to learn whether another page exists
+        find = self.db.technicians.find(page_query, self.HIDDEN_FIELDS).sort([("name", 1), ("id", 1)])
+        if offset and not cursor:
+            find = find.skip(offset)
+        
+        rows, total = await asyncio.gather(
+            find.limit(limit + 1).to_list(limit + 1),
+            self.db.technicians.count_documents(query)
+        )
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self.encode_cursor(rows[-1]["name"], rows[-1]["id"])
+        
+        return {
+            "technicians": rows,
+            "total": total,
+            "limit": limit,
+            "offset": 0 if cursor else offset,
+            "next_cursor": next_cursor
+        }
+    
+    async def backfill_search_fields(self, company_id: Optional[str] = None) -> Dict[str, int]:
+        """Populate status and derived search fields on existing technicians"""
+        
+        report = {"scanned": 0, "updated": 0, "invalid": 0}
+        query = {"company_id": company_id} if company_id else {}
+        
+        operations = []
+        async for technician_data in self.db.technicians.find(query, {"_id": 0}):
+            report["scanned"] += 1
+            if "status" not in technician_data:
+                technician_data["status"] = (
+                    TechnicianStatus.AVAILABLE.value if technician_data.get("is_active", True)
+                    else TechnicianStatus.UNAVAILABLE.value
+                )
+            try:
+                technician = Technician(**technician_data)
+            except Exception as e:
+                report["invalid"] += 1
+                logger.warning(f"Skipping technician {technician_data.get('id')}: {str(e)}")
+                continue
+            
+            technician.calculate_search_fields()
+            operations.append(UpdateOne({"id": technician.id}, {"$set": {
+                "status": technician.status.value,
+                "search_terms": technician.search_terms,
+                "skill_keys": technician.skill_keys
+            }}))
+            
+            if len(operations) >= self.BACKFILL_BATCH_SIZE:
+                report["updated"] += await self._flush(operations)
+                operations = []
+        
+        if operations:
+            report["updated"] += await self._flush(operations)
+        if report["updated"]:
+            await change_versions.bump_all(self.db, "technicians")
+        return report
+    
+    async def _flush(self, operations: List[UpdateOne]) -> int:
+        result = await self.db.technicians.bulk_write(operations, ordered=False)
+        return result.modified_count
+
+class DispatchService:
+    """Nearest-technician queries over the technicians 2dsphere index"""
+    
+    MAX_RESULTS = 50
+    
+    # (keys, options) for the technicians collection; the company_id equality prefix keeps
+    # $geoNear from walking other tenants' points before the company filter applies
+    INDEXES = [
+        ([("company_id", 1), ("location", "2dsphere"), ("status", 1)], {}),
+    ]
+    
+    # Earlier index layouts, dropped at startup ($geoNear refuses to pick between two on location)
+    SUPERSEDED_INDEXES = ["location_2dsphere_company_id_1_status_1"]
+    
+    RESULT_FIELDS = {
+        "_id": 0, "id": 1, "name": 1, "phone": 1, "status": 1, "specialties": 1,
+        "certifications": 1, "average_rating": 1, "current_location": 1, "distance_m": 1
+    }
+    
+    def __init__(self, db):
+        self.db = db
+    
+    async def nearest_technicians(
+        self,
+        company_id: str,
+        lat: float,
+        lng: float,
+        specialty: Optional[str] = None,
+        k: int = 5,
+        max_distance_km: Optional[float] = None,
+        status: Optional[str] = TechnicianStatus.AVAILABLE.value
+    ) -> List[Dict[str, Any]]:
+        """The `k` closest matching technicians, nearest first, with distance_km"""
+        
+        query: Dict[str, Any] = {"company_id": company_id, "is_active": {"$ne": False}}
+        if status:
+            query["status"] = status
+        if specialty:
+            query["skill_keys"] = specialty.strip().lower()
+        
+        geo_near = {
+            "near": geojson_point(lat, lng),
+            "key": "location",
+            "distanceField": "distance_m",
+            "spherical": True,
+            "query": query
+        }
+        if max_distance_km:
+            geo_near["maxDistance"] = max_distance_km * 1000
+        
+        pipeline = [
+            {"$geoNear": geo_near},
+            {"$limit": max(1, min(k, self.MAX_RESULTS))},
+            {"$project": self.RESULT_FIELDS}
+        ]
+        technicians = await self.db.technicians.aggregate(pipeline).to_list(self.MAX_RESULTS)
+        for technician in technicians:
+            technician["distance_km"] = round(technician.pop("distance_m") / 1000, 2)
+        return technicians
+
+class RoutePlanningService:
+    """Plans a day of appointments into ordered, time-window-feasible technician routes"""
+    
+    DAY_START_HOUR = int(os.getenv("ROUTE_DAY_START_HOUR", "8"))
+    DAY_END_HOUR = int(os.getenv("ROUTE_DAY_END_HOUR", "18"))
+    # Appointments booked for an exact time (no window) must start within this many minutes of it
+    FIXED_TIME_TOLERANCE = 30
+    
+    ROUTABLE_STATUSES = [AppointmentStatus.SCHEDULED.value, AppointmentStatus.CONFIRMED.value]
+    OFF_SHIFT_STATUSES = [TechnicianStatus.OFF_DUTY.value, TechnicianStatus.UNAVAILABLE.value]
+    
+    def __init__(self, db, optimizer: Optional[RouteOptimizer] = None):
+        self.db = db
+        self.optimizer = optimizer or RouteOptimizer()
+    
+    def appointment_window(self, appointment: Dict[str, Any]) -> tuple:
+        """(earliest, latest) service start in minutes after midnight"""
+        if appointment.get("window"):
+            return parse_time_window(appointment["window"])
+        scheduled = appointment["scheduled_date"]
+        minutes = scheduled.hour * 60 + scheduled.minute
+        if minutes:
+            return minutes, minutes + self.FIXED_TIME_TOLERANCE
+        return self.DAY_START_HOUR * 60, self.DAY_END_HOUR * 60
+    
+    async def plan_day(
+        self,
+        company_id: str,
+        day: datetime,
+        technician_ids: Optional[List[str]] = None,
+        respect_assignments: bool = True
+    ) -> Dict[str, Any]:
+        """Routes for every working technician over the day's open appointments"""
+        
+        day = datetime(day.year, day.month, day.day)
+        appointments = await self.db.appointments.find(
+            {
+                "company_id": company_id,
+                "scheduled_date": {"$gte": day, "$lt": day + timedelta(days=1)},
+                "status": {"$in": self.ROUTABLE_STATUSES}
+            },
+            {"_id": 0, "id": 1, "customer_id": 1, "technician_id": 1, "title": 1,
+             "scheduled_date": 1, "estimated_duration": 1, "window": 1}
+        ).to_list(None)
+        
+        technician_query: Dict[str, Any] = {
+            "company_id": company_id,
+            "is_active": {"$ne": False},
+            "status": {"$nin": self.OFF_SHIFT_STATUSES}
+        }
+        if technician_ids:
+            technician_query["id"] = {"$in": technician_ids}
+        technicians = await self.db.technicians.find(
+            technician_query, {"_id": 0, "id": 1, "name": 1, "location": 1, "current_location": 1}
+        ).to_list(None)
+        
+        customer_ids = list({appointment["customer_id"] for appointment in appointments})
+        customers = await self.db.customers.find(
+            {"id": {"$in": customer_ids}, "company_id": company_id},
+            {"_id": 0, "id": 1, "location": 1, "address": 1}
+        ).to_list(None)
+        customer_points = {}
+        for customer in customers:
+            point = customer.get("location")
+            if not point:
+                try:
+                    point = point_from_location(await geocoding_service.geocode(customer.get("address")))
+                except Exception as e:
+                    logger.warning(f"Failed to geocode customer {customer['id']}: {str(e)}")
+            if point:
+                customer_points[customer["id"]] = point
+        
+        route_technicians, skipped_technicians = [], []
+        for technician in technicians:
+            point = technician.get("location") or point_from_location(technician.get("current_location"))
+            if not point:
+                skipped_technicians.append(technician["id"])
+                continue
+            lng, lat = point["coordinates"]
+            route_technicians.append({
+                "id": technician["id"], "name": technician.get("name"), "lat": lat, "lng": lng,
+                "shift_start": self.DAY_START_HOUR * 60, "shift_end": self.DAY_END_HOUR * 60
+            })
+        
+        stops, unassigned = [], []
+        for appointment in appointments:
+            point = customer_points.get(appointment["customer_id"])
+            if not point:
+                unassigned.append({"appointment_id": appointment["id"], "reason": "no_location"})
+                continue
+            earliest, latest = self.appointment_window(appointment)
+            lng, lat = point["coordinates"]
+            stops.append({
+                "id": appointment["id"], "lat": lat, "lng": lng,
+                "duration": appointment.get("estimated_duration") or 60,
+                "earliest": earliest, "latest": latest,
+                "technician_id": appointment.get("technician_id") if respect_assignments else None
+            })
+        
+        # CPU-bound; keep it off the event loop
+        plan = await asyncio.to_thread(self.optimizer.optimize, route_technicians, stops)
+        
+        by_id = {appointment["id"]: appointment for appointment in appointments}
+        routes = []
+        for technician, route in zip(route_technicians, plan["routes"]):
+            routes.append({
+                "technician_id": technician["id"],
+                "technician_name": technician["name"],
+                "total_distance_km": route["total_distance_km"],
+                "total_travel_minutes": route["total_travel_minutes"],
+                "stops": [
+                    {
+                        "appointment_id": stop["id"],
+                        "customer_id": by_id[stop["id"]]["customer_id"],
+                        "title": by_id[stop["id"]].get("title"),
+                        "arrival": day + timedelta(minutes=stop["arrival"]),
+                        "start": day + timedelta(minutes=stop["start"]),
+                        "end": day + timedelta(minutes=stop["end"]),
+                        "wait_minutes": stop["wait_minutes"],
+                        "travel_minutes": stop["travel_minutes"],
+                        "distance_km": stop["distance_km"]
+                    }
+                    for stop in route["stops"]
+                ]
+            })
+        unassigned.extend({"appointment_id": item["id"], "reason": item["reason"]} for item in plan["unassigned"])
+        
+        return {
+            "date": day.date().isoformat(),
+            "routes": routes,
+            "unassigned": unassigned,
+            "skipped_technicians": skipped_technicians
+        }
+
+class AppointmentCalendarService:
+    """Calendar and list views of appointments over a (company_id, scheduled_date) range scan"""
+    
+    MAX_EVENTS = 5000
+    
+    # (keys, options) for the appointments collection
+    INDEXES = [
+        ([("company_id", 1), ("scheduled_date", 1)], {}),
+    ]
+    
+    PROJECTION = {
+        "_id": 0, "id": 1, "title": 1, "customer_id": 1, "technician_id": 1, "scheduled_date": 1,
+        "estimated_duration": 1, "status": 1, "service_type": 1, "address": 1, "source": 1,
+        "is_ai_generated": 1, "window": 1
+    }
+    
+    # The list view's cards also show the description and priority
+    FILTER_PROJECTION = {**PROJECTION, "description": 1, "priority": 1}
+    
+    def __init__(self, db):
+        self.db = db
+    
+    async def _find(self, query: Dict[str, Any], limit: int, projection: Optional[Dict[str, int]] = None) -> tuple:
+        """Matching appointments in date order, plus whether more than `limit` matched"""
+        appointments = await self.db.appointments.find(query, projection or self.PROJECTION).sort(
+            [("scheduled_date", 1), ("id", 1)]
+        ).to_list(limit + 1)
+        return appointments[:limit], len(appointments) > limit
+    
+    async def _names(self, company_id: str, appointments: List[Dict[str, Any]]) -> tuple:
+        """Customer and technician names for a page of appointments, one $in query each"""
+        customer_ids = list({a["customer_id"] for a in appointments if a.get("customer_id")})
+        technician_ids = list({a["technician_id"] for a in appointments if a.get("technician_id")})
+        customers, technicians = await asyncio.gather(
+            self.db.customers.find(
+                {"company_id": company_id, "id": {"$in": customer_ids}}, {"_id": 0, "id": 1, "name": 1, "address": 1}
+            ).to_list(None),
+            self.db.technicians.find(
+                {"company_id": company_id, "id": {"$in": technician_ids}}, {"_id": 0, "id": 1, "name": 1}
+            ).to_list(None)
+        )
+        return {c["id"]: c for c in customers}, {t["id"]: t["name"] for t in technicians}
+    
+    @staticmethod
+    def _event(appointment: Dict[str, Any], customers: Dict[str, Any], technician_names: Dict[str, str]) -> Dict[str, Any]:
+        customer = customers.get(appointment.get("customer_id"), {})
+        event = {
+            "id": appointment["id"],
+            "title": appointment.get("title"),
+            "customer_id": appointment.get("customer_id"),
+            "customer_name": customer.get("name"),
+            "technician_id": appointment.get("technician_id"),
+            "technician": technician_names.get(appointment.get("technician_id")),
+            "status": appointment.get("status"),
+            "service_type": appointment.get("service_type"),
+            "address": appointment.get("address") or MockGeocodingService.format_address(customer.get("address")) or None,
+            "source": appointment.get("source"),
+            "window": appointment.get("window"),
+            "is_ai_generated": appointment.get("is_ai_generated") or None
+        }
+        # Month views carry thousands of events: leave out empty fields
+        return {key: value for key, value in event.items() if value is not None}
+    
+    async def calendar(
+        self, company_id: str, start: datetime, end: datetime, technician_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Events (with start/end) scheduled in [start, end)"""
+        query: Dict[str, Any] = {"company_id": company_id, "scheduled_date": {"$gte": start, "$lt": end}}
+        if technician_id:
+            query["technician_id"] = technician_id
+        appointments, truncated = await self._find(query, self.MAX_EVENTS)
+        customers, technician_names = await self._names(company_id, appointments)
+        
+        events = []
+        for appointment in appointments:
+            event = self._event(appointment, customers, technician_names)
+            event["start"] = appointment["scheduled_date"]
+            event["end"] = appointment["scheduled_date"] + timedelta(minutes=appointment.get("estimated_duration") or 60)
+            events.append(event)
+        return {"appointments": events, "truncated": truncated}
+    
+    async def filter(
+        self,
+        company_id: str,
+        status: Optional[str] = None,
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        technician: Optional[str] = None,
+        limit: int = 500
+    ) -> Dict[str, Any]:
+        """Appointments by status, date range and technician (id or part of a name)"""
+        query: Dict[str, Any] = {"company_id": company_id}
+        if status:
+            query["status"] = status
+        if date_from or date_to:
+            query["scheduled_date"] = {}
+            if date_from:
+                query["scheduled_date"]["$gte"] = date_from
+            if date_to:
+                query["scheduled_date"]["$lt"] = date_to
+        if technician:
+            matches = await self.db.technicians.find(
+                {"company_id": company_id,
+                 "$or": [{"id": technician}, {"name": {"$regex": re.escape(technician), "$options": "i"}}]},
+                {"_id": 0, "id": 1}
+            ).to_list(None)
+            query["technician_id"] = {"$in": [match["id"] for match in matches]}
+        
+        appointments, truncated = await self._find(query, limit, self.FILTER_PROJECTION)
+        customers, technician_names = await self._names(company_id, appointments)
+        
+        results = []
+        for appointment in appointments:
+            result = self._event(appointment, customers, technician_names)
+            result["scheduled_date"] = appointment["scheduled_date"]
+            result["description"] = appointment.get("description", "")
+            if appointment.get("priority"):
+                result["priority"] = appointment["priority"]
+            results.append(result)
+        return {"appointments": results, "total": len(results), "truncated": truncated}
+
+class InvalidSyncToken(Exception):
+    """Sync token that cannot be decoded or belongs to another technician"""
+
+class TechnicianSyncService:
+    """Delta sync of a technician's jobs, appointments, job messages and QA gates.
+
+    Each collection is read in (updated_at, id) order past a cursor kept in an
+    opaque token. Once a collection has caught up, its cursor is held back by
+    SYNC_OVERLAP_SECONDS so writes that commit late with an earlier updated_at
+    are still seen; clients upsert by id, so re-sent documents are harmless.
+
+    The token also holds a digest of the technician's job and appointment ids.
+    When it changes (a job was assigned or taken away) the full id lists are
+    returned for pruning, and the messages and QA gates of the changed jobs are
+    sent in full, since their history predates the cursors.
+    """
+
+    TOKEN_VERSION = 1
+    COLLECTIONS = ("jobs", "appointments", "messages", "qa_gates")
+    OVERLAP = timedelta(seconds=float(os.getenv("SYNC_OVERLAP_SECONDS", "5")))
+
+    # (collection, keys, options)
+    INDEXES = [
+        ("jobs", [("company_id", 1), ("technician_id", 1), ("updated_at", 1), ("id", 1)], {}),
+        ("appointments", [("company_id", 1), ("technician_id", 1), ("updated_at", 1), ("id", 1)], {}),
+        ("messages", [("job_id", 1), ("updated_at", 1), ("id", 1)], {}),
+        ("qa_gates", [("job_id", 1), ("updated_at", 1), ("id", 1)], {}),
+    ]
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def encode_token(state: Dict[str, Any]) -> str:
+        return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode().rstrip("=")
+
+    @classmethod
+    def decode_token(cls, token: str) -> Dict[str, Any]:
+        try:
+            state = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+            cursors = {
+                name: (datetime.fromisoformat(cursor[0]), str(cursor[1]))
+                for name, cursor in state.get("c", {}).items() if name in cls.COLLECTIONS
+            }
+        except (ValueError, TypeError, AttributeError, IndexError):
+            raise InvalidSyncToken("Malformed sync token")
+        if state.get("v") != cls.TOKEN_VERSION:
+            raise InvalidSyncToken("Unsupported sync token version")
+        return {**state, "c": cursors}
+
+    @staticmethod
+    def _after(cursor: Optional[tuple]) -> Dict[str, Any]:
+        if cursor is None:
+            return {}
+        updated_at, last_id = cursor
+        return {"$or": [{"updated_at": {"$gt": updated_at}}, {"updated_at": updated_at, "id": {"$gt": last_id}}]}
+
+    @staticmethod
+    def _up_to(cursor: tuple) -> Dict[str, Any]:
+        updated_at, last_id = cursor
+        return {"$or": [{"updated_at": {"$lt": updated_at}}, {"updated_at": updated_at, "id": {"$lte": last_id}}]}
+
+    @staticmethod
+    def _compact(document: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in document.items() if value is not None}
+
+    @staticmethod
+    def _digest(ids: List[str]) -> str:
+        return hashlib.sha1("\n".join(sorted(ids)).encode()).hexdigest()[:16]
+
+    async def _ids(self, collection: str, scope: Dict[str, Any]) -> List[str]:
+        documents = await self.db[collection].find(scope, {"_id": 0, "id": 1}).to_list(None)
+        return [document["id"] for document in documents]
+
+    async def _changes(self, collection: str, scope: Dict[str, Any], cursor: Optional[tuple], limit: int) -> tuple:
+        """Documents changed past the cursor in (updated_at, id) order, plus whether more remain"""
+        # Documents without a timestamp cannot be ordered against the cursor
+        query = {**scope, **self._after(cursor), "updated_at": {"$type": "date"}}
+        documents = await self.db[collection].find(query, {"_id": 0}).sort(
+            [("updated_at", 1), ("id", 1)]
+        ).to_list(limit + 1)
+        return documents[:limit], len(documents) > limit
+
+    def _advance(self, cursor: Optional[tuple], documents: List[Dict[str, Any]], has_more: bool, now: datetime):
+        if documents:
+            cursor = (documents[-1]["updated_at"], documents[-1]["id"])
+        if cursor is not None and not has_more and cursor[0] > now - self.OVERLAP:
+            cursor = (now - self.OVERLAP, "")
+        return cursor
+
+    async def sync(
+        self, company_id: str, technician_id: str, token: Optional[str] = None, limit: int = 200
+    ) -> Dict[str, Any]:
+        """Changes since `token` (everything without one) and the token for the next call"""
+        state = self.decode_token(token) if token else {"c": {}, "d": {}}
+        if token and state.get("t") != technician_id:
+            raise InvalidSyncToken("Sync token belongs to another technician")
+        cursors, digests = state["c"], dict(state.get("d", {}))
+        now = datetime.utcnow()
+
+        scope = {"company_id": company_id, "technician_id": technician_id}
+        job_ids, appointment_ids = await asyncio.gather(self._ids("jobs", scope), self._ids("appointments", scope))
+        scopes = {
+            "jobs": scope,
+            "appointments": scope,
+            "messages": {"job_id": {"$in": job_ids}},
+            "qa_gates": {"job_id": {"$in": job_ids}}
+        }
+        pages = await asyncio.gather(*[
+            self._changes(name, scopes[name], cursors.get(name), limit) for name in self.COLLECTIONS
+        ])
+        changes = {name: documents for name, (documents, _) in zip(self.COLLECTIONS, pages)}
+        more = {name: has_more for name, (_, has_more) in zip(self.COLLECTIONS, pages)}
+
+        result: Dict[str, Any] = {}
+        job_digest, appointment_digest = self._digest(job_ids), self._digest(appointment_ids)
+        if digests.get("jobs") != job_digest:
+            result["job_ids"] = job_ids
+            # Jobs new to this technician come with their whole thread and QA gate
+            changed_jobs = [job["id"] for job in changes["jobs"]]
+            for name in ("messages", "qa_gates"):
+                if changed_jobs and cursors.get(name) is not None:
+                    changes[name] = changes[name] + await self.db[name].find(
+                        {"job_id": {"$in": changed_jobs}, **self._up_to(cursors[name])}, {"_id": 0}
+                    ).to_list(None)
+            if not more["jobs"]:
+                digests["jobs"] = job_digest
+        if digests.get("appointments") != appointment_digest:
+            result["appointment_ids"] = appointment_ids
+            if not more["appointments"]:
+                digests["appointments"] = appointment_digest
+
+        next_cursors = {}
+        for name, (documents, has_more) in zip(self.COLLECTIONS, pages):
+            cursor = self._advance(cursors.get(name), documents, has_more, now)
+            if cursor is not None:
+                next_cursors[name] = [cursor[0].isoformat(), cursor[1]]
+
+        result.update({name: [self._compact(document) for document in changes[name]] for name in self.COLLECTIONS})
+        result["has_more"] = any(more.values())
+        result["token"] = self.encode_token({"v": self.TOKEN_VERSION, "t": technician_id, "c": next_cursors, "d": digests})
+        return result
+
+class LocationIngestBuffer:
+    """Coalesces technician GPS pings in memory and flushes them in bulk.
+    
+    Only the newest ping per technician is kept between flushes, so a burst
+    of pings costs one write per technician. Pings are keyed by company as
+    well, so a ping sent under another company can never displace a real one. Every FLUSH_INTERVAL seconds the
+    positions are written with one bulk_write; the filter on
+    location_updated_at keeps an older ping (e.g. from another worker) from
+    overwriting a newer one. When TRAIL_INTERVAL is set, one point per
+    technician per interval also goes to a time-series trail collection.
+    """
+    
+    FLUSH_INTERVAL = float(os.getenv("LOCATION_FLUSH_INTERVAL", "5"))
+    TRAIL_INTERVAL = float(os.getenv("LOCATION_TRAIL_INTERVAL", "60"))  # 0 disables the trail
+    TRAIL_RETENTION = timedelta(days=int(os.getenv("LOCATION_TRAIL_RETENTION_DAYS", "30")))
+    TRAIL_COLLECTION = "technician_location_trail"
+    MAX_PENDING = 100000  # Flush early rather than grow without bound
+    
+    def __init__(self, db):
+        self.db = db
+        self._latest: Dict[tuple, Dict[str, Any]] = {}  # (company id, technician id) -> newest unflushed ping
+        self._trail: List[Dict[str, Any]] = []
+        self._last_trail_at: Dict[tuple, datetime] = {}
+        self._flush_lock = asyncio.Lock()
+        self._early_flush_pending = False
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {"received": 0, "coalesced": 0, "stale": 0, "flushed": 0, "trail_points": 0, "flush_errors": 0}
+    
+    def add(self, company_id: str, ping: Dict[str, Any]):
+        """Record a ping (validated LocationPing dict); never touches the database"""
+        self.counters["received"] += 1
+        recorded_at = ping.get("recorded_at") or datetime.utcnow()
+        if recorded_at.tzinfo is not None:
+            recorded_at = recorded_at.astimezone(timezone.utc).replace(tzinfo=None)
+        entry = {**ping, "company_id": company_id, "recorded_at": recorded_at}
+        
+        key = (company_id, ping["technician_id"])
+        current = self._latest.get(key)
+        if current is not None:
+            if current["recorded_at"] > recorded_at:
+                self.counters["stale"] += 1
+                return
+            self.counters["coalesced"] += 1
+        self._latest[key] = entry
+        
+        if self.TRAIL_INTERVAL > 0:
+            last_trail_at = self._last_trail_at.get(key)
+            if last_trail_at is None or (recorded_at - last_trail_at).total_seconds() >= self.TRAIL_INTERVAL:
+                self._last_trail_at[key] = recorded_at
+                self._trail.append(entry)
+        
+        if len(self._latest) >= self.MAX_PENDING and not self._early_flush_pending:
+            # One early flush at a time; pings arriving before it runs go out with it
+            self._early_flush_pending = True
+            asyncio.ensure_future(self.flush())
+    
+    async def flush(self) -> int:
+        """Write buffered positions (and trail points); returns technicians updated"""
+        async with self._flush_lock:
+            self._early_flush_pending = False
+            latest, self._latest = self._latest, {}
+            trail, self._trail = self._trail, []
+            
+            operations = [
+                UpdateOne(
+                    {
+                        "id": technician_id,
+                        "company_id": company_id,
+                        "location_updated_at": {"$not": {"$gte": ping["recorded_at"]}}
+                    },
+                    {"$set": {
+                        "current_location": {"lat": ping["lat"], "lng": ping["lng"]},
+                        "location": geojson_point(ping["lat"], ping["lng"]),
+                        "location_updated_at": ping["recorded_at"],
+                        "location_accuracy_m": ping.get("accuracy_m")
+                    }}
+                )
+                for (company_id, technician_id), ping in latest.items()
+            ]
+            
+            updated = 0
+            if operations:
+                try:
+                    result = await self.db.technicians.bulk_write(operations, ordered=False)
+                    updated = result.modified_count
+                    self.counters["flushed"] += updated
+                    for company_id in {company_id for company_id, _ in latest}:
+                        await change_versions.bump(self.db, "technicians", company_id)
+                except Exception as e:
+                    self.counters["flush_errors"] += 1
+                    logger.error(f"Failed to flush {len(operations)} technician locations: {str(e)}")
+                    # Put positions back unless newer ones arrived meanwhile
+                    for key, ping in latest.items():
+                        self._latest.setdefault(key, ping)
+            
+            if trail:
+                try:
+                    await self.db[self.TRAIL_COLLECTION].insert_many([
+                        {
+                            "technician_id": ping["technician_id"],
+                            "company_id": ping["company_id"],
+                            "recorded_at": ping["recorded_at"],
+                            "location": geojson_point(ping["lat"], ping["lng"]),
+                            "speed_mps": ping.get("speed_mps"),
+                            "heading": ping.get("heading")
+                        }
+                        for ping in trail
+                    ], ordered=False)
+                    self.counters["trail_points"] += len(trail)
+                except Exception as e:
+                    self.counters["flush_errors"] += 1
+                    logger.error(f"Failed to write {len(trail)} location trail points: {str(e)}")
+            
+            return updated
+    
+    async def ensure_trail_collection(self):
+        """Create the time-series trail collection (MongoDB 5.0+) if it does not exist"""
+        if self.TRAIL_INTERVAL <= 0:
+            return
+        try:
+            if self.TRAIL_COLLECTION in await self.db.list_collection_names():
+                return
+            await self.db.create_collection(
+                self.TRAIL_COLLECTION,
+                timeseries={"timeField": "recorded_at", "metaField": "technician_id", "granularity": "seconds"},
+                expireAfterSeconds=int(self.TRAIL_RETENTION.total_seconds())
+            )
+        except Exception as e:
+            # Older servers: the trail is written to a regular collection instead
+            logger.warning(f"Could not create time-series location trail: {str(e)}")
+    
+    def start(self):
+        """Start the periodic flush loop"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+    
+    async def stop(self):
+        """Stop the loop and flush what is still buffered"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+    
+    async def _run(self):
+        await self.ensure_trail_collection()
+        while True:
+            await asyncio.sleep(self.FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Location flush loop error: {str(e)}")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Ingest counters for the cache stats endpoint"""
+        return {
+            "pending": len(self._latest),
+            "pending_trail_points": len(self._trail),
+            "flush_interval_seconds": self.FLUSH_INTERVAL,
+            **self.counters
+        }
+
+class CalendarSyncWorker:
+    """Background sync of appointments to the calendar, tracked in calendar_events.
+    
+    Request handlers only enqueue (upsert a pending CalendarEvent per appointment).
+    The worker claims due events, sends them as one batch per calendar and retries
+    failures with exponential backoff.
+    """
+    
+    BATCH_SIZE = 50
+    POLL_INTERVAL = float(os.getenv("CALENDAR_SYNC_INTERVAL", "5"))
+    MAX_RETRIES = 5
+    BACKOFF_BASE_SECONDS = 2
+    BACKOFF_MAX_SECONDS = 15 * 60
+    CLAIM_LEASE = timedelta(minutes=2)
+    
+    def __init__(self, db, calendar_service):
+        self.db = db
+        self.calendar_service = calendar_service
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    async def enqueue(self, appointment: Dict[str, Any], operation: str, calendar_id: Optional[str] = None):
+        """Record that an appointment's calendar event needs a create, update or delete"""
+        now = datetime.utcnow()
+        start_time = appointment["scheduled_date"]
+        if isinstance(start_time, str):
+            start_time = datetime.fromisoformat(start_time.replace("Z", "+00:00"))
+        end_time = start_time + timedelta(minutes=appointment.get("estimated_duration") or 60)
+        
+        await self.db.calendar_events.update_one(
+            {"appointment_id": appointment["id"]},
+            {
+                "$set": {
+                    "company_id": appointment["company_id"],
+                    "calendar_id": calendar_id or self.calendar_service.calendar_id,
+                    "title": f"HVAC: {appointment['title']}",
+                    "description": appointment.get("description", ""),
+                    "start_time": start_time,
+                    "end_time": end_time,
+                    "operation": operation,
+                    "sync_status": "pending",
+                    "next_attempt_at": now,
+                    "retry_count": 0,
+                    "error_message": None,
+                    "claim_token": None,  # Supersedes any batch in flight
+                    "updated_at": now
+                },
+                "$setOnInsert": {
+                    "id": str(uuid.uuid4()),
+                    "appointment_id": appointment["id"],
+                    "google_event_id": appointment.get("calendar_event_id"),
+                    "attendees": [],
+                    "created_at": now
+                }
+            },
+            upsert=True
+        )
+        self._wakeup.set()
+    
+    def start(self):
+        """Start the background loop"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+    
+    async def stop(self):
+        """Stop the background loop"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            try:
+                while await self.run_once() == self.BATCH_SIZE:
+                    pass  # Keep draining while batches are full
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Calendar sync worker error: {str(e)}")
+            
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+    
+    async def run_once(self) -> int:
+        """Sync one batch of due events; returns how many were claimed"""
+        events = await self._claim_batch()
+        if not events:
+            return 0
+        
+        by_calendar: Dict[str, List[CalendarEvent]] = {}
+        for event in events:
+            by_calendar.setdefault(event.calendar_id, []).append(event)
+        
+        for calendar_id, calendar_events in by_calendar.items():
+            await self._sync_calendar(calendar_id, calendar_events)
+        
+        return len(events)
+    
+    async def _claim_batch(self) -> List[CalendarEvent]:
+        """Mark up to BATCH_SIZE due events as syncing under a fresh claim token"""
+        now = datetime.utcnow()
+        due = {
+            "$or": [
+                {"sync_status": "pending", "next_attempt_at": {"$lte": now}},
+                {"sync_status": "syncing", "claimed_at": {"$lt": now - self.CLAIM_LEASE}}  # Worker died mid-batch
+            ]
+        }
+        
+        candidates = await self.db.calendar_events.find(due, {"id": 1}).limit(self.BATCH_SIZE).to_list(self.BATCH_SIZE)
+        if not candidates:
+            return []
+        
+        claim_token = str(uuid.uuid4())
+        await self.db.calendar_events.update_many(
+            {"id": {"$in": [c["id"] for c in candidates]}, **due},
+            {"$set": {"sync_status": "syncing", "claim_token": claim_token, "claimed_at": now}}
+        )
+        
+        claimed = await self.db.calendar_events.find({"claim_token": claim_token}).to_list(self.BATCH_SIZE)
+        return [CalendarEvent(**event) for event in claimed]
+    
+    async def _sync_calendar(self, calendar_id: str, events: List[CalendarEvent]):
+        """Send one calendar's events as a batch and record the outcomes"""
+        operations = []
+        to_send = []
+        updates = []
+        now = datetime.utcnow()
+        
+        for event in events:
+            if event.operation == "delete":
+                if not event.google_event_id:
+                    # Never reached the calendar - nothing to delete
+                    updates.append(self._mark_synced(event, now, deleted=True))
+                    continue
+                operation = "delete"
+            else:
+                operation = "update" if event.google_event_id else "create"
+            
+            operations.append({
+                "operation": operation,
+                "event_id": event.google_event_id,
+                "event_data": event.to_event_data(),
+                "retry_count": event.retry_count
+            })
+            to_send.append(event)
+        
+        if operations:
+            try:
+                results = await self.calendar_service.execute_batch(calendar_id, operations)
+            except Exception as e:
+                results = [{"ok": False, "error": str(e)}] * len(operations)
+            
+            for event, op, result in zip(to_send, operations, results):
+                if result.get("ok"):
+                    if op["operation"] == "create":
+                        await self._record_created(event, result["event_id"])
+                    updates.append(self._mark_synced(event, now, deleted=op["operation"] == "delete"))
+                else:
+                    updates.append(self._mark_failed(event, result.get("error", "Unknown error"), now))
+        
+        if updates:
+            await self.db.calendar_events.bulk_write(updates, ordered=False)
+    
+    async def _record_created(self, event: CalendarEvent, google_event_id: str):
+        """Store the new calendar event ID even if the appointment changed meanwhile"""
+        await self.db.calendar_events.update_one(
+            {"id": event.id},
+            {"$set": {"google_event_id": google_event_id}}
+        )
+        await self.db.appointments.update_one(
+            {"id": event.appointment_id},
+            {"$set": {"calendar_event_id": google_event_id}}
+        )
+    
+    def _mark_synced(self, event: CalendarEvent, now: datetime, deleted: bool = False) -> UpdateOne:
+        update = {
+            "sync_status": "deleted" if deleted else "synced",
+            "last_sync_at": now,
+            "retry_count": 0,
+            "error_message": None,
+            "claim_token": None
+        }
+        if deleted:
+            update["google_event_id"] = None
+        # Only if no newer change was enqueued while this batch was in flight
+        return UpdateOne({"id": event.id, "claim_token": event.claim_token}, {"$set": update})
+    
+    def _mark_failed(self, event: CalendarEvent, error: str, now: datetime) -> UpdateOne:
+        retry_count = event.retry_count + 1
+        if retry_count >= self.MAX_RETRIES:
+            logger.error(f"Calendar sync for appointment {event.appointment_id} failed permanently: {error}")
+            update = {"sync_status": "failed"}
+        else:
+            backoff = min(self.BACKOFF_BASE_SECONDS ** retry_count, self.BACKOFF_MAX_SECONDS)
+            update = {"sync_status": "pending", "next_attempt_at": now + timedelta(seconds=backoff)}
+        
+        update.update({"retry_count": retry_count, "error_message": error, "claim_token": None})
+        return UpdateOne({"id": event.id, "claim_token": event.claim_token}, {"$set": update})
+
+class CalendarSyncEngine:
+    """Pulls calendar-side changes incrementally and applies them to appointments.
+    
+    Each calendar keeps a sync token in calendar_sync_state, so only changes since
+    the last pull are listed; an expired token falls back to one full listing.
+    Events are matched to appointments through calendar_event_id. Local changes
+    still waiting to be pushed by CalendarSyncWorker win over calendar edits.
+    """
+    
+    PULL_INTERVAL = float(os.getenv("CALENDAR_PULL_INTERVAL", "60"))
+    PAGE_SIZE = 250
+    TITLE_PREFIX = "HVAC: "
+    
+    def __init__(self, db, calendar_service, on_appointments_changed: Optional[Callable[[str], None]] = None):
+        self.db = db
+        self.calendar_service = calendar_service
+        self.on_appointments_changed = on_appointments_changed
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """Start pulling on a schedule"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+    
+    async def stop(self):
+        """Stop the scheduled pulls"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            try:
+                await self.sync_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Calendar pull failed: {str(e)}")
+            await asyncio.sleep(self.PULL_INTERVAL)
+    
+    async def sync_all(self) -> List[Dict[str, Any]]:
+        """Pull changes for every calendar we have pushed events to"""
+        calendar_ids = set(await self.db.calendar_events.distinct("calendar_id"))
+        calendar_ids.add(self.calendar_service.calendar_id)
+        return [await self.sync_calendar(calendar_id) for calendar_id in sorted(calendar_ids)]
+    
+    async def sync_calendar(self, calendar_id: str) -> Dict[str, Any]:
+        """Pull and apply one calendar's changes since its stored sync token"""
+        state = await self.db.calendar_sync_state.find_one({"_id": calendar_id}) or {}
+        sync_token = state.get("sync_token")
+        
+        stats = {"calendar_id": calendar_id, "full_sync": sync_token is None,
+                 "changes": 0, "applied": 0, "skipped": 0, "unmatched": 0}
+        try:
+            next_sync_token = await self._pull(calendar_id, sync_token, stats)
+        except SyncTokenExpired:
+            logger.warning(f"Sync token for calendar {calendar_id} expired, running a full sync")
+            stats.update({"full_sync": True, "changes": 0, "applied": 0, "skipped": 0, "unmatched": 0})
+            next_sync_token = await self._pull(calendar_id, None, stats)
+        
+        await self.db.calendar_sync_state.update_one(
+            {"_id": calendar_id},
+            {"$set": {"sync_token": next_sync_token, "last_synced_at": datetime.utcnow(), "last_stats": stats}},
+            upsert=True
+        )
+        
+        if stats["applied"]:
+            logger.info(f"Calendar {calendar_id}: applied {stats['applied']} of {stats['changes']} changes")
+        return stats
+    
+    async def _pull(self, calendar_id: str, sync_token: Optional[str], stats: Dict[str, Any]) -> Optional[str]:
+        """Page through a listing, reconciling each page; returns the next sync token"""
+        page_token = None
+        while True:
+            result = await self.calendar_service.list_events(
+                calendar_id, sync_token=sync_token, page_token=page_token, max_results=self.PAGE_SIZE
+            )
+            await self._reconcile(result.get("items", []), stats)
+            page_token = result.get("nextPageToken")
+            if not page_token:
+                return result.get("nextSyncToken")
+    
+    async def _reconcile(self, items: List[Dict[str, Any]], stats: Dict[str, Any]):
+        """Apply a page of calendar events to their appointments"""
+        if not items:
+            return
+        stats["changes"] += len(items)
+        
+        event_ids = [item["id"] for item in items]
+        appointments = {
+            appt["calendar_event_id"]: appt
+            async for appt in self.db.appointments.find(
+                {"calendar_event_id": {"$in": event_ids}},
+                {"_id": 0, "id": 1, "company_id": 1, "calendar_event_id": 1, "title": 1,
+                 "scheduled_date": 1, "estimated_duration": 1, "status": 1}
+            )
+        }
+        unpushed = {
+            event["google_event_id"]
+            async for event in self.db.calendar_events.find(
+                {"google_event_id": {"$in": event_ids}, "sync_status": {"$in": ["pending", "syncing"]}},
+                {"google_event_id": 1}
+            )
+        }
+        
+        now = datetime.utcnow()
+        appointment_updates = []
+        event_updates = []
+        changed_companies = set()
+        
+        for item in items:
+            appointment = appointments.get(item["id"])
+            if not appointment:
+                stats["unmatched"] += 1
+                continue
+            if item["id"] in unpushed:
+                stats["skipped"] += 1
+                continue
+            
+            changes = self._appointment_changes(appointment, item)
+            if not changes:
+                stats["skipped"] += 1  # Already in step (e.g. our own push)
+                continue
+            
+            appointment_updates.append(UpdateOne({"id": appointment["id"]}, {"$set": {**changes, "updated_at": now}}))
+            event_updates.append(UpdateOne({"appointment_id": appointment["id"]}, {"$set": self._event_changes(item, now)}))
+            changed_companies.add(appointment["company_id"])
+            stats["applied"] += 1
+        
+        if appointment_updates:
+            await self.db.appointments.bulk_write(appointment_updates, ordered=False)
+            await self.db.calendar_events.bulk_write(event_updates, ordered=False)
+        
+        if self.on_appointments_changed:
+            for company_id in changed_companies:
+                self.on_appointments_changed(company_id)
+    
+    def _appointment_changes(self, appointment: Dict[str, Any], item: Dict[str, Any]) -> Dict[str, Any]:
+        """Fields to update on an appointment so it matches its calendar event"""
+        if item.get("status") == "cancelled":
+            if appointment.get("status") == "cancelled":
+                return {}
+            return {"status": "cancelled", "calendar_event_id": None}
+        
+        changes = {}
+        start_time = self._parse_event_time(item.get("start"))
+        end_time = self._parse_event_time(item.get("end"))
+        if start_time and start_time != appointment.get("scheduled_date"):
+            changes["scheduled_date"] = start_time
+        if start_time and end_time:
+            duration = int((end_time - start_time).total_seconds() // 60)
+            if duration > 0 and duration != appointment.get("estimated_duration"):
+                changes["estimated_duration"] = duration
+        
+        title = item.get("summary") or ""
+        if title.startswith(self.TITLE_PREFIX):
+            title = title[len(self.TITLE_PREFIX):]
+        if title and title != appointment.get("title"):
+            changes["title"] = title
+        
+        return changes
+    
+    def _event_changes(self, item: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+        """Fields to update on the local CalendarEvent after pulling a change"""
+        if item.get("status") == "cancelled":
+            return {"sync_status": "deleted", "google_event_id": None, "last_sync_at": now}
+        
+        changes = {"title": item.get("summary", ""), "last_sync_at": now}
+        start_time = self._parse_event_time(item.get("start"))
+        end_time = self._parse_event_time(item.get("end"))
+        if start_time:
+            changes["start_time"] = start_time
+        if end_time:
+            changes["end_time"] = end_time
+        return changes
+    
+    @staticmethod
+    def _parse_event_time(value: Optional[Dict[str, Any]]) -> Optional[datetime]:
+        """Parse an event start/end into a naive UTC datetime"""
+        if not value or not value.get("dateTime"):
+            return None
+        parsed = datetime.fromisoformat(value["dateTime"].replace("Z", "+00:00"))
+        if parsed.tzinfo:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+
 class NotificationService:
     """Owner notification system with multi-channel delivery"""
     
@@ -634,9 +2384,13 @@ class NotificationService:
 
 # Service Instances (Dependency Injection)
 twilio_service = MockTwilioService()
-calendar_service = MockGoogleCalendarService()
+calendar_service = (
+    CalendarApiClient(os.environ["GOOGLE_CALENDAR_API_URL"])
+    if os.getenv("GOOGLE_CALENDAR_API_URL") else MockGoogleCalendarService()
+)
 llm_service = LLMService()
 email_service = MockEmailService()
+geocoding_service = MockGeocodingService()
 
 def get_messaging_service(db):
     """Get messaging service instance"""
@@ -650,6 +2404,34 @@ def get_notification_service(db):
     """Get notification service instance"""
     return NotificationService(twilio_service, email_service, db)
 
+def get_invoice_number_allocator(db):
+    """Get invoice number allocator instance"""
+    return InvoiceNumberAllocator(db)
+
+def get_holdback_release_service(db):
+    """Get holdback release service instance"""
+    return HoldbackReleaseService(db)
+
+def get_technician_search_service(db):
+    """Get technician search service instance"""
+    return TechnicianSearchService(db)
+
+def get_dispatch_service(db):
+    """Get dispatch service instance"""
+    return DispatchService(db)
+
+def get_route_planning_service(db):
+    """Get route planning service instance"""
+    return RoutePlanningService(db)
+
+def get_appointment_calendar_service(db):
+    """Get appointment calendar service instance"""
+    return AppointmentCalendarService(db)
+
+def get_technician_sync_service(db):
+    """Get technician delta sync service instance"""
+    return TechnicianSyncService(db)
+
 def get_sms_service():
     """Get SMS service instance"""
     return twilio_service
@@ -658,6 +2440,10 @@ def get_calendar_service():
     """Get calendar service instance"""
     return calendar_service
 
+def get_geocoding_service():
+    """Get geocoding service instance"""
+    return geocoding_service
+
 def get_llm_service():
     """Get LLM service instance"""
     return llm_service
\ No newline at end of file
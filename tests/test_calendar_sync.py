@@ -0,0 +1,141 @@
+"""CalendarSyncEngine pulling from the local stand-in calendar provider (mock_calendar_server.py)"""
+
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import mock_calendar_server
+from services import CalendarApiClient, CalendarSyncEngine, MockGoogleCalendarService
+
+CALENDAR_ID = "mock_calendar_id"
+START = datetime(2030, 5, 6, 9, 0)
+
+@pytest.fixture
+def provider():
+    """A fresh in-memory calendar behind the stand-in HTTP API"""
+    mock_calendar_server.calendar = MockGoogleCalendarService()
+    return mock_calendar_server.calendar
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()["calendar_sync_test"]
+
+@pytest.fixture
+def engine(db, provider):
+    client = CalendarApiClient("http://calendar")
+    client.calendar_id = CALENDAR_ID
+    client._client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=mock_calendar_server.app), base_url="http://calendar"
+    )
+    changed = []
+    engine = CalendarSyncEngine(db, client, changed.append)
+    engine.changed_companies = changed
+    return engine
+
+def event_data(title: str, start: datetime, minutes: int = 60):
+    return {
+        "summary": CalendarSyncEngine.TITLE_PREFIX + title,
+        "start": {"dateTime": start.isoformat() + "Z"},
+        "end": {"dateTime": (start + timedelta(minutes=minutes)).isoformat() + "Z"}
+    }
+
+async def booked_appointment(db, provider, title="Furnace tune-up", start=START, sync_status="synced"):
+    """An appointment already pushed to the calendar (retry_count=1 skips the mock's injected failures)"""
+    event_id = await provider.create_event(event_data(title, start), retry_count=1, calendar_id=CALENDAR_ID)
+    await db.appointments.insert_one({
+        "id": "appt-1", "company_id": "company-1", "calendar_event_id": event_id, "title": title,
+        "scheduled_date": start, "estimated_duration": 60, "status": "scheduled"
+    })
+    await db.calendar_events.insert_one({
+        "id": "cal-1", "appointment_id": "appt-1", "calendar_id": CALENDAR_ID,
+        "google_event_id": event_id, "sync_status": sync_status
+    })
+    return event_id
+
+def test_incremental_sync_lists_only_changes_since_token(db, provider, engine):
+    async def scenario():
+        event_id = await booked_appointment(db, provider)
+        first = await engine.sync_calendar(CALENDAR_ID)
+        assert first["full_sync"] and first["changes"] == 1
+
+        await provider.update_event(event_id, event_data("Furnace repair", START + timedelta(hours=2), 90))
+        second = await engine.sync_calendar(CALENDAR_ID)
+        assert not second["full_sync"]
+        assert (second["changes"], second["applied"]) == (1, 1)
+
+        appointment = await db.appointments.find_one({"id": "appt-1"})
+        assert appointment["title"] == "Furnace repair"
+        assert appointment["scheduled_date"] == START + timedelta(hours=2)
+        assert appointment["estimated_duration"] == 90
+        assert engine.changed_companies == ["company-1"]
+
+        third = await engine.sync_calendar(CALENDAR_ID)
+        assert (third["full_sync"], third["changes"]) == (False, 0)
+
+    asyncio.run(scenario())
+
+def test_expired_token_falls_back_to_full_listing(db, provider, engine):
+    async def scenario():
+        provider.change_log = deque(maxlen=2)
+        event_id = await booked_appointment(db, provider)
+        await engine.sync_calendar(CALENDAR_ID)
+
+        # Three changes push the token's position out of the retained log (the API answers 410)
+        for hour in (10, 11, 12):
+            await provider.update_event(event_id, event_data("Furnace tune-up", START.replace(hour=hour)))
+        stats = await engine.sync_calendar(CALENDAR_ID)
+
+        assert stats["full_sync"]
+        assert stats["applied"] == 1
+        appointment = await db.appointments.find_one({"id": "appt-1"})
+        assert appointment["scheduled_date"] == START.replace(hour=12)
+        state = await db.calendar_sync_state.find_one({"_id": CALENDAR_ID})
+        assert state["sync_token"] == str(provider.change_seq)
+
+    asyncio.run(scenario())
+
+def test_remote_delete_cancels_appointment(db, provider, engine):
+    async def scenario():
+        event_id = await booked_appointment(db, provider)
+        await engine.sync_calendar(CALENDAR_ID)
+
+        await provider.delete_event(event_id)
+        stats = await engine.sync_calendar(CALENDAR_ID)
+
+        assert stats["applied"] == 1
+        appointment = await db.appointments.find_one({"id": "appt-1"})
+        assert appointment["status"] == "cancelled"
+        assert appointment["calendar_event_id"] is None
+        event = await db.calendar_events.find_one({"appointment_id": "appt-1"})
+        assert event["sync_status"] == "deleted"
+
+    asyncio.run(scenario())
+
+def test_echoes_of_our_own_pushes_are_skipped(db, provider, engine):
+    async def scenario():
+        await booked_appointment(db, provider)
+        stats = await engine.sync_calendar(CALENDAR_ID)
+
+        # The listed event is exactly what we pushed: nothing to apply
+        assert (stats["changes"], stats["applied"], stats["skipped"]) == (1, 0, 1)
+        assert engine.changed_companies == []
+        appointment = await db.appointments.find_one({"id": "appt-1"})
+        assert "updated_at" not in appointment
+
+    asyncio.run(scenario())
+
+def test_local_changes_waiting_to_be_pushed_win(db, provider, engine):
+    async def scenario():
+        event_id = await booked_appointment(db, provider, sync_status="pending")
+        await provider.update_event(event_id, event_data("Edited in calendar", START))
+        stats = await engine.sync_calendar(CALENDAR_ID)
+
+        assert (stats["applied"], stats["skipped"]) == (0, 1)
+        appointment = await db.appointments.find_one({"id": "appt-1"})
+        assert appointment["title"] == "Furnace tune-up"
+
+    asyncio.run(scenario())
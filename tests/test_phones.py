@@ -0,0 +1,39 @@
+"""normalize_phone_e164 across the formats stored and received here"""
+
+import pytest
+
+from phones import normalize_phone_e164
+
+@pytest.mark.parametrize("phone, expected", [
+    ("+1-205-555-1234", "+12055551234"),     # Seed data
+    ("+12055551234", "+12055551234"),        # SMS webhooks
+    ("2055551234", "+12055551234"),          # Voice, +1 stripped
+    ("12055551234", "+12055551234"),         # Voice, country code without +
+    ("(205) 555-1234", "+12055551234"),
+    ("1 (205) 555-1234", "+12055551234"),
+    ("  205.555.1234  ", "+12055551234"),
+    ("+44 20 7946 0958", "+442079460958"),   # Non-NANP with its own country code
+    ("0044 20 7946 0958", "+442079460958"),  # International dialing prefix
+])
+def test_accepts_known_formats(phone, expected):
+    assert normalize_phone_e164(phone) == expected
+
+@pytest.mark.parametrize("phone", [
+    None,
+    "",
+    "   ",
+    "205-555-CALL",               # Letters
+    "call me",
+    "555-1234",                   # Too short: no area code
+    "+1234",
+    "+1-205-555-123",             # NANP with 10 digits
+    "+1-205-555-12345",           # NANP with 12 digits
+    "205555123",                  # Becomes 10 digits with the default +1
+    "+1234567890123456",          # Over 15 digits
+    "+0205551234",                # Country codes never start with 0
+])
+def test_rejects_invalid_numbers(phone):
+    assert normalize_phone_e164(phone) is None
+
+def test_other_default_country_code():
+    assert normalize_phone_e164("20 7946 0958", default_country_code="44") == "+442079460958"
@@ -0,0 +1,110 @@
+"""RouteOptimizer time windows, pinning and unassigned stops, plus parse_time_window"""
+
+import random
+
+import pytest
+
+from route_optimizer import RouteOptimizer, parse_time_window
+
+# Downtown Chicago; 0.01 degrees is roughly 1 km
+BASE_LAT, BASE_LNG = 41.88, -87.63
+EPSILON = 0.1  # Route times are rounded to a tenth of a minute
+
+def technician(technician_id: str, lat: float = BASE_LAT, lng: float = BASE_LNG,
+               shift_start: int = 8 * 60, shift_end: int = 17 * 60):
+    return {"id": technician_id, "lat": lat, "lng": lng, "shift_start": shift_start, "shift_end": shift_end}
+
+def stop(stop_id: str, lat: float = BASE_LAT, lng: float = BASE_LNG, duration: int = 60,
+         window: str = "8-5", technician_id: str = None):
+    earliest, latest = parse_time_window(window)
+    return {"id": stop_id, "lat": lat, "lng": lng, "duration": duration,
+            "earliest": earliest, "latest": latest, "technician_id": technician_id}
+
+def assert_feasible(result, technicians, stops):
+    """Every stop is routed or unassigned exactly once, inside its window and its technician's shift"""
+    by_id = {s["id"]: s for s in stops}
+    shifts = {t["id"]: t for t in technicians}
+    routed = [s["id"] for route in result["routes"] for s in route["stops"]]
+    unassigned = [entry["id"] for entry in result["unassigned"]]
+    assert sorted(routed + unassigned) == sorted(by_id)
+
+    for route in result["routes"]:
+        shift = shifts[route["technician_id"]]
+        clock = shift["shift_start"]
+        for routed_stop in route["stops"]:
+            wanted = by_id[routed_stop["id"]]
+            assert routed_stop["arrival"] >= clock - EPSILON
+            assert routed_stop["start"] >= routed_stop["arrival"] - EPSILON
+            assert wanted["earliest"] - EPSILON <= routed_stop["start"] <= wanted["latest"] + EPSILON
+            assert routed_stop["end"] == pytest.approx(routed_stop["start"] + wanted["duration"], abs=EPSILON)
+            clock = routed_stop["end"]
+        assert clock <= shift["shift_end"] + EPSILON
+
+@pytest.mark.parametrize("window, expected", [
+    ("8-11", (8 * 60, 11 * 60)),
+    ("11-2", (11 * 60, 14 * 60)),
+    ("12-3", (12 * 60, 15 * 60)),
+    ("3-6", (15 * 60, 18 * 60)),
+])
+def test_parse_time_window_reads_afternoon_hours_as_pm(window, expected):
+    assert parse_time_window(window) == expected
+
+def test_routes_respect_time_windows_and_shift_end():
+    rng = random.Random(42)
+    technicians = [
+        technician(f"tech-{i}", BASE_LAT + rng.uniform(-0.1, 0.1), BASE_LNG + rng.uniform(-0.1, 0.1),
+                   shift_end=rng.choice([15, 16, 17]) * 60)
+        for i in range(4)
+    ]
+    stops = [
+        stop(f"stop-{i}", BASE_LAT + rng.uniform(-0.15, 0.15), BASE_LNG + rng.uniform(-0.15, 0.15),
+             duration=rng.choice([30, 45, 60, 90]), window=rng.choice(["8-11", "11-2", "12-3", "3-6", "8-5"]))
+        for i in range(40)
+    ]
+
+    result = RouteOptimizer().optimize(technicians, stops)
+
+    assert_feasible(result, technicians, stops)
+    assert sum(len(route["stops"]) for route in result["routes"]) > 0
+
+def test_late_stops_wait_for_their_window():
+    technicians = [technician("tech-1")]
+    stops = [stop("afternoon", window="3-6", duration=30)]
+
+    route = RouteOptimizer().optimize(technicians, stops)["routes"][0]
+
+    assert route["stops"][0]["start"] == 15 * 60
+    assert route["stops"][0]["wait_minutes"] > 0
+
+def test_pinned_stops_stay_with_their_technician():
+    # Both stops sit next to tech-near, but one is pinned to tech-far
+    technicians = [technician("tech-near"), technician("tech-far", BASE_LAT + 0.2, BASE_LNG + 0.2)]
+    stops = [
+        stop("pinned-far", technician_id="tech-far"),
+        stop("pinned-near", BASE_LAT + 0.001, technician_id="tech-near")
+    ]
+
+    result = RouteOptimizer().optimize(technicians, stops)
+
+    routes = {route["technician_id"]: [s["id"] for s in route["stops"]] for route in result["routes"]}
+    assert routes == {"tech-near": ["pinned-near"], "tech-far": ["pinned-far"]}
+    assert result["unassigned"] == []
+
+def test_stops_pinned_to_an_absent_technician_are_unassigned():
+    result = RouteOptimizer().optimize([technician("tech-1")], [stop("orphan", technician_id="tech-off-today")])
+
+    assert result["routes"][0]["stops"] == []
+    assert result["unassigned"] == [{"id": "orphan", "reason": "technician_unavailable"}]
+
+def test_stops_that_fit_nowhere_are_unassigned():
+    # One two-hour shift: only one of the 90-minute stops fits, and the evening stop never does
+    technicians = [technician("tech-1", shift_start=8 * 60, shift_end=10 * 60)]
+    stops = [stop("first", duration=90), stop("second", duration=90), stop("evening", window="5-7", duration=30)]
+
+    result = RouteOptimizer().optimize(technicians, stops)
+
+    assert_feasible(result, technicians, stops)
+    assert len(result["routes"][0]["stops"]) == 1
+    assert len(result["unassigned"]) == 2
+    assert {entry["reason"] for entry in result["unassigned"]} == {"no_feasible_slot"}
+    assert "evening" in [entry["id"] for entry in result["unassigned"]]